@@ -1,25 +1,52 @@
 
 from typing import Dict, Any, List, Set, Optional, Tuple
-import logging
 # from dotenv import load_dotenv
 import os
+import re
 import json
 from uuid import uuid4
-from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 
-import boto3
-
-from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from aws_clients import get_client, log_client_stats
+from log_utils import WEBSOCKET_EVENT_FIELDS, get_logger, log_verbose
+from metrics import BYTES, in_invocation, metrics_scope, put_metric, span
+from multipart_upload import (
+    MAX_MULTIPART_FILE_SIZE,
+    MultipartUploadError,
+    abort_upload,
+    check_upload_token,
+    complete_upload,
+    create_upload,
+    presign_parts,
+)
+from profiling import profile_scope, profiled
+from result_cache import cache_get
+from result_store import replay_results
+from wire_encoding import DEFAULT_ENCODING, encode_message, negotiate_encoding
+
 # load_dotenv()
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+logger = get_logger(__name__)
 
 MAX_FILE_SIZE = 10 * 1024 * 1024 # 10MB
 ALLOWED_TYPES = {'image/jpeg', 'image/jpg', 'image/png', 'application/pdf'}
 UPLOAD_DIR_NAME = 'uploads/'
+CONTENT_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$') # hex sha256, see result_cache.gen_hash
+# presigned urls are sent to the websocket in chunks of this many files
+PRESIGN_CHUNK_SIZE = int(os.getenv('PRESIGN_CHUNK_SIZE', '10'))
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+# websocket action returning the stored results of a session, see result_store.py
+REPLAY_ACTION = 'replayResults'
+# websocket actions of the multipart upload flow, see multipart_upload.py
+MULTIPART_ACTIONS = {
+    'createMultipartUpload',
+    'presignUploadParts',
+    'completeMultipartUpload',
+    'abortMultipartUpload',
+}
 
 @dataclass
 class FileObj:
@@ -27,49 +54,49 @@ class FileObj:
     filename: str
     filetype: str
     filesize: int
+    filehash: Optional[str] = None
 
 # ==================
 # S3 client Handling
 # ==================
-_s3_client: Optional[Any] = None
-_gateway_client: Optional[Any] = None
+# Clients come from the shared pooled factory in aws_clients.py. They are created
+# on first use and cached for the lifetime of the container, so warm invocations
+# reuse open connections. With PREWARM_CLIENTS=on they are created during init
+# instead, which takes them off the first request's critical path under
+# SnapStart / provisioned concurrency.
+PREWARM_CLIENTS = os.getenv('PREWARM_CLIENTS', 'off') == 'on'
 
 # Singleton pattern!
 def get_s3_client():
-    global _s3_client
-    if not _s3_client:
-        try:
-            _s3_client = boto3.client(
-                's3',
-                # Use lambda's local environment for prod
-                # region_name=os.getenv('AWS_REGION'),
-                # aws_access_key_id=os.getenv('ACCESS_KEY'),
-                # aws_secret_access_key=os.getenv('SECRET_KEY'),
-                config=Config(signature_version="s3v4")
-            )
-        except ClientError:
-            logger.error('Failed to create s3 client')
-        
-    return _s3_client
+    try:
+        # Use lambda's local environment for prod
+        return get_client('s3', signature_version='s3v4')
+    except ClientError:
+        logger.error('Failed to create s3 client')
+        return None
 
 def get_gateway_client():
-    global _gateway_client
-    if not _gateway_client:
-        _gateway_client = boto3.client(
-            'apigatewaymanagementapi', 
-            endpoint_url='https://bdoyue9pj6.execute-api.us-west-1.amazonaws.com/dev/'
-        )
-    return _gateway_client
+    return get_client(
+        'apigatewaymanagementapi',
+        endpoint_url='https://bdoyue9pj6.execute-api.us-west-1.amazonaws.com/dev/',
+        name='apigateway'
+    )
+
+
+if PREWARM_CLIENTS:
+    get_s3_client()
+    get_gateway_client()
+
 # ==================
 # Validation
 # ==================
 # Pydantic would be better....future refactor?
-def validate_file(allowed_types: Set, file_obj: FileObj) -> Tuple[bool, str]:
+def validate_file(allowed_types: Set, file_obj: FileObj, max_size: int = MAX_FILE_SIZE) -> Tuple[bool, str]:
     # smaller than max size
-    if file_obj.filesize > MAX_FILE_SIZE:
+    if file_obj.filesize > max_size:
         return (
             False,
-            f'Error: {file_obj.filename} is over the 10MB limit'
+            f'Error: {file_obj.filename} is over the {max_size // (1024 * 1024)}MB limit'
         )
     # one of the valid formats
     elif file_obj.filetype not in allowed_types:
@@ -86,15 +113,75 @@ def validate_file(allowed_types: Set, file_obj: FileObj) -> Tuple[bool, str]:
 # Helper functions for url gen
 # ============================
 def validate_file_obj(file_entry: Dict[str, Any]) -> bool:
+    if not isinstance(file_entry, dict):
+        return False
+    if 'id' not in file_entry:
+        return False
     if 'name' not in file_entry:
         return False
     if 'type' not in file_entry:
         return False
     if 'size' not in file_entry:
         return False
+    # values come straight from the client, a wrong type must reject only this file
+    if isinstance(file_entry['id'], bool) or not isinstance(file_entry['id'], (str, int)):
+        return False
+    if not isinstance(file_entry['name'], str) or not file_entry['name']:
+        return False
+    if not isinstance(file_entry['type'], str):
+        return False
+    if isinstance(file_entry['size'], bool) or not isinstance(file_entry['size'], int) or file_entry['size'] < 0:
+        return False
     return True
 
 
+def parse_file_obj(file_entry: Dict[str, Any], max_size: int = MAX_FILE_SIZE) -> Tuple[Optional[FileObj], str]:
+    # Returns the file or the reason it was rejected
+    if not validate_file_obj(file_entry):
+        return None, 'Error: incoming data is incorrect format'
+
+    file_obj = FileObj(
+        fileid=str(file_entry['id']),
+        filename=file_entry['name'],
+        filetype=file_entry['type'],
+        filesize=file_entry['size'],
+        filehash=get_content_hash(file_entry)
+    )
+    logger.info('filename: %s, filetype: %s, filesize: %s', file_obj.filename, file_obj.filetype, file_obj.filesize)
+
+    is_valid_file, error_msg = validate_file(ALLOWED_TYPES, file_obj, max_size)
+    if not is_valid_file:
+        return None, error_msg
+    return file_obj, ''
+
+
+def get_content_hash(file_entry: Dict[str, Any]) -> Optional[str]:
+    # optional client computed sha256 of the file contents
+    content_hash = file_entry.get('hash')
+    if not isinstance(content_hash, str):
+        return None
+    content_hash = content_hash.lower()
+    return content_hash if CONTENT_HASH_PATTERN.match(content_hash) else None
+
+
+def get_cached_result(content_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+    # Build the same body lambda_s3_textract sends for a processed file
+    if not content_hash:
+        return None
+    parsed_receipts = cache_get(content_hash)
+    if parsed_receipts is None:
+        return None
+    if not parsed_receipts:
+        return {
+            'statusCode': 422,
+            'error': {'message': 'No receipt data found in image.'}
+        }
+    return {
+        'statusCode': 200,
+        'data': parsed_receipts,
+    }
+
+
 def get_file_extension(filename: str) -> str:
     file_extension = filename.split('.')[-1]
     return file_extension if file_extension else ""
@@ -114,30 +201,280 @@ def create_object_key(filename: str) -> str:
     return object_key
 
 
-def generate_presigned_put_url(s3_client, bucket: str, object_key: str, connectionId:str, fileId:str, content_type: str, expires_in: int) -> Optional[str]:
+def get_session_id(body: Dict[str, Any]) -> Optional[str]:
+    # optional client generated id that survives websocket reconnects
+    session_id = body.get('sessionId')
+    if isinstance(session_id, str) and SESSION_ID_PATTERN.match(session_id):
+        return session_id
+    return None
+
+
+def get_object_metadata(connectionId: str, fileId: str, encoding: str,
+                        session_id: Optional[str] = None) -> Dict[str, str]:
+    # read back by lambda_s3_textract to route and encode the result
+    metadata = {
+        'connectionId': connectionId,
+        'fileId': fileId,
+    }
+    # only clients that negotiated an encoding send the extra header
+    if encoding != DEFAULT_ENCODING:
+        metadata['encoding'] = encoding
+    # results of a session can be replayed after a reconnect, see result_store.py
+    if session_id:
+        metadata['sessionId'] = session_id
+    return metadata
+
+
+def generate_presigned_put_url(s3_client, bucket: str, object_key: str, connectionId:str, fileId:str, content_type: str, expires_in: int, encoding: str = DEFAULT_ENCODING, session_id: Optional[str] = None) -> Optional[str]:
     try:
         url = s3_client.generate_presigned_url(
             ClientMethod='put_object',
             Params={
                 'Bucket': bucket,
                 'Key': object_key,
-                'Metadata': {
-                    'connectionId': connectionId,
-                    'fileId': fileId,
-                },
+                'Metadata': get_object_metadata(connectionId, fileId, encoding, session_id),
                 'ContentType': content_type,
             },
             ExpiresIn=expires_in
         )
         return url
     except ClientError as e:
-        logger.error(f'Failed to generate presigned url: {e}')
+        logger.error('Failed to generate presigned url: %s', e)
         return None
 
 
 
+def mint_presigned_url(s3_client, bucket: str, connectionId: str, file_obj: FileObj,
+                       encoding: str = DEFAULT_ENCODING, session_id: Optional[str] = None) -> Optional[str]:
+    object_key = create_object_key(file_obj.filename)
+    if object_key == "":
+        return None
+    return generate_presigned_put_url(
+        s3_client=s3_client,
+        bucket=bucket,
+        object_key=object_key,
+        connectionId=connectionId,
+        fileId=file_obj.fileid,
+        content_type=file_obj.filetype,
+        expires_in=3600,
+        encoding=encoding,
+        session_id=session_id
+    )
+
+
+# ==================
+# Websocket delivery
+# ==================
+@dataclass
+class PresignedUrlChunk:
+    file_urls: Dict[str, str] = field(default_factory=dict)
+    # files already processed are answered from the result cache and never uploaded
+    cached_results: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # per-file validation errors keyed by file id
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+class PresignedUrlSender:
+    """Posts presignedUrls messages in order on a background thread."""
+
+    def __init__(self, gateway_client, connectionId: str, encoding: str = DEFAULT_ENCODING,
+                 session_id: Optional[str] = None):
+        self.gateway_client = gateway_client
+        self.connectionId = connectionId
+        self.encoding = encoding
+        self.session_id = session_id
+        self.chunks_sent = 0
+        # a single worker keeps the chunks in order
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: List[Future] = []
+
+    def send(self, chunk: PresignedUrlChunk, final: bool) -> None:
+        message = {
+            'file_urls': chunk.file_urls,
+            'cached_results': chunk.cached_results,
+            'errors': chunk.errors,
+            'type': 'presignedUrls',
+            'connectionId': self.connectionId,
+            'chunk': self.chunks_sent,
+            'final': final,
+            # the client sends this back as x-amz-meta-encoding with every upload
+            'encoding': self.encoding,
+            # likewise x-amz-meta-sessionid, only when the session id was accepted
+            'sessionId': self.session_id,
+        }
+        self.chunks_sent += 1
+        self._pending.append(self._executor.submit(in_invocation(profiled(self._post)), message))
+
+    def _post(self, message: Dict[str, Any]) -> None:
+        data = json.dumps(message)
+        put_metric('frame_size', len(data), BYTES)
+        try:
+            with span('post_to_connection'):
+                self.gateway_client.post_to_connection(
+                    ConnectionId=self.connectionId,
+                    Data=data
+                )
+        except ClientError as e:
+            logger.error("Failed to send presigned url chunk %s: %s", message['chunk'], e)
+
+    def close(self) -> None:
+        """Wait until every queued chunk has been posted."""
+        for future in self._pending:
+            future.result()
+        self._executor.shutdown()
+
+
+# ================
+# Multipart upload
+# ================
+def get_upload_owner(body: Dict[str, Any], connectionId: str) -> str:
+    # uploads belong to the session, so they survive a websocket reconnect
+    session_id = get_session_id(body)
+    return f'session:{session_id}' if session_id else f'connection:{connectionId}'
+
+
+def run_multipart_action(s3_client, action: str, body: Dict[str, Any], bucket: str,
+                         connectionId: str) -> Dict[str, Any]:
+    owner = get_upload_owner(body, connectionId)
+    if action == 'createMultipartUpload':
+        encoding = negotiate_encoding(body.get('encodings'))
+        file_obj, error_msg = parse_file_obj(body.get('file'), MAX_MULTIPART_FILE_SIZE)
+        if not file_obj:
+            raise MultipartUploadError(error_msg)
+
+        cached_result = get_cached_result(file_obj.filehash)
+        if cached_result:
+            logger.info('Result cache hit for %s, skipping upload', file_obj.filename)
+            return {'fileId': file_obj.fileid, 'cached_result': cached_result}
+
+        object_key = create_object_key(file_obj.filename)
+        if object_key == "":
+            raise MultipartUploadError('Could not create object key')
+        upload = create_upload(
+            s3_client,
+            bucket,
+            object_key,
+            content_type=file_obj.filetype,
+            file_size=file_obj.filesize,
+            metadata=get_object_metadata(connectionId, file_obj.fileid, encoding, get_session_id(body)),
+            owner=owner
+        )
+        # multipart metadata is set here, so the client needs no extra header
+        return {'fileId': file_obj.fileid, 'encoding': encoding, **upload}
+
+    # every later step refers to an upload created above
+    key = body.get('key')
+    upload_id = body.get('uploadId')
+    if not isinstance(key, str) or not key.startswith(UPLOAD_DIR_NAME) or not isinstance(upload_id, str):
+        raise MultipartUploadError('Missing or invalid key / uploadId')
+    check_upload_token(key, upload_id, owner, body.get('uploadToken'))
+
+    if action == 'presignUploadParts':
+        # presign_parts and complete_upload check the shape and types of these
+        return presign_parts(s3_client, bucket, key, upload_id, body.get('partCount'), body.get('partNumbers'))
+    if action == 'completeMultipartUpload':
+        return complete_upload(
+            s3_client, bucket, key, upload_id,
+            parts=body.get('parts'),
+            part_count=body.get('partCount')
+        )
+    return abort_upload(s3_client, bucket, key, upload_id)
+
+
+def handle_multipart_action(body: Dict[str, Any], bucket: str, connectionId: str) -> Dict[str, Any]:
+    action = body['action']
+    s3_client = get_s3_client()
+    gateway_client = get_gateway_client()
+    if not s3_client:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': 'Failed to initialize S3 client'})
+        }
+
+    message: Dict[str, Any] = {
+        'type': 'multipartUpload',
+        'action': action,
+        'connectionId': connectionId,
+    }
+    try:
+        with span(action):
+            message.update(run_multipart_action(s3_client, action, body, bucket, connectionId))
+        status_code = 200
+    except MultipartUploadError as e:
+        logger.error('%s failed: %s', action, e.message)
+        message['error'] = e.message
+        status_code = e.status_code
+    except ClientError as e:
+        logger.error('%s failed: %s', action, e)
+        message['error'] = f'Error: {action} failed'
+        status_code = 500
+
+    # echo the client's file id so it can match the reply to its upload
+    if 'fileId' not in message and 'fileId' in body:
+        message['fileId'] = body['fileId']
+    gateway_client.post_to_connection(
+        ConnectionId=connectionId,
+        Data=json.dumps(message)
+    )
+
+    if 'error' in message:
+        return {
+            'statusCode': status_code,
+            'body': json.dumps({'error': message['error']})
+        }
+    return {
+        'statusCode': status_code,
+    }
+
+
+# ======
+# Replay
+# ======
+def handle_replay(body: Dict[str, Any], connectionId: str) -> Dict[str, Any]:
+    # A reconnected client (new connectionId) pulls the results it missed.
+    # Only results stored under its own session are replayed; fileIds select
+    # files of that session regardless of since.
+    session_id = get_session_id(body)
+    if not session_id:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': 'Missing sessionId'})
+        }
+    file_ids = body.get('fileIds')
+    if file_ids is not None and not (isinstance(file_ids, list) and all(isinstance(f, str) for f in file_ids)):
+        file_ids = None
+    since = body.get('since', 0)
+    if not isinstance(since, (int, float)):
+        since = 0
+
+    with span('replay_results'):
+        results = replay_results(session_id, file_ids, since)
+    put_metric('replayed_results', len(results))
+    logger.info('Replaying %d result(s) to %s', len(results), connectionId)
+
+    message = {
+        'type': 'extractText',
+        'replay': True,
+        'results': results,
+    }
+    gateway_client = get_gateway_client()
+    for frame in encode_message(message, negotiate_encoding(body.get('encodings'))):
+        put_metric('frame_size', len(frame), BYTES)
+        with span('post_to_connection'):
+            gateway_client.post_to_connection(
+                ConnectionId=connectionId,
+                Data=frame
+            )
+
+    return {
+        'statusCode': 200,
+    }
+
+
+@profile_scope('accept-files-dev')
+@metrics_scope('accept-files-dev')
 def lambda_handler(event: Dict[str, Any], context) -> Dict[str, Any]:
-    logger.info(f'Event: {event}')
+    log_verbose(logger, 'Event', event, WEBSOCKET_EVENT_FIELDS)
     bucket = os.getenv('BUCKET_NAME')
     if not bucket:
         return {
@@ -147,7 +484,12 @@ def lambda_handler(event: Dict[str, Any], context) -> Dict[str, Any]:
     
 
     body = json.loads(event['body'])
-    if 'files' not in body:
+    if body.get('action') in MULTIPART_ACTIONS:
+        return handle_multipart_action(body, bucket, event['requestContext']['connectionId'])
+    if body.get('action') == REPLAY_ACTION:
+        return handle_replay(body, event['requestContext']['connectionId'])
+
+    if not isinstance(body.get('files'), list):
         return {
             'statusCode': 400,
             'body': json.dumps({'error': 'Missing files array'})
@@ -169,67 +511,66 @@ def lambda_handler(event: Dict[str, Any], context) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Failed to initialize gateway client'})
         }
 
-    presigned_urls: Dict[str, str] = {}
-    for file_data in files:
-        if not validate_file_obj(file_data):
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'Error: incoming data is incorrect format'})
-            }
-
-        # file_obj must have the expected fields
-        fileid = file_data['id']
-        filename = file_data['name']
-        filetype = file_data['type']
-        filesize = file_data['size']
-
-        logger.info(f'filename: {filename}, filetype: {filetype}, filesize: {filesize}')
-        file_obj = FileObj(
-            fileid=fileid,
-            filename=filename,
-            filetype=filetype,
-            filesize=filesize
-        )
-
-        is_valid_file, error_msg = validate_file(ALLOWED_TYPES, file_obj)
-
-        if not is_valid_file:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': error_msg})
-            }
-
-        object_key = create_object_key(filename)
-        if object_key == "":
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'Could not create object key'})
-            }
-
-        url = generate_presigned_put_url(
-            s3_client=s3_client, 
-            bucket=bucket, 
-            object_key=object_key, 
-            connectionId=connectionId,
-            fileId=fileid,
-            content_type=filetype,
-            expires_in=3600
-        )
-
-        if url:
-            presigned_urls[filename] = url
-        
-    gateway_client.post_to_connection(
-        ConnectionId = connectionId,
-        Data = json.dumps(
-            {
-                'file_urls': presigned_urls,
-                'type': 'presignedUrls',
-                'connectionId': connectionId
-            }
-        )
-    )
-
+    # URLs are minted on this thread while finished chunks are posted to the
+    # websocket in the background, so the browser can start uploading the
+    # first files while the rest are still being signed
+    # results come back in the most compact encoding the client can decode
+    encoding = negotiate_encoding(body.get('encodings'))
+    session_id = get_session_id(body)
+    sender = PresignedUrlSender(gateway_client, connectionId, encoding, session_id)
+    chunk = PresignedUrlChunk()
+    errors: Dict[str, str] = {}
+    presigned_count = 0
+    cached_count = 0
+    try:
+        for index, file_data in enumerate(files):
+            file_obj, error_msg = parse_file_obj(file_data)
+            if not file_obj:
+                # keyed by id when the client sent one, else by position in files
+                file_key = str(file_data.get('id', index)) if isinstance(file_data, dict) else str(index)
+                chunk.errors[file_key] = error_msg
+                errors[file_key] = error_msg
+                continue
+
+            with span('cache_get'):
+                cached_result = get_cached_result(file_obj.filehash)
+            if cached_result:
+                logger.info('Result cache hit for %s, skipping upload', file_obj.filename)
+                chunk.cached_results[file_obj.fileid] = cached_result
+                cached_count += 1
+                continue
+
+            with span('presign'):
+                url = mint_presigned_url(s3_client, bucket, connectionId, file_obj, encoding, session_id)
+            if not url:
+                error_msg = f'Error: could not create upload url for {file_obj.filename}'
+                chunk.errors[file_obj.fileid] = error_msg
+                errors[file_obj.fileid] = error_msg
+                continue
+
+            chunk.file_urls[file_obj.filename] = url
+            presigned_count += 1
+            if len(chunk.file_urls) >= PRESIGN_CHUNK_SIZE:
+                sender.send(chunk, final=False)
+                chunk = PresignedUrlChunk()
+
+        # the final chunk is always sent so the client knows the batch is complete
+        sender.send(chunk, final=True)
+    finally:
+        sender.close()
+    log_client_stats()
+
+    put_metric('files', len(files))
+    put_metric('presigned_urls', presigned_count)
+    put_metric('cached_files', cached_count)
+    put_metric('rejected_files', len(errors))
+    logger.info('%d url(s) minted, %d cache hit(s), %d error(s)', presigned_count, cached_count, len(errors))
     return {
-        'statusCode': 200,
+        # only a request where every file was rejected is a bad request
+        'statusCode': 400 if files and len(errors) == len(files) else 200,
+        'body': json.dumps({
+            'presigned': presigned_count,
+            'cached': cached_count,
+            'errors': errors,
+        })
     }
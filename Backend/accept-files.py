@@ -4,19 +4,35 @@ Lambda function to give permission to frontend to upload files to s3.
 # Refactored + better version in accept-files-dev.py
 # This file will be deleted later
 import logging
-import boto3
 from botocore.exceptions import ClientError
-from botocore.config import Config
 import os
 from dotenv import load_dotenv
 import json
 import uuid
 
+from aws_clients import get_client
+from log_utils import get_logger
+from metrics import metrics_scope, put_metric, span
+
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
+
+
+def get_s3_client():
+    # Shared across invocations so presign calls reuse the pooled client
+    return get_client(
+        's3',
+        client_kwargs={
+            'region_name': 'us-west-1',
+            'aws_access_key_id': os.getenv('ACCESS_KEY'),
+            'aws_secret_access_key': os.getenv('SECRET_KEY'),
+        },
+        signature_version='s3v4'
+    )
 
 
+@metrics_scope('accept-files')
 def lambda_handler(event, context):
     # file data is received from the event
     bucket_name = os.getenv('BUCKET_NAME')
@@ -26,13 +42,7 @@ def lambda_handler(event, context):
             'statusCode': 400,
             'body': 'Server is missing bucket name'
         }
-    s3_client = boto3.client(
-        "s3",
-        region_name='us-west-1',
-        aws_access_key_id=os.getenv('ACCESS_KEY'),
-        aws_secret_access_key=os.getenv('SECRET_KEY'),
-        config=Config(signature_version="s3v4")
-    )
+    s3_client = get_s3_client()
 
 
     presigned_urls = {}
@@ -54,8 +64,10 @@ def lambda_handler(event, context):
 
         new_uuid = str(uuid.uuid4())
         s3_object_key = f"receipt_{new_uuid}"
-        url = generate_presigned_put(s3_client, bucket_name, s3_object_key, 3600)
+        with span('presign'):
+            url = generate_presigned_put(s3_client, bucket_name, s3_object_key, 3600)
         presigned_urls[file['name']] = url
+    put_metric('presigned_urls', len(presigned_urls))
     return {
         'statusCode': 200,
         'body': json.dumps({'file_urls': presigned_urls})
@@ -63,15 +75,7 @@ def lambda_handler(event, context):
 
 
 
-# # later. need for cacheing
-# def gen_hash():
-#     # generate hash of the file based on it's name, size, data, and metadata
-#     pass
-
-# def check_cache(hash):
-#     # check dynamodb to see if the current file has been processed within the last 24 hours
-#     # return a json: {True, data} or {False, blah blah}
-#     pass
+# Content hashing and the result cache live in result_cache.py (gen_hash, get_result_cache)
 
 
 
@@ -95,7 +99,7 @@ def generate_presigned_put(s3_client, bucket, key, expires_in):
             ExpiresIn=expires_in,
         )
     except ClientError:
-        print(f"Couldn't get a presigned POST URL '.")
+        logger.error(f"Couldn't get a presigned PUT URL for {key}")
         raise
     return url
 
@@ -103,13 +107,7 @@ def main():
     # for local testing
     bucket_name = os.getenv('BUCKET_NAME')
     s3_object_key = "finalpythontest.txt"
-    s3_client = boto3.client(
-        "s3",
-        region_name='us-west-1',
-        aws_access_key_id=os.getenv('ACCESS_KEY'),
-        aws_secret_access_key=os.getenv('SECRET_KEY'),
-        config=Config(signature_version="s3v4")
-    )
+    s3_client = get_s3_client()
     
     # The presigned URL is specified to expire in 1000 seconds
     url = generate_presigned_put(
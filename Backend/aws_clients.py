@@ -0,0 +1,190 @@
+"""
+Shared factory for pooled boto3 clients.
+
+Every handler gets its clients from get_client so that within one container:
+    - a single botocore session is reused (credentials, endpoint and service
+      model data are loaded once)
+    - each distinct client is created once and cached; its HTTP connection
+      pool is sized for the concurrency of the caller, so warm invocations
+      reuse open TLS connections instead of handshaking on every call
+    - TCP keep-alive and explicit connect/read timeouts are applied everywhere
+    - request latency is recorded per client and exposed with client_stats()
+
+boto3 is imported on first use so that importing a handler stays cheap.
+
+Environment:
+    AWS_CONNECT_TIMEOUT      seconds to establish a connection (default 3)
+    AWS_READ_TIMEOUT         seconds to wait for a response (default 30)
+    AWS_MAX_POOL_CONNECTIONS default connection pool size (default 10)
+    AWS_TCP_KEEPALIVE        'on' / 'off' (default on)
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from log_utils import get_logger
+from metrics import percentile
+
+logger = get_logger(__name__)
+
+CONNECT_TIMEOUT = float(os.getenv('AWS_CONNECT_TIMEOUT', '3'))  # seconds
+READ_TIMEOUT = float(os.getenv('AWS_READ_TIMEOUT', '30'))  # seconds
+DEFAULT_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '10'))
+TCP_KEEPALIVE = os.getenv('AWS_TCP_KEEPALIVE', 'on') == 'on'
+
+# Latencies kept per client for percentiles
+LATENCY_WINDOW = 1000
+
+_session: Optional[Any] = None
+_clients: Dict[Tuple, Any] = {}
+_stats: Dict[str, 'ClientStats'] = {}
+# boto3 session and client creation are not thread safe
+_lock = threading.Lock()
+
+
+class ClientStats:
+    """Request count, errors and latency of one client."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms: float, error: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            self._recent.append(elapsed_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the counters and the p50/p95 latency of the recent window."""
+        with self._lock:
+            recent = list(self._recent)
+            requests = self.requests
+            summary = {
+                'requests': requests,
+                'errors': self.errors,
+                'avg_ms': round(self.total_ms / requests, 2) if requests else 0.0,
+                'max_ms': round(self.max_ms, 2),
+            }
+
+        if recent:
+            summary['p50_ms'] = round(percentile(recent, 50), 2)
+            summary['p95_ms'] = round(percentile(recent, 95), 2)
+        return summary
+
+
+def get_session():
+    """Return the boto3 session shared by every client in this process."""
+    global _session
+    if not _session:
+        with _lock:
+            if not _session:
+                import boto3
+                _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service: str, pool_size: Optional[int] = None, endpoint_url: Optional[str] = None,
+               name: Optional[str] = None, client_kwargs: Optional[Dict[str, Any]] = None,
+               **config_options):
+    """
+    Return the cached client for a service, creating it on first use.
+
+    Clients are cached by all of their arguments, so callers asking for the
+    same configuration share one client and its connection pool.
+
+    Args:
+        service: boto3 service name, e.g. 's3'
+        pool_size: Maximum pooled HTTP connections, should match the number of
+            threads using the client (default AWS_MAX_POOL_CONNECTIONS)
+        endpoint_url: Custom endpoint, e.g. an API Gateway websocket stage
+        name: Name the latency stats are reported under (default service)
+        client_kwargs: Extra boto3 client arguments (region_name, credentials)
+        **config_options: Extra botocore Config options, e.g. signature_version or retries
+
+    Returns:
+        Boto3 client
+    """
+    pool_size = pool_size or DEFAULT_POOL_CONNECTIONS
+    name = name or service
+    client_kwargs = client_kwargs or {}
+    cache_key = (
+        service, pool_size, endpoint_url, name,
+        repr(sorted(client_kwargs.items())), repr(sorted(config_options.items()))
+    )
+
+    client = _clients.get(cache_key)
+    if client:
+        return client
+
+    session = get_session()
+    with _lock:
+        client = _clients.get(cache_key)
+        if client:
+            return client
+
+        from botocore.config import Config
+
+        config = Config(
+            max_pool_connections=pool_size,
+            connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=READ_TIMEOUT,
+            tcp_keepalive=TCP_KEEPALIVE,
+            **config_options
+        )
+        client = session.client(service, endpoint_url=endpoint_url, config=config, **client_kwargs)
+        _register_latency_hooks(client, _stats.setdefault(name, ClientStats(name)))
+        _clients[cache_key] = client
+        logger.info('Created %s client (pool size %s)', name, pool_size)
+    return client
+
+
+def _register_latency_hooks(client, stats: ClientStats) -> None:
+    """Time every API call of client, retries included."""
+    # before-call and after-call receive the same per-request context dict
+    def start(context, **kwargs):
+        context['latency_start'] = time.perf_counter()
+
+    def finish(context, exception=None, **kwargs):
+        started = context.pop('latency_start', None)
+        if started is None:
+            return
+        http_response = kwargs.get('http_response')
+        error = exception is not None or (http_response is not None and http_response.status_code >= 400)
+        stats.record((time.perf_counter() - started) * 1000, error)
+
+    events = client.meta.events
+    events.register('before-call', start)
+    events.register('after-call', finish)
+    events.register('after-call-error', finish)
+
+
+def client_stats() -> Dict[str, Dict[str, Any]]:
+    """Return the latency stats of every client, keyed by client name."""
+    return {name: stats.snapshot() for name, stats in list(_stats.items())}
+
+
+def log_client_stats() -> None:
+    """Log the latency stats of every client that made requests."""
+    for name, summary in client_stats().items():
+        if summary['requests']:
+            logger.info('AWS client %s: %s', name, summary)
+
+
+def reset_clients() -> None:
+    """Drop every cached client, session and stat (e.g. after a fork or in tests)."""
+    global _session
+    with _lock:
+        _clients.clear()
+        _stats.clear()
+        _session = None
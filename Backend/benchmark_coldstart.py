@@ -0,0 +1,173 @@
+"""
+Cold start measurement harness for the lambda handlers.
+
+Every run starts a fresh Python process (like a new Lambda container) that
+imports a handler module and invokes it twice with a sample event. It reports:
+    import_ms  - time to import the handler module (Lambda init phase)
+    first_ms   - time to the first response (client creation, first calls)
+    warm_ms    - time of a second, warm invocation
+
+AWS is never contacted: botocore's HTTP send is replaced with canned
+responses, so the numbers cover Python-side work (imports, client creation,
+signing, parsing) only.
+
+Usage:
+    python benchmark_coldstart.py --runs 10
+    PREWARM_CLIENTS=on python benchmark_coldstart.py
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HANDLERS = {
+    'lambda_s3_textract': {
+        'file': 'lambda_s3_textract.py',
+        'event': {
+            'Records': [
+                {'s3': {'bucket': {'name': 'receipts'}, 'object': {'key': 'uploads/receipt_1.jpg'}}}
+            ]
+        },
+    },
+    'accept-files-dev': {
+        'file': 'accept-files-dev.py',
+        'event': {
+            'body': json.dumps({
+                'files': [{'id': '1', 'name': 'receipt.jpg', 'type': 'image/jpeg', 'size': 1024}]
+            }),
+            'requestContext': {'connectionId': 'coldstart'},
+        },
+    },
+}
+
+CHILD_ENV = {
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_DEFAULT_REGION': 'us-west-1',
+    'BUCKET_NAME': 'receipts',
+    'RESULT_CACHE_BACKEND': 'none',
+    # keep the Textract rate limiter from spacing out the warm invocation
+    'TEXTRACT_RATE_LIMIT': '1000',
+}
+
+
+# ==================
+# Child process
+# ==================
+class _FakeRaw:
+    """Minimal urllib3 response stand-in for botocore.awsrequest.AWSResponse."""
+
+    def __init__(self, body: bytes):
+        self._body = body
+        self._read = False
+
+    def stream(self, *args, **kwargs):
+        yield self.read()
+
+    def read(self, *args, **kwargs) -> bytes:
+        if self._read:
+            return b''
+        self._read = True
+        return self._body
+
+
+def _fake_send(endpoint, request):
+    """Replacement for botocore.endpoint.Endpoint._send returning canned responses."""
+    from botocore.awsrequest import AWSResponse
+    from fake_textract import sample_expense_response
+
+    headers: Dict[str, str] = {}
+    body = b''
+    if 'textract' in request.url:
+        headers['Content-Type'] = 'application/x-amz-json-1.1'
+        body = json.dumps(sample_expense_response()).encode()
+    elif 'execute-api' not in request.url:
+        # S3 head_object / get_object
+        body = b'not a real image'
+        headers.update({
+            'Content-Type': 'image/jpeg',
+            'Content-Length': str(len(body)),
+            'x-amz-meta-connectionid': 'coldstart',
+            'x-amz-meta-fileid': '1',
+        })
+        if request.method == 'HEAD':
+            body = b''
+
+    return AWSResponse(request.url, 200, headers, _FakeRaw(body))
+
+
+def run_child(name: str) -> Dict[str, float]:
+    """Import and invoke one handler in this (fresh) process."""
+    handler = HANDLERS[name]
+    sys.path.insert(0, BACKEND_DIR)
+
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(BACKEND_DIR, handler['file']))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    import_ms = (time.perf_counter() - start) * 1000
+
+    import botocore.endpoint
+    botocore.endpoint.Endpoint._send = _fake_send
+
+    start = time.perf_counter()
+    module.lambda_handler(handler['event'], None)
+    first_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    module.lambda_handler(handler['event'], None)
+    warm_ms = (time.perf_counter() - start) * 1000
+
+    return {'import_ms': import_ms, 'first_ms': first_ms, 'warm_ms': warm_ms}
+
+
+# ==================
+# Parent process
+# ==================
+def measure(name: str, runs: int) -> Dict[str, List[float]]:
+    env = {**os.environ, **CHILD_ENV}
+    samples: Dict[str, List[float]] = {'import_ms': [], 'first_ms': [], 'warm_ms': []}
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', name],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        for key in samples:
+            samples[key].append(result[key])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per handler')
+    parser.add_argument('--handler', choices=sorted(HANDLERS), action='append',
+                        help='handler to measure (default: all)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child)))
+        return
+
+    header = f"{'handler':<22}{'import ms':>12}{'first ms':>12}{'cold total':>12}{'warm ms':>12}"
+    print(header)
+    print('-' * len(header))
+    for name in args.handler or sorted(HANDLERS):
+        samples = measure(name, args.runs)
+        import_ms = statistics.median(samples['import_ms'])
+        first_ms = statistics.median(samples['first_ms'])
+        warm_ms = statistics.median(samples['warm_ms'])
+        print(f"{name:<22}{import_ms:>12.1f}{first_ms:>12.1f}{import_ms + first_ms:>12.1f}{warm_ms:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
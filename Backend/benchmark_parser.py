@@ -0,0 +1,172 @@
+"""
+Micro-benchmarks for the Textract response parser in lambda_s3_textract.
+
+Runs parse_extracted_text (fast and strict pydantic mode), parse_lineitemgroups
+and parse_summaryfields on synthetic responses (synthetic_textract.py) of
+increasing size and reports time per call, peak traced memory and allocated
+blocks. Before timing, the fast and strict parsers are checked to produce
+identical output. Results can be saved and compared against an earlier run,
+so parser regressions show up before deploy:
+
+    python benchmark_parser.py --save baseline.json
+    # ... change the parser ...
+    python benchmark_parser.py --compare baseline.json --max-regression 0.2
+"""
+
+import argparse
+import gc
+import json
+import logging
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import lambda_s3_textract as parser_module
+from synthetic_textract import generate_expense_response
+
+# (documents, line items per document)
+SIZES: List[Tuple[int, int]] = [(1, 10), (1, 100), (1, 1000), (10, 100)]
+# share of generated line items that fail validation, to exercise the skip path
+INVALID_LINE_ITEMS = 0.05
+
+
+def get_targets() -> Dict[str, Callable[[Dict[str, Any]], Any]]:
+    """Return the parser entry points to benchmark, keyed by name."""
+    def lineitems(response: Dict[str, Any]) -> Any:
+        return [parser_module.parse_lineitemgroups(doc['LineItemGroups'])
+                for doc in response['ExpenseDocuments']]
+
+    def summaryfields(response: Dict[str, Any]) -> Any:
+        return [parser_module.parse_summaryfields(doc['SummaryFields'])
+                for doc in response['ExpenseDocuments']]
+
+    def strict(response: Dict[str, Any]) -> Any:
+        return parser_module.parse_extracted_text(response, strict=True)
+
+    return {
+        'parse_extracted_text': lambda response: parser_module.parse_extracted_text(response, strict=False),
+        'parse_extracted_text_strict': strict,
+        'parse_lineitemgroups': lineitems,
+        'parse_summaryfields': summaryfields,
+    }
+
+
+def measure_time(func: Callable[[Dict[str, Any]], Any], response: Dict[str, Any],
+                 repeat: int) -> Dict[str, float]:
+    """Time func(response), auto-scaling the loop count so each sample takes ~0.1s."""
+    timer = timeit.Timer(lambda: func(response))
+    loops, _ = timer.autorange()
+    loops = max(1, loops // 2)
+    samples = [t / loops for t in timer.repeat(repeat=repeat, number=loops)]
+    return {
+        'min_us': min(samples) * 1e6,
+        'median_us': statistics.median(samples) * 1e6,
+    }
+
+
+def measure_memory(func: Callable[[Dict[str, Any]], Any], response: Dict[str, Any]) -> Dict[str, float]:
+    """Measure peak traced memory and allocated blocks of a single func(response) call."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        result = func(response)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    allocated_blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    del result
+    return {
+        'peak_kb': (peak - baseline) / 1024,
+        'allocated_blocks': allocated_blocks,
+    }
+
+
+def check_equivalence(response: Dict[str, Any]) -> None:
+    """Fail loudly if the fast parser's output differs from strict mode."""
+    fast = parser_module.parse_extracted_text(response, strict=False)
+    strict = parser_module.parse_extracted_text(response, strict=True)
+    if json.dumps(fast) != json.dumps(strict):
+        raise AssertionError('fast and strict parse_extracted_text outputs differ')
+
+
+def run(repeat: int) -> Dict[str, Dict[str, float]]:
+    """Benchmark every target on every size, keyed by 'target[documents x items]'."""
+    results: Dict[str, Dict[str, float]] = {}
+    for documents, line_items in SIZES:
+        response = generate_expense_response(
+            documents=documents,
+            line_items=line_items,
+            invalid_line_items=INVALID_LINE_ITEMS
+        )
+        check_equivalence(response)
+        for name, func in get_targets().items():
+            case = f'{name}[{documents}x{line_items}]'
+            results[case] = {**measure_time(func, response, repeat), **measure_memory(func, response)}
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> None:
+    header = f"{'case':<44}{'min us':>12}{'median us':>12}{'peak KB':>10}{'blocks':>10}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+    print('-' * len(header))
+    for case, stats in results.items():
+        line = (f"{case:<44}{stats['min_us']:>12.1f}{stats['median_us']:>12.1f}"
+                f"{stats['peak_kb']:>10.1f}{stats['allocated_blocks']:>10.0f}")
+        if case in baseline:
+            change = stats['min_us'] / baseline[case]['min_us'] - 1
+            line += f"{change:>+10.1%}"
+        print(line)
+
+
+def find_regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                     max_regression: float) -> List[str]:
+    """Return the cases whose min time grew by more than max_regression over baseline."""
+    return [
+        case for case, stats in results.items()
+        if case in baseline and stats['min_us'] > baseline[case]['min_us'] * (1 + max_regression)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='timing samples per case')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='fail when a case is this much slower than --compare (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    # parser warnings about skipped rows would drown the report
+    logging.disable(logging.WARNING)
+
+    results = run(args.repeat)
+
+    baseline: Dict[str, Dict[str, float]] = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'created': time.time(), 'python': sys.version, 'results': results}, f, indent=2)
+
+    regressions = find_regressions(results, baseline, args.max_regression)
+    if regressions:
+        print(f"\nRegressions over {args.max_regression:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark image preprocessing (image_preprocess.py) against real Textract.
+
+Every sample receipt is analyzed twice, once as uploaded and once after
+preprocessing, and the payload size, Textract latency and parsed output are
+compared. Accuracy is measured against a ground truth file next to the image
+(receipt.jpg -> receipt.json, holding the parse_extracted_text output) when
+one exists, otherwise against the result for the original image.
+
+Usage:
+    python benchmark_preprocess.py samples/ --runs 3 --max-dpi 200
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import textract
+from image_preprocess import PREPROCESS_MAX_DPI, PREPROCESS_QUALITY, preprocess_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def find_samples(paths: List[str]) -> List[str]:
+    """Expand directories into the receipt images they contain."""
+    samples: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for extension in IMAGE_EXTENSIONS:
+                samples.extend(glob.glob(os.path.join(path, f'*{extension}')))
+        else:
+            samples.append(path)
+    return sorted(samples)
+
+
+def analyze(image_bytes: bytes, runs: int) -> Tuple[List[float], List[Dict[str, Any]]]:
+    """Call Textract runs times, returning the latencies and the parsed receipts."""
+    latencies: List[float] = []
+    parsed: List[Dict[str, Any]] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = textract.client.analyze_expense(Document={'Bytes': image_bytes})
+        latencies.append(time.perf_counter() - start)
+        parsed = textract.parse_extracted_text(response)
+    return latencies, parsed
+
+
+def field_accuracy(expected: List[Dict[str, Any]], actual: List[Dict[str, Any]]) -> float:
+    """
+    Score how well actual matches expected, from 0 to 1.
+
+    Summary fields (store_name, date, total) count one point each when equal,
+    line items are scored by the F1 of matching (item_name, price) pairs.
+    """
+    if not expected:
+        return 1.0 if not actual else 0.0
+    if not actual:
+        return 0.0
+
+    expected_receipt, actual_receipt = expected[0], actual[0]
+    summary_keys = ('store_name', 'date', 'total')
+    summary_hits = sum(expected_receipt.get(k) == actual_receipt.get(k) for k in summary_keys)
+
+    expected_items = {(i['item_name'], i['price']) for i in expected_receipt.get('items', [])}
+    actual_items = {(i['item_name'], i['price']) for i in actual_receipt.get('items', [])}
+    if expected_items or actual_items:
+        matched = len(expected_items & actual_items)
+        item_score = 2 * matched / (len(expected_items) + len(actual_items))
+    else:
+        item_score = 1.0
+
+    return (summary_hits + item_score) / (len(summary_keys) + 1)
+
+
+def load_ground_truth(sample: str) -> Optional[List[Dict[str, Any]]]:
+    truth_file = os.path.splitext(sample)[0] + '.json'
+    if not os.path.exists(truth_file):
+        return None
+    with open(truth_file) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='receipt images or directories of them')
+    parser.add_argument('--runs', type=int, default=3, help='Textract calls per variant')
+    parser.add_argument('--max-dpi', type=int, default=PREPROCESS_MAX_DPI)
+    parser.add_argument('--quality', type=int, default=PREPROCESS_QUALITY)
+    args = parser.parse_args()
+
+    rows = []
+    for sample in find_samples(args.paths):
+        with open(sample, 'rb') as f:
+            original = f.read()
+
+        start = time.perf_counter()
+        processed = preprocess_image(original, max_dpi=args.max_dpi, quality=args.quality, enabled=True)
+        preprocess_time = time.perf_counter() - start
+        processed = processed or original
+
+        original_latencies, original_parsed = analyze(original, args.runs)
+        processed_latencies, processed_parsed = analyze(processed, args.runs)
+
+        reference = load_ground_truth(sample)
+        if reference is None:
+            reference = original_parsed
+
+        rows.append({
+            'file': os.path.basename(sample),
+            'original_kb': len(original) / 1024,
+            'processed_kb': len(processed) / 1024,
+            'preprocess_ms': preprocess_time * 1000,
+            'original_ms': statistics.median(original_latencies) * 1000,
+            'processed_ms': statistics.median(processed_latencies) * 1000,
+            'original_acc': field_accuracy(reference, original_parsed),
+            'processed_acc': field_accuracy(reference, processed_parsed),
+        })
+
+    if not rows:
+        print('No sample receipts found')
+        return
+
+    header = f"{'file':<30}{'orig KB':>10}{'proc KB':>10}{'prep ms':>10}{'orig ms':>10}{'proc ms':>10}{'orig acc':>10}{'proc acc':>10}"
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        print(
+            f"{row['file'][:29]:<30}{row['original_kb']:>10.0f}{row['processed_kb']:>10.0f}"
+            f"{row['preprocess_ms']:>10.0f}{row['original_ms']:>10.0f}{row['processed_ms']:>10.0f}"
+            f"{row['original_acc']:>10.2f}{row['processed_acc']:>10.2f}"
+        )
+
+    def mean(key: str) -> float:
+        return statistics.mean(row[key] for row in rows)
+
+    print('-' * len(header))
+    print(
+        f"{'mean':<30}{mean('original_kb'):>10.0f}{mean('processed_kb'):>10.0f}"
+        f"{mean('preprocess_ms'):>10.0f}{mean('original_ms'):>10.0f}{mean('processed_ms'):>10.0f}"
+        f"{mean('original_acc'):>10.2f}{mean('processed_acc'):>10.2f}"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""
+In-process stand-ins for the S3 and API Gateway websocket clients.
+
+Together with fake_textract.py they let the upload -> extract -> notify flow
+run without AWS (see load_test.py):
+
+    FakeS3       presigns PUT urls, accepts uploads through them with the
+                 signature, expiry, content type and metadata headers checked
+                 like S3 does, and emits an object-created event for every
+                 stored object
+    FakeGateway  counts post_to_connection calls, keeps the latest ones and
+                 hands each message to the listener of its connection
+
+FakeS3 keeps objects in memory, or in a directory when given storage_dir, which
+is how local_service.py stores uploads.
+
+    s3 = FakeS3(on_object_created=lambda record: lambda_handler({'Records': [record]}, None))
+    accept_files_dev.get_s3_client = lambda: s3
+"""
+
+import hashlib
+import hmac
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from urllib.parse import parse_qs, quote, quote_plus, unquote, urlencode, urlsplit
+from uuid import uuid4
+
+
+def client_error(code: str, operation: str, message: str = '') -> Exception:
+    """Build the botocore ClientError an AWS service would raise."""
+    from botocore.exceptions import ClientError
+
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+
+# ==================
+# S3
+# ==================
+class FakeS3:
+    """
+    Fake S3 client holding objects in memory or in a local directory.
+
+    Args:
+        on_object_created: Called with an S3 event record after every upload
+        latency: Seconds every head_object / get_object call takes
+        endpoint_url: Base of the presigned urls, which are path style
+            (<endpoint_url>/<bucket>/<key>)
+        storage_dir: Keep object bodies and metadata in this directory
+            instead of in memory
+    """
+
+    def __init__(self, on_object_created: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 latency: float = 0.0, endpoint_url: str = 'https://s3.localhost',
+                 storage_dir: Optional[str] = None):
+        self.on_object_created = on_object_created
+        self.latency = latency
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.storage_dir = os.path.abspath(storage_dir) if storage_dir else None
+        self.objects: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.calls: Dict[str, int] = {}
+        # uploads presigned before a restart stay valid when the secret is set
+        self._secret = os.getenv('FAKE_S3_SECRET', '').encode() or uuid4().bytes
+        self._lock = threading.Lock()
+
+    def _record_call(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _sign(self, bucket: str, key: str, expires: int, headers: Dict[str, str]) -> str:
+        signed = '\n'.join([bucket, key, str(expires), *(f'{name}:{headers[name]}' for name in sorted(headers))])
+        return hmac.new(self._secret, signed.encode(), hashlib.sha256).hexdigest()
+
+    # presigned uploads
+    def generate_presigned_url(self, ClientMethod: str, Params: Dict[str, Any], ExpiresIn: int = 3600,
+                               **kwargs) -> str:
+        if ClientMethod != 'put_object':
+            raise NotImplementedError(f'FakeS3 cannot presign {ClientMethod}')
+        self._record_call('generate_presigned_url')
+        bucket, key = Params['Bucket'], Params['Key']
+        # like SigV4, the content type and every metadata header are signed
+        headers = {f'x-amz-meta-{name.lower()}': value for name, value in Params.get('Metadata', {}).items()}
+        if 'ContentType' in Params:
+            headers['content-type'] = Params['ContentType']
+        expires = int(time.time()) + ExpiresIn
+        query = urlencode({
+            'X-Amz-Expires': expires,
+            'X-Amz-SignedHeaders': ';'.join(sorted(headers)),
+            'X-Amz-Signature': self._sign(bucket, key, expires, headers),
+        })
+        return f'{self.endpoint_url}/{bucket}/{quote(key)}?{query}'
+
+    def put_presigned(self, url: str, body: bytes, headers: Optional[Dict[str, str]] = None) -> int:
+        """
+        Upload through a presigned url, as a browser PUT would.
+
+        Returns:
+            HTTP status: 200 when stored, 403 when the signature does not match
+            or the url expired
+        """
+        self._record_call('put_presigned')
+        parts = urlsplit(url)
+        path = unquote(parts.path)[len(urlsplit(self.endpoint_url).path):].lstrip('/')
+        if '/' not in path:
+            return 403
+        bucket, key = path.split('/', 1)
+        query = {name: values[0] for name, values in parse_qs(parts.query, keep_blank_values=True).items()}
+
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        signed_names = [name for name in query.get('X-Amz-SignedHeaders', '').split(';') if name]
+        if any(name not in headers for name in signed_names):
+            return 403
+        expires = int(query.get('X-Amz-Expires', 0))
+        signature = self._sign(bucket, key, expires, {name: headers[name] for name in signed_names})
+        if not hmac.compare_digest(signature, query.get('X-Amz-Signature', '')) or time.time() > expires:
+            return 403
+
+        metadata = {name[len('x-amz-meta-'):]: value for name, value in headers.items()
+                    if name.startswith('x-amz-meta-')}
+        self.put_object(Bucket=bucket, Key=key, Body=body,
+                        ContentType=headers.get('content-type', 'binary/octet-stream'), Metadata=metadata)
+        return 200
+
+    # regular client methods
+    def put_object(self, Bucket: str, Key: str, Body: bytes = b'', ContentType: str = 'binary/octet-stream',
+                   Metadata: Optional[Dict[str, str]] = None, **kwargs) -> Dict[str, Any]:
+        self._record_call('put_object')
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        stored = {
+            'Body': Body,
+            'ContentType': ContentType,
+            # S3 returns metadata keys in lower case
+            'Metadata': {name.lower(): value for name, value in (Metadata or {}).items()},
+            'ETag': etag,
+        }
+        if self.storage_dir:
+            self._write(Bucket, Key, stored)
+        else:
+            with self._lock:
+                self.objects[(Bucket, Key)] = stored
+        if self.on_object_created:
+            self.on_object_created({
+                'eventSource': 'aws:s3',
+                'eventName': 'ObjectCreated:Put',
+                's3': {
+                    'bucket': {'name': Bucket},
+                    'object': {'key': quote_plus(Key), 'size': len(Body), 'eTag': etag.strip('"')},
+                },
+            })
+        return {'ETag': etag}
+
+    def _get(self, bucket: str, key: str, operation: str) -> Dict[str, Any]:
+        if self.storage_dir:
+            stored = self._read(bucket, key)
+        else:
+            with self._lock:
+                stored = self.objects.get((bucket, key))
+        if stored is None:
+            raise client_error('NoSuchKey', operation)
+        return stored
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.storage_dir, bucket, key))
+        if not path.startswith(os.path.join(self.storage_dir, '')):
+            raise client_error('InvalidObjectName', 'PutObject', f'{bucket}/{key} is outside the storage directory')
+        return path
+
+    def _write(self, bucket: str, key: str, stored: Dict[str, Any]) -> None:
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the metadata is written last, an object without it is not visible yet
+        with open(path, 'wb') as f:
+            f.write(stored['Body'])
+        with open(f'{path}.metadata.json', 'w') as f:
+            json.dump({name: value for name, value in stored.items() if name != 'Body'}, f)
+
+    def _read(self, bucket: str, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(bucket, key)
+        try:
+            with open(f'{path}.metadata.json') as f:
+                stored = json.load(f)
+            with open(path, 'rb') as f:
+                stored['Body'] = f.read()
+        except FileNotFoundError:
+            return None
+        return stored
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        self._record_call('head_object')
+        stored = self._get(Bucket, Key, 'HeadObject')
+        return {
+            'ContentLength': len(stored['Body']),
+            'ContentType': stored['ContentType'],
+            'ETag': stored['ETag'],
+            'Metadata': dict(stored['Metadata']),
+        }
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self._record_call('get_object')
+        body = self._get(Bucket, Key, 'GetObject')['Body']
+        if Range:
+            # only the 'bytes=start-end' form the handlers use
+            start, end = Range.split('=', 1)[1].split('-')
+            body = body[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', MaxKeys: int = 1000,
+                        ContinuationToken: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self._record_call('list_objects_v2')
+        if self.storage_dir:
+            root = os.path.join(self.storage_dir, Bucket)
+            keys = [
+                os.path.relpath(os.path.join(directory, name), root).replace(os.sep, '/')[:-len('.metadata.json')]
+                for directory, _, names in os.walk(root) for name in names if name.endswith('.metadata.json')
+            ]
+        else:
+            with self._lock:
+                keys = [key for bucket, key in self.objects if bucket == Bucket]
+        # like S3, keys are listed in order and the continuation token is the last key returned
+        keys = sorted(key for key in keys if key.startswith(Prefix) and key > (ContinuationToken or ''))
+        page = keys[:MaxKeys]
+        response: Dict[str, Any] = {
+            'Contents': [{'Key': key} for key in page],
+            'KeyCount': len(page),
+            'IsTruncated': len(keys) > MaxKeys,
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+
+# ==================
+# API Gateway
+# ==================
+class FakeGateway:
+    """
+    Fake apigatewaymanagementapi client.
+
+    Args:
+        latency: Seconds every post_to_connection call takes
+        max_posts: Delivered messages kept in posts, 0 to keep none
+    """
+
+    def __init__(self, latency: float = 0.0, max_posts: int = 1000):
+        self.latency = latency
+        # (time.monotonic(), connection id, data) of the latest delivered messages
+        self.posts: Deque[Tuple[float, str, Any]] = deque(maxlen=max_posts)
+        self.post_count = 0
+        self._listeners: Dict[str, Callable[[Any], None]] = {}
+        self._closed: set = set()
+        self._lock = threading.Lock()
+
+    def connect(self, connection_id: str, listener: Optional[Callable[[Any], None]] = None) -> None:
+        """Open a connection; listener is called with every message posted to it."""
+        with self._lock:
+            self._closed.discard(connection_id)
+            if listener:
+                self._listeners[connection_id] = listener
+
+    def disconnect(self, connection_id: str) -> None:
+        """Close a connection; later posts to it fail with GoneException."""
+        with self._lock:
+            self._closed.add(connection_id)
+            self._listeners.pop(connection_id, None)
+
+    def post_to_connection(self, ConnectionId: str, Data: Any, **kwargs) -> Dict[str, Any]:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if ConnectionId in self._closed:
+                raise client_error('GoneException', 'PostToConnection')
+            self.post_count += 1
+            self.posts.append((time.monotonic(), ConnectionId, Data))
+            listener = self._listeners.get(ConnectionId)
+        if listener:
+            listener(Data)
+        return {}
@@ -0,0 +1,194 @@
+"""
+In-process stand-in for the boto3 Textract client.
+
+Implements analyze_expense, start_expense_analysis and get_expense_analysis
+with configurable latency and throttling so the handlers can be exercised
+without AWS:
+
+    import lambda_s3_textract
+    lambda_s3_textract._textract_client = FakeTextract(latency=0.5, throttle_rate=0.1)
+
+Responses come from sample_expense_response by default, or from
+recorded_response_factory / synthetic_response_factory. Given an S3 client
+(e.g. fake_aws.FakeS3), jobs started with an OutputConfig write their results
+to it as numbered files, like Textract does.
+"""
+
+import copy
+import itertools
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from textract_jobs import MAX_RESULTS_PER_PAGE
+
+
+def sample_expense_response() -> Dict[str, Any]:
+    """Return a minimal single-receipt analyze_expense response."""
+    def field(field_type: str, text: str) -> Dict[str, Any]:
+        return {'Type': {'Text': field_type}, 'ValueDetection': {'Text': text}}
+
+    return {
+        'DocumentMetadata': {'Pages': 1},
+        'ExpenseDocuments': [
+            {
+                'ExpenseIndex': 1,
+                'SummaryFields': [
+                    field('VENDOR_NAME', 'Sample Market'),
+                    field('INVOICE_RECEIPT_DATE', '01/01/2025'),
+                    field('TOTAL', '$5.25'),
+                ],
+                'LineItemGroups': [
+                    {
+                        'LineItemGroupIndex': 1,
+                        'LineItems': [
+                            {'LineItemExpenseFields': [field('ITEM', 'Coffee'), field('PRICE', '$3.00')]},
+                            {'LineItemExpenseFields': [field('ITEM', 'Bagel'), field('PRICE', '$2.25')]},
+                        ]
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def recorded_response_factory(paths: List[str]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Serve analyze_expense responses saved as JSON files, in turn."""
+    responses = []
+    for path in paths:
+        with open(path) as f:
+            responses.append(json.load(f))
+    cycle = itertools.cycle(responses)
+    lock = threading.Lock()
+
+    def factory(document: Dict[str, Any]) -> Dict[str, Any]:
+        with lock:
+            return next(cycle)
+    return factory
+
+
+def synthetic_response_factory(line_items: int = 20, documents: int = 1) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Serve one synthetic response of the given size, see synthetic_textract.py."""
+    from synthetic_textract import generate_expense_response
+
+    response = generate_expense_response(documents=documents, line_items=line_items)
+    return lambda document: response
+
+
+def throttling_error(operation: str) -> Exception:
+    """Build the ClientError Textract raises when it is over capacity."""
+    from botocore.exceptions import ClientError
+
+    return ClientError(
+        {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+        operation
+    )
+
+
+class FakeTextract:
+    """
+    Fake Textract client.
+
+    Args:
+        response_factory: Called with the Document/DocumentLocation argument,
+            returns the analyze_expense style response to serve
+        latency: Seconds every analyze_expense call takes
+        job_duration: Seconds an asynchronous job stays IN_PROGRESS
+        latency_jitter: Up to this many seconds are added to latency at random
+        throttle_rate: Fraction of calls rejected with a ThrottlingException
+        output_s3: S3 client the results of jobs started with an OutputConfig
+            are written to, MAX_RESULTS_PER_PAGE documents per file
+    """
+
+    def __init__(self, response_factory: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                 latency: float = 0.0, job_duration: float = 0.0,
+                 latency_jitter: float = 0.0, throttle_rate: float = 0.0,
+                 output_s3: Optional[Any] = None):
+        self.response_factory = response_factory or (lambda document: sample_expense_response())
+        self.latency = latency
+        self.job_duration = job_duration
+        self.latency_jitter = latency_jitter
+        self.throttle_rate = throttle_rate
+        self.output_s3 = output_s3
+        self.calls: Dict[str, int] = {}
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # JobId by ClientRequestToken, a repeated token returns the earlier job
+        self._job_tokens: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _record_call(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            with self._lock:
+                self.calls['throttled'] = self.calls.get('throttled', 0) + 1
+            raise throttling_error(operation)
+
+    def analyze_expense(self, Document: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        self._record_call('analyze_expense')
+        if self.latency or self.latency_jitter:
+            time.sleep(self.latency + random.random() * self.latency_jitter)
+        return copy.deepcopy(self.response_factory(Document))
+
+    def start_expense_analysis(self, DocumentLocation: Dict[str, Any],
+                               OutputConfig: Optional[Dict[str, str]] = None,
+                               ClientRequestToken: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self._record_call('start_expense_analysis')
+        job_id = uuid4().hex
+        response = copy.deepcopy(self.response_factory(DocumentLocation))
+        with self._lock:
+            if ClientRequestToken in self._job_tokens:
+                return {'JobId': self._job_tokens[ClientRequestToken]}
+            if ClientRequestToken:
+                self._job_tokens[ClientRequestToken] = job_id
+            self._jobs[job_id] = {
+                'ready_at': time.monotonic() + self.job_duration,
+                'response': response,
+            }
+        if OutputConfig and self.output_s3 is not None:
+            # written right away, the job status still says when they may be read
+            self._write_output(job_id, response, OutputConfig)
+        return {'JobId': job_id}
+
+    def _write_output(self, job_id: str, response: Dict[str, Any], output_config: Dict[str, str]) -> None:
+        documents: List[Dict[str, Any]] = response.get('ExpenseDocuments', [])
+        prefix = output_config['S3Prefix'].rstrip('/')
+        self.output_s3.put_object(Bucket=output_config['S3Bucket'], Key=f'{prefix}/.s3_access_check', Body=b'')
+        for number, start in enumerate(range(0, max(len(documents), 1), MAX_RESULTS_PER_PAGE), 1):
+            page = {
+                'JobStatus': 'SUCCEEDED',
+                'DocumentMetadata': response.get('DocumentMetadata', {'Pages': 1}),
+                'ExpenseDocuments': documents[start:start + MAX_RESULTS_PER_PAGE],
+            }
+            self.output_s3.put_object(
+                Bucket=output_config['S3Bucket'],
+                Key=f'{prefix}/{job_id}/{number}',
+                Body=json.dumps(page).encode(),
+                ContentType='application/json'
+            )
+
+    def get_expense_analysis(self, JobId: str, MaxResults: int = 20,
+                             NextToken: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self._record_call('get_expense_analysis')
+        with self._lock:
+            job = self._jobs.get(JobId)
+        if job is None:
+            raise ValueError(f'Unknown JobId {JobId}')
+        if time.monotonic() < job['ready_at']:
+            return {'JobStatus': 'IN_PROGRESS'}
+
+        # Paginate ExpenseDocuments, NextToken is the index of the next document
+        documents: List[Dict[str, Any]] = job['response'].get('ExpenseDocuments', [])
+        start = int(NextToken) if NextToken else 0
+        end = start + MaxResults
+        page: Dict[str, Any] = {
+            'JobStatus': 'SUCCEEDED',
+            'DocumentMetadata': job['response'].get('DocumentMetadata', {'Pages': 1}),
+            'ExpenseDocuments': documents[start:end],
+        }
+        if end < len(documents):
+            page['NextToken'] = str(end)
+        return page
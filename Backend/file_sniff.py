@@ -0,0 +1,162 @@
+"""
+Magic-byte sniffing of uploaded receipts.
+
+The type and size in the upload request are declared by the client, so a
+mislabeled or corrupt file would only fail inside Textract, after seconds of
+billed analysis. sniff_document inspects the first few KB of a file (one
+ranged GET for objects in S3) and recognizes JPEG, PNG and PDF by their
+signatures, checking that the header is sane: image dimensions, PDF version
+and, when it can be found in the header, the page count.
+
+Only definite junk is rejected. When a header field is simply not within the
+sniffed range (e.g. a JPEG frame header after a large EXIF block), the file is
+given the benefit of the doubt.
+"""
+
+import re
+import struct
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# enough for the PNG IHDR, the PDF header / linearization dict and most JPEG frame headers
+SNIFF_BYTES = 16 * 1024  # 16KB
+# an image smaller than this on either side cannot hold a readable receipt
+MIN_IMAGE_DIMENSION = 32
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+# the PDF header may be preceded by up to 1KB of garbage
+PDF_HEADER_WINDOW = 1024
+
+_PDF_HEADER = re.compile(rb'%PDF-(\d)\.(\d)')
+# /N of the linearization dictionary, or the /Count of a page tree node
+# (searched within a few hundred bytes, so a match cannot span unrelated objects)
+_PDF_LINEARIZED_PAGES = re.compile(rb'/Linearized\b.{0,300}?/N\s+(\d+)', re.DOTALL)
+_PDF_PAGE_COUNT = re.compile(rb'/Type\s*/Pages\b.{0,300}?/Count\s+(\d+)', re.DOTALL)
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...); not DHT/JPG/DAC
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+@dataclass
+class SniffResult:
+    """What could be learnt from the start of a file."""
+    kind: Optional[str] = None  # 'jpeg', 'png' or 'pdf'
+    width: Optional[int] = None
+    height: Optional[int] = None
+    page_count: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def valid(self) -> bool:
+        return self.kind is not None and self.error is None
+
+
+def sniff_document(head: bytes) -> SniffResult:
+    """
+    Identify a receipt file from its first bytes.
+
+    Args:
+        head: The first SNIFF_BYTES (or fewer) bytes of the file
+
+    Returns:
+        SniffResult; error is set when the file is not a usable JPEG, PNG or PDF
+    """
+    if head.startswith(PNG_SIGNATURE):
+        return _sniff_png(head)
+    if head.startswith(JPEG_SIGNATURE):
+        return _sniff_jpeg(head)
+    if b'%PDF-' in head[:PDF_HEADER_WINDOW]:
+        return _sniff_pdf(head)
+    return SniffResult(error='File is not a JPEG, PNG or PDF')
+
+
+def _check_dimensions(result: SniffResult) -> SniffResult:
+    if result.width is not None and result.height is not None:
+        if min(result.width, result.height) < MIN_IMAGE_DIMENSION:
+            result.error = f'Image is too small ({result.width}x{result.height})'
+    return result
+
+
+def _sniff_png(head: bytes) -> SniffResult:
+    result = SniffResult(kind='png')
+    # the IHDR chunk must come first: length, type, width, height, bit depth, color type
+    if len(head) < 26:
+        result.error = 'PNG header is truncated'
+        return result
+    length, chunk_type = struct.unpack('>I4s', head[8:16])
+    if chunk_type != b'IHDR' or length != 13:
+        result.error = 'PNG is missing its IHDR header'
+        return result
+    result.width, result.height = struct.unpack('>II', head[16:24])
+    bit_depth, color_type = head[24], head[25]
+    if bit_depth not in (1, 2, 4, 8, 16) or color_type not in (0, 2, 3, 4, 6):
+        result.error = 'PNG header is corrupt'
+        return result
+    return _check_dimensions(result)
+
+
+def _sniff_jpeg(head: bytes) -> SniffResult:
+    result = SniffResult(kind='jpeg')
+    dimensions = _find_jpeg_dimensions(head)
+    if dimensions == (0, 0):
+        result.error = 'JPEG structure is corrupt'
+        return result
+    if dimensions:
+        result.height, result.width = dimensions
+    return _check_dimensions(result)
+
+
+def _find_jpeg_dimensions(head: bytes) -> Optional[Tuple[int, int]]:
+    """Walk the JPEG segments to the frame header.
+
+    Returns:
+        (height, width); None if the frame header lies beyond head; (0, 0) if
+        the segment structure is broken
+    """
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            return (0, 0)
+        marker = head[pos + 1]
+        # fill bytes and standalone markers carry no length
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0x01, *range(0xD0, 0xD8)):
+            pos += 2
+            continue
+        if marker == 0xD9:
+            return (0, 0)
+        segment_length = struct.unpack('>H', head[pos + 2:pos + 4])[0]
+        if segment_length < 2:
+            return (0, 0)
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > len(head):
+                return None
+            height, width = struct.unpack('>HH', head[pos + 5:pos + 9])
+            return (height, width)
+        if marker == 0xDA:
+            # image data started without a frame header
+            return (0, 0)
+        pos += 2 + segment_length
+    return None
+
+
+def _sniff_pdf(head: bytes) -> SniffResult:
+    result = SniffResult(kind='pdf')
+    match = _PDF_HEADER.search(head, 0, PDF_HEADER_WINDOW + 8)
+    if not match:
+        result.error = 'PDF header is corrupt'
+        return result
+    major = int(match.group(1))
+    if major not in (1, 2):
+        result.error = f'Unsupported PDF version {match.group(1).decode()}.{match.group(2).decode()}'
+        return result
+
+    pages = _PDF_LINEARIZED_PAGES.search(head) or _PDF_PAGE_COUNT.search(head)
+    if pages:
+        result.page_count = int(pages.group(1))
+        if result.page_count == 0:
+            result.error = 'PDF has no pages'
+    return result
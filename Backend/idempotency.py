@@ -0,0 +1,343 @@
+"""
+Idempotent processing of at-least-once S3 notifications.
+
+S3 can deliver the same object-created event more than once, and lambda
+retries re-run the handler. Each object version (bucket/key/ETag) is claimed
+before it is processed:
+    - the first delivery acquires an IN_PROGRESS record with a lease, runs,
+      and stores its outcome as COMPLETED
+    - a duplicate arriving later is served the stored outcome
+    - a duplicate arriving while the first run is still going waits for it
+      instead of calling Textract a second time
+    - a run that crashed stops holding its lease once the lease expires, and
+      a run that failed with a retryable error releases its claim, so either
+      can be retried
+
+A lease must outlast the run holding it, or a redelivery takes over a claim
+that is still being worked on (e.g. a long asynchronous Textract poll) and
+starts a second job. Inside Lambda, lease_for gives a lease covering the rest
+of the invocation; elsewhere it is LEASE_SECONDS, the longest Lambda timeout.
+
+Backends are selected with IDEMPOTENCY_BACKEND / IDEMPOTENCY_TABLE, see
+store_backends.py. Deduplication across Lambda containers needs the dynamodb
+backend.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+from uuid import uuid4
+
+from log_utils import get_logger
+from store_backends import DYNAMODB, SQLITE, DynamoDBBackend, SQLiteBackend, select_backend
+
+logger = get_logger(__name__)
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+
+# the longest Lambda timeout, so no run outlives its lease
+LEASE_SECONDS = float(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '900'))  # 15 minutes
+# added to the remaining invocation time, for the run's last store writes
+LEASE_MARGIN_SECONDS = 30
+WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '60'))
+POLL_INTERVAL = float(os.getenv('IDEMPOTENCY_POLL_INTERVAL', '0.25'))  # seconds
+DEFAULT_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL', str(24 * 60 * 60)))  # 24 hours
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), 'receipt-idempotency.sqlite3')
+
+
+def make_idempotency_key(bucket: str, key: str, etag: str) -> str:
+    """Identify one version of an S3 object."""
+    return f"{bucket}/{key}/{etag.strip(chr(34))}"
+
+
+def lease_for(context) -> float:
+    """
+    Return a lease covering the rest of a Lambda invocation.
+
+    A run cannot outlive its invocation, so once the lease expires the claim is
+    known to be abandoned. Without a Lambda context, LEASE_SECONDS.
+    """
+    get_remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time is None:
+        return LEASE_SECONDS
+    return get_remaining_time() / 1000 + LEASE_MARGIN_SECONDS
+
+
+@dataclass
+class Claim:
+    """Result of claiming a key."""
+    status: str
+    # set when this caller acquired the key, needed to complete or release it
+    token: Optional[str] = None
+    # set when the key was already completed
+    outcome: Optional[Dict[str, Any]] = None
+
+
+# ==================
+# Store backends
+# ==================
+class IdempotencyStore(ABC):
+    """Interface of an idempotency record store."""
+
+    @abstractmethod
+    def claim(self, key: str, lease_seconds: float = LEASE_SECONDS) -> Claim:
+        """
+        Acquire key unless it is completed or leased by another run.
+
+        Returns:
+            Claim with status IN_PROGRESS and a token if acquired, COMPLETED with
+            the stored outcome, or IN_PROGRESS without a token if another run holds it
+        """
+
+    @abstractmethod
+    def complete(self, key: str, token: str, outcome: Dict[str, Any]) -> None:
+        """Store the outcome of the run holding token."""
+
+    @abstractmethod
+    def release(self, key: str, token: str) -> None:
+        """Drop the claim of the run holding token, so a retry can process key."""
+
+
+class NullIdempotencyStore(IdempotencyStore):
+    """Store that lets every delivery through."""
+
+    def claim(self, key: str, lease_seconds: float = LEASE_SECONDS) -> Claim:
+        return Claim(IN_PROGRESS, token=str(uuid4()))
+
+    def complete(self, key: str, token: str, outcome: Dict[str, Any]) -> None:
+        return None
+
+    def release(self, key: str, token: str) -> None:
+        return None
+
+
+class SQLiteIdempotencyStore(SQLiteBackend, IdempotencyStore):
+    """Local file backed store. Safe to share between processes too."""
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        # transactions are opened explicitly with BEGIN IMMEDIATE
+        super().__init__(path, ttl_seconds, [
+            'CREATE TABLE IF NOT EXISTS idempotency ('
+            'idempotency_key TEXT PRIMARY KEY, '
+            'status TEXT NOT NULL, '
+            'token TEXT, '
+            'lease_expires_at REAL, '
+            'outcome TEXT, '
+            'expires_at REAL NOT NULL)',
+        ], isolation_level=None, timeout=30)
+
+    def claim(self, key: str, lease_seconds: float = LEASE_SECONDS) -> Claim:
+        now = time.time()
+        token = str(uuid4())
+        with self._lock:
+            # the write lock is taken up front, so two claimers cannot both see the key free
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT status, lease_expires_at, outcome FROM idempotency '
+                    'WHERE idempotency_key = ? AND expires_at > ?',
+                    (key, now)
+                ).fetchone()
+                if row:
+                    status, lease_expires_at, outcome = row
+                    if status == COMPLETED:
+                        self._conn.execute('COMMIT')
+                        return Claim(COMPLETED, outcome=json.loads(outcome))
+                    if lease_expires_at > now:
+                        self._conn.execute('COMMIT')
+                        return Claim(IN_PROGRESS)
+
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO idempotency '
+                    '(idempotency_key, status, token, lease_expires_at, outcome, expires_at) '
+                    'VALUES (?, ?, ?, ?, NULL, ?)',
+                    (key, IN_PROGRESS, token, now + lease_seconds, now + self.ttl_seconds)
+                )
+                self._evict('idempotency', now)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return Claim(IN_PROGRESS, token=token)
+
+    def complete(self, key: str, token: str, outcome: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                'UPDATE idempotency SET status = ?, outcome = ?, expires_at = ? '
+                'WHERE idempotency_key = ? AND token = ?',
+                (COMPLETED, json.dumps(outcome), time.time() + self.ttl_seconds, key, token)
+            )
+
+    def release(self, key: str, token: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM idempotency WHERE idempotency_key = ? AND token = ? AND status = ?',
+                (key, token, IN_PROGRESS)
+            )
+
+
+class DynamoDBIdempotencyStore(DynamoDBBackend, IdempotencyStore):
+    """
+    DynamoDB backed store shared by every lambda, using conditional writes.
+
+    The table needs a string partition key 'idempotency_key' and should have
+    DynamoDB TTL enabled on the numeric 'expires_at' attribute.
+    """
+
+    def __init__(self, table_name: str, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(table_name, ttl_seconds)
+
+    def claim(self, key: str, lease_seconds: float = LEASE_SECONDS) -> Claim:
+        now = time.time()
+        token = str(uuid4())
+        try:
+            self.table.put_item(
+                Item={
+                    'idempotency_key': key,
+                    'status': IN_PROGRESS,
+                    'token': token,
+                    'lease_expires_at': int(now + lease_seconds),
+                    'expires_at': self._expires_at(now),
+                },
+                # free, expired (TTL deletion is lazy), or an abandoned lease
+                ConditionExpression=(
+                    'attribute_not_exists(idempotency_key) OR expires_at < :now '
+                    'OR (#status = :in_progress AND lease_expires_at < :now)'
+                ),
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':now': int(now), ':in_progress': IN_PROGRESS}
+            )
+            return Claim(IN_PROGRESS, token=token)
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+        item = self.table.get_item(Key={'idempotency_key': key}, ConsistentRead=True).get('Item')
+        if item and item['status'] == COMPLETED:
+            return Claim(COMPLETED, outcome=json.loads(item['outcome']))
+        return Claim(IN_PROGRESS)
+
+    def complete(self, key: str, token: str, outcome: Dict[str, Any]) -> None:
+        try:
+            self.table.update_item(
+                Key={'idempotency_key': key},
+                UpdateExpression='SET #status = :completed, outcome = :outcome, expires_at = :expires_at',
+                ConditionExpression='#token = :token',
+                ExpressionAttributeNames={'#status': 'status', '#token': 'token'},
+                ExpressionAttributeValues={
+                    ':completed': COMPLETED,
+                    ':outcome': json.dumps(outcome),
+                    ':expires_at': self._expires_at(time.time()),
+                    ':token': token,
+                }
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            # our lease expired and another run took over, its outcome wins
+            logger.warning('Lost the idempotency lease on %s before completing', key)
+
+    def release(self, key: str, token: str) -> None:
+        try:
+            self.table.delete_item(
+                Key={'idempotency_key': key},
+                ConditionExpression='#token = :token AND #status = :in_progress',
+                ExpressionAttributeNames={'#status': 'status', '#token': 'token'},
+                ExpressionAttributeValues={':token': token, ':in_progress': IN_PROGRESS}
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+
+# ==================
+# Store handling
+# ==================
+_idempotency_store: Optional[IdempotencyStore] = None
+# records are processed by several threads, only one of them may create the backend
+_idempotency_store_lock = threading.Lock()
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    """Return the process-wide store, creating it from the environment on first use."""
+    global _idempotency_store
+    with _idempotency_store_lock:
+        if not _idempotency_store:
+            _idempotency_store = select_backend('IDEMPOTENCY', {
+                DYNAMODB: lambda: DynamoDBIdempotencyStore(os.environ['IDEMPOTENCY_TABLE']),
+                SQLITE: lambda: SQLiteIdempotencyStore(os.getenv('IDEMPOTENCY_PATH', DEFAULT_SQLITE_PATH)),
+            }, NullIdempotencyStore, 'deliveries handled by other containers are processed again')
+        return _idempotency_store
+
+
+def set_idempotency_store(store: Optional[IdempotencyStore]) -> None:
+    """Replace the process-wide store, e.g. with a fresh SQLite file in tests."""
+    global _idempotency_store
+    with _idempotency_store_lock:
+        _idempotency_store = store
+
+
+def run_once(key: str, func: Callable[[], Dict[str, Any]],
+             should_store: Callable[[Dict[str, Any]], bool] = lambda outcome: True,
+             wait_seconds: float = WAIT_SECONDS,
+             lease_seconds: float = LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+    """
+    Run func at most once per key, serving duplicates the stored outcome.
+
+    If the store itself fails, func is run anyway: processing twice is better
+    than not processing at all.
+
+    Args:
+        key: Idempotency key, see make_idempotency_key
+        func: Work to do; returns a JSON serializable outcome
+        should_store: Whether an outcome is final. Outcomes it rejects (e.g.
+            retryable errors) release the claim instead of being stored
+        wait_seconds: How long a duplicate waits for a run in progress
+        lease_seconds: How long a claim is held before others may take over
+
+    Returns:
+        Outcome of func or of the run that completed first; None if another
+        run was still in progress after wait_seconds
+    """
+    store = get_idempotency_store()
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        try:
+            claim = store.claim(key, lease_seconds)
+        except Exception as e:
+            logger.warning('Idempotency claim failed, processing anyway: %s', e)
+            return func()
+
+        if claim.status == COMPLETED:
+            logger.info('Duplicate delivery of %s, serving the stored outcome', key)
+            return claim.outcome
+        if claim.token:
+            break
+        if time.monotonic() >= deadline:
+            logger.warning('%s is still being processed by another run', key)
+            return None
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        outcome = func()
+    except Exception:
+        _release(store, key, claim.token)
+        raise
+
+    try:
+        if should_store(outcome):
+            store.complete(key, claim.token, outcome)
+        else:
+            store.release(key, claim.token)
+    except Exception as e:
+        logger.warning('Idempotency record update failed for %s: %s', key, e)
+    return outcome
+
+
+def _release(store: IdempotencyStore, key: str, token: str) -> None:
+    try:
+        store.release(key, token)
+    except Exception as e:
+        logger.warning('Idempotency release failed for %s: %s', key, e)
@@ -0,0 +1,86 @@
+"""
+Shrink receipt photos before they are sent to Textract.
+
+Phone photos arrive at 8-10MB and Textract latency grows with payload size.
+Receipts only need enough resolution for the text, so images are decoded,
+capped at a DPI-equivalent resolution, converted to grayscale and re-encoded
+as JPEG.
+
+Requires Pillow. Without it, or when preprocessing does not make the image
+smaller, preprocess_image returns None and the original is used.
+
+Configuration (environment):
+    IMAGE_PREPROCESSING  - 'off' disables preprocessing
+    PREPROCESS_MAX_DPI   - resolution cap, assuming the long edge of the photo
+                           spans ASSUMED_LONG_EDGE_INCHES of paper
+    PREPROCESS_QUALITY   - JPEG quality of the re-encoded image
+"""
+
+import io
+import os
+from typing import Optional
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+IMAGE_PREPROCESSING = os.getenv('IMAGE_PREPROCESSING', 'on') != 'off'
+PREPROCESS_MAX_DPI = int(os.getenv('PREPROCESS_MAX_DPI', '200'))
+PREPROCESS_QUALITY = int(os.getenv('PREPROCESS_QUALITY', '85'))
+# Long receipts are roughly letter length, so a 200 DPI cap is a 2200px long edge
+ASSUMED_LONG_EDGE_INCHES = 11
+
+
+def max_long_edge(max_dpi: int = PREPROCESS_MAX_DPI) -> int:
+    """Return the long edge, in pixels, that corresponds to max_dpi."""
+    return max_dpi * ASSUMED_LONG_EDGE_INCHES
+
+
+def preprocess_image(image_bytes: bytes, max_dpi: int = PREPROCESS_MAX_DPI,
+                     quality: int = PREPROCESS_QUALITY,
+                     enabled: bool = IMAGE_PREPROCESSING) -> Optional[bytes]:
+    """
+    Downscale, grayscale and re-encode a receipt image.
+
+    Args:
+        image_bytes: Encoded JPEG or PNG. PDFs are left alone
+        max_dpi: DPI-equivalent resolution cap
+        quality: JPEG quality of the output
+        enabled: Set to False to skip preprocessing
+
+    Returns:
+        Smaller JPEG bytes, or None if preprocessing is disabled, unavailable,
+        failed, or would not reduce the payload
+    """
+    if not enabled or image_bytes[:4] == b'%PDF':
+        return None
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning('Pillow is not installed, skipping image preprocessing')
+        return None
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # phone photos are often stored sideways with an EXIF rotation
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('L')
+
+            limit = max_long_edge(max_dpi)
+            if max(image.size) > limit:
+                image.thumbnail((limit, limit), Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+
+    except Exception as e:
+        logger.warning('Failed to preprocess image, sending original: %s', e)
+        return None
+
+    processed = buffer.getvalue()
+    if len(processed) >= len(image_bytes):
+        return None
+
+    logger.info('Preprocessed image from %d to %d bytes', len(image_bytes), len(processed))
+    return processed
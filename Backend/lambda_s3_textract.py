@@ -1,6 +1,18 @@
 """
 Lambda function triggered by S3 object creation.
 Processes receipts using AWS Textract.
+All records of a batched S3 notification are processed concurrently.
+
+Small documents go through the synchronous analyze_expense call. Large or
+long documents are submitted as asynchronous Textract jobs; their results are
+either polled for, or (when TEXTRACT_SNS_TOPIC_ARN is set) delivered to
+completion_handler through SNS. With TEXTRACT_OUTPUT_BUCKET set, jobs also write
+their results to S3 and those are parsed incrementally from the object bodies.
+
+Uploads arrive either as a single presigned PUT or as a multipart upload (see
+multipart_upload.py); the S3 trigger must cover both s3:ObjectCreated:Put and
+s3:ObjectCreated:CompleteMultipartUpload. Parts of an unfinished multipart
+upload never emit an event.
 
 S3 Event Structure:
 {
@@ -15,38 +27,121 @@ S3 Event Structure:
 }
 """
 
-import boto3
+import functools
 import json
-import logging
-from typing import Dict, Any, List, Optional
-from pydantic import BaseModel, ValidationError
-from botocore.config import Config
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+
+from aws_clients import get_client, log_client_stats
+from file_sniff import SNIFF_BYTES, sniff_document
+from idempotency import LEASE_SECONDS, lease_for, make_idempotency_key, run_once
+from image_preprocess import preprocess_image
+from log_utils import HEAD_OBJECT_FIELDS, get_logger, log_verbose
+from metrics import BYTES, in_invocation, metrics_scope, put_metric, span
+from pdf_pages import count_pdf_pages, is_pdf, merge_expense_responses, split_pdf_pages
+from profiling import profile_scope, profiled
+from rate_limiter import RateLimitedClient, get_rate_limiter, is_throttling_error
+from result_cache import cache_get, cache_put, gen_hash, gen_stream_hash
+from result_store import store_result
+from stream_parser import StreamFormatError
+from textract_jobs import (
+    MAX_RESULTS_PER_PAGE,
+    check_job_status,
+    iter_expense_job_documents,
+    iter_job_output_documents,
+    poll_expense_job,
+    start_expense_job,
+)
+from websocket_outbox import WebsocketOutbox
+from wire_encoding import DEFAULT_ENCODING
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+logger = get_logger(__name__)
 
 UPLOAD_DIR_NAME = 'uploads/'
 FINISHED_DIR_NAME = 'finished/'
 
-# AWS client init
-s3_client = boto3.client('s3', config=Config(signature_version="s3v4"))
-gateway_client = boto3.client(
-    'apigatewaymanagementapi', 
-    endpoint_url='https://bdoyue9pj6.execute-api.us-west-1.amazonaws.com/dev/'
-)
-textract_client = boto3.client('textract')
+# Validate parsed receipts with pydantic instead of the fast plain checks
+STRICT_PARSING = os.getenv('STRICT_PARSING', 'off') == 'on'
 
-# Data classes
-class ReceiptItem(BaseModel):
-    item_name: str
-    price: str
+# hardcoded map of values to look for in the summary part
+SUMMARY_TYPE_MAP = {
+    'INVOICE_RECEIPT_DATE': 'date',
+    'TOTAL': 'total',
+    'VENDOR_NAME': 'store_name',
+}
 
+# Send downloaded documents to Textract as bytes instead of as an S3 reference,
+# for storage Textract cannot read (local_service.py)
+TEXTRACT_SEND_BYTES = os.getenv('TEXTRACT_SEND_BYTES', 'off') == 'on'
+
+# Upper bound on records processed concurrently within one invocation
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '8'))
+# Upper bound on pages of one PDF analyzed concurrently
+PDF_PAGE_WORKERS = int(os.getenv('PDF_PAGE_WORKERS', '4'))
+
+# Documents above either threshold are analyzed with an asynchronous Textract job
+# The size threshold matches the 10MB synchronous analyze_expense limit
+ASYNC_SIZE_THRESHOLD = int(os.getenv('ASYNC_SIZE_THRESHOLD', str(10 * 1024 * 1024)))  # 10MB
+ASYNC_PAGE_THRESHOLD = int(os.getenv('ASYNC_PAGE_THRESHOLD', '10'))
+# When set, job completion is published to SNS instead of polled for
+TEXTRACT_SNS_TOPIC_ARN = os.getenv('TEXTRACT_SNS_TOPIC_ARN')
+TEXTRACT_SNS_ROLE_ARN = os.getenv('TEXTRACT_SNS_ROLE_ARN')
+# When set, jobs write their results to this bucket (Textract needs write access)
+# and they are streamed from there instead of paged through GetExpenseAnalysis.
+# Keep the prefix outside the uploads/ prefix the S3 trigger watches.
+TEXTRACT_OUTPUT_BUCKET = os.getenv('TEXTRACT_OUTPUT_BUCKET')
+TEXTRACT_OUTPUT_PREFIX = os.getenv('TEXTRACT_OUTPUT_PREFIX', 'textract-output')
 
-class Receipt(BaseModel):
-    store_name: Optional[str] = None
-    date: Optional[str] = None
-    items: List[ReceiptItem]
-    total: str
+# AWS client init
+# Clients come from the shared pooled factory in aws_clients.py and are created
+# on first use, so invocations that fail early never pay for boto3. With
+# PREWARM_CLIENTS=on they are created during init instead (SnapStart /
+# provisioned concurrency).
+PREWARM_CLIENTS = os.getenv('PREWARM_CLIENTS', 'off') == 'on'
+
+_textract_client: Optional[Any] = None
+_outbox: Optional[WebsocketOutbox] = None
+_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    # Connection pools are sized so every worker can hold its own connection
+    return get_client('s3', pool_size=MAX_WORKERS, signature_version='s3v4')
+
+
+def get_gateway_client():
+    return get_client(
+        'apigatewaymanagementapi',
+        pool_size=MAX_WORKERS,
+        endpoint_url='https://bdoyue9pj6.execute-api.us-west-1.amazonaws.com/dev/',
+        name='apigateway'
+    )
+
+
+def get_textract_client():
+    global _textract_client
+    if not _textract_client:
+        with _client_lock:
+            if not _textract_client:
+                # Throttling and transient errors are retried by the shared rate limiter, not botocore
+                _textract_client = RateLimitedClient(
+                    get_client(
+                        'textract',
+                        pool_size=MAX_WORKERS * PDF_PAGE_WORKERS,
+                        retries={'mode': 'standard', 'max_attempts': 1}
+                    ),
+                    get_rate_limiter()
+                )
+    return _textract_client
+
+
+if PREWARM_CLIENTS:
+    get_s3_client()
+    get_gateway_client()
+    get_textract_client()
 
 
 # AWS textract exception
@@ -62,131 +157,626 @@ class InvalidTextractResponse(Exception):
         return f"{self.message} {self.missing_field}"
 
 
+@profile_scope('lambda_s3_textract')
+@metrics_scope('lambda_s3_textract')
 def lambda_handler(event, context):
     """
     Lambda handler triggered by S3 object creation.
 
+    Every record in the event is processed independently on a bounded
+    worker pool, so a batch takes roughly as long as its slowest receipt.
+
     Args:
-        event: S3 event containing bucket name and object key
+        event: S3 event containing one or more bucket name / object key records
         context: Lambda context object
 
     Returns:
-        Response with statusCode and body
+        Response with statusCode and the per-record results
     """
+    try:
+        records = event['Records']
+    except (KeyError, TypeError) as e:
+        logger.error("Invalid S3 event structure: %s", e)
+        return {
+            'statusCode': 400,
+            'body': {'error': 'Invalid S3 event'}
+        }
 
-    # Extract S3 information from event
+    if not records:
+        logger.error("S3 event contains no records")
+        return {
+            'statusCode': 400,
+            'body': {'error': 'Invalid S3 event'}
+        }
+
+    put_metric('records', len(records))
+    retries_before = get_rate_limiter().stats()['retries']
+    max_workers = min(MAX_WORKERS, len(records))
+    # claims are held for as long as this invocation can still be running
+    process = functools.partial(process_record, lease_seconds=lease_for(context))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(in_invocation(profiled(process)), records))
+
+    failed = [result for result in results if result['statusCode'] >= 400]
+    if failed:
+        logger.error("%d of %d record(s) failed", len(failed), len(results))
+    put_metric('failed_records', len(failed))
+    limiter_stats = get_rate_limiter().stats()
+    put_metric('textract_retries', limiter_stats['retries'] - retries_before)
+    logger.info("Textract rate limiter stats: %s", limiter_stats)
+    logger.info("Websocket outbox stats: %s", get_outbox().stats())
+    log_client_stats()
+
+    return {
+        'statusCode': 500 if failed else 200,
+        'results': results,
+    }
+
+
+def process_record(record: Dict[str, Any], lease_seconds: float = LEASE_SECONDS) -> Dict[str, Any]:
+    """
+    Run the head_object -> analyze_expense -> parse -> notify chain for one S3 record.
+
+    Never raises; failures are reported in the returned result so that one bad
+    record cannot take down the rest of the batch.
+
+    Args:
+        record: Single entry of the S3 event 'Records' array
+        lease_seconds: How long the record's idempotency claim is held
+
+    Returns:
+        Dictionary with the record's 'key', 'statusCode' and, on failure, an 'error'
+    """
+    # Extract S3 information from record
     try:
-        record = event['Records'][0]
         bucket = record['s3']['bucket']['name']
-        key = record['s3']['object']['key']
-
-        output_body = {}
+        key = unquote_plus(record['s3']['object']['key'])
+    except (KeyError, TypeError) as e:
+        logger.error("Invalid S3 event record: %s", e)
+        return {
+            'key': None,
+            'statusCode': 400,
+            'error': 'Invalid S3 event record'
+        }
 
-        if not key.startswith(UPLOAD_DIR_NAME):
-            logger.error(f"Invalid s3 key: {key}. Object must be from the {UPLOAD_DIR_NAME} directory.")
-            output_body =  {
-                'statusCode': 400,
-                'body': {'error': 'Invalid S3 object key'}
-            }   
+    if not key.startswith(UPLOAD_DIR_NAME):
+        logger.error("Invalid s3 key: %s. Object must be from the %s directory.", key, UPLOAD_DIR_NAME)
+        return {
+            'key': key,
+            'statusCode': 400,
+            'error': 'Invalid S3 object key'
+        }
 
-        # Check S3 object for valid metadata
-        response = s3_client.head_object(Key=key, Bucket=bucket)
-        logger.info(f"Head object response: {response}")
+    # Check S3 object for valid metadata
+    try:
+        with span('head_object'):
+            response = get_s3_client().head_object(Key=key, Bucket=bucket)
+        log_verbose(logger, "Head object response", response, HEAD_OBJECT_FIELDS)
         metadata = response['Metadata']
         connection_id = metadata['connectionid']
         file_id = metadata['fileid']
-        
-        logger.info(f"Processing S3 object: s3://{bucket}/{key}")
-
-    except (KeyError, IndexError) as e:
-        logger.error(f"Invalid S3 event structure: {e}")
-        output_body =  {
+        # negotiated by accept-files-dev, absent for clients that only read JSON
+        encoding = metadata.get('encoding', DEFAULT_ENCODING)
+        session_id = metadata.get('sessionid')
+    except KeyError as e:
+        logger.error("S3 object %s is missing metadata: %s", key, e)
+        return {
+            'key': key,
             'statusCode': 400,
-            'body': {'error': 'Invalid S3 event'}
+            'error': 'Missing S3 object metadata'
+        }
+    except Exception as e:
+        logger.error("Failed to read S3 object %s: %s", key, e)
+        return {
+            'key': key,
+            'statusCode': 500,
+            'error': 'Failed to read S3 object'
+        }
+
+    # S3 delivers events at least once; each object version is processed once
+    # and duplicates are served the stored outcome
+    idempotency_key = make_idempotency_key(bucket, key, response.get('ETag', ''))
+    put_metric('object_size', response.get('ContentLength', 0), BYTES)
+    with span('process_object'):
+        result = run_once(
+            idempotency_key,
+            lambda: process_object(bucket, key, response, connection_id, file_id, encoding, session_id),
+            should_store=lambda result: not result.get('retryable'),
+            lease_seconds=lease_seconds
+        )
+    if result is None:
+        return {
+            'key': key,
+            'fileId': file_id,
+            'statusCode': 202,
+            'duplicate': True,
         }
+    return result
 
 
+def process_object(bucket: str, key: str, head_response: Dict[str, Any], connection_id: str,
+                   file_id: str, encoding: str = DEFAULT_ENCODING,
+                   session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Extract a receipt and deliver the result to its websocket connection.
 
+    Args:
+        bucket: Name of the S3 bucket holding the receipt
+        key: Object key of the receipt
+        head_response: head_object response of the receipt
+        connection_id: Websocket connection that uploaded the file
+        file_id: Frontend identifier of the file
+        encoding: Wire encoding negotiated with the client
+        session_id: Client session the result is stored under for replay
 
-    # Process receipt with Textract
-    try:
-        # Call Textract with S3 reference
-        logger.info("Calling Textract analyze_expense...")
-        response = textract_client.analyze_expense(
-            Document={
-                'S3Object': {
-                    'Bucket': bucket,
-                    'Name': key
-                }
-            }
-        )
+    Returns:
+        Record result; 'retryable' is set when extraction failed transiently
+    """
+    logger.info("Processing S3 object: s3://%s/%s", bucket, key)
+    output_body = extract_receipt(
+        bucket,
+        key,
+        content_type=head_response.get('ContentType', ''),
+        content_length=head_response.get('ContentLength', 0),
+        etag=head_response.get('ETag', '')
+    )
+
+    if output_body is None:
+        # Asynchronous job submitted, completion_handler notifies the frontend
+        return {
+            'key': key,
+            'fileId': file_id,
+            'statusCode': 202,
+        }
 
-        logger.info("Textract analysis complete, parsing results...")
-        parsed_receipts = parse_extracted_text(response)
+    # Persist first, so a client that reconnected can still replay the result
+    with span('store_result'):
+        store_result(file_id, session_id, output_body)
 
-        if not parsed_receipts:
-            # Valid execution, but useless result
-            output_body = {
-                'statusCode': 422,
-                'error': {'message': 'No receipt data found in image.'}
-            }
+    result: Dict[str, Any] = {
+        'key': key,
+        'fileId': file_id,
+        'statusCode': 200,
+    }
+    # throttling and internal errors are worth another attempt on redelivery
+    if output_body['statusCode'] >= 500:
+        result['retryable'] = True
+
+    # Always write to websocket to notify frontend of request status
+    if not notify_connection(connection_id, file_id, output_body, encoding):
+        result['statusCode'] = 500
+        result['error'] = 'Failed to write to socket'
+
+    return result
+
+
+def extract_receipt(bucket: str, key: str, content_type: str = '',
+                    content_length: int = 0, etag: str = '') -> Optional[Dict[str, Any]]:
+    """
+    Process a receipt stored in S3 with Textract.
+
+    Args:
+        bucket: Name of the S3 bucket holding the receipt
+        key: Object key of the receipt
+        content_type: ContentType reported by head_object
+        content_length: ContentLength reported by head_object
+        etag: ETag reported by head_object, identifies the object version
+
+    Returns:
+        Output body to send to the frontend, containing a statusCode and data or error.
+        None if an asynchronous job was submitted and completion_handler will finish it.
+    """
+    try:
+        # Documents for the synchronous path are downloaded once, so PDFs can be
+        # split and images shrunk locally. Large ones stay in S3 for async jobs.
+        # Junk is rejected from its first bytes, before it costs a Textract call.
+        # Small documents are sniffed from the download, large ones from a ranged GET.
+        document_bytes: Optional[bytes] = None
+        if content_length <= ASYNC_SIZE_THRESHOLD:
+            with span('get_object'):
+                document_bytes = get_s3_client().get_object(Bucket=bucket, Key=key)['Body'].read()
+            sniffed = sniff_document(document_bytes[:SNIFF_BYTES])
         else:
-            # Success
-            output_body = {
-                'statusCode': 200,
-                'data': parsed_receipts,
+            with span('get_object_head'):
+                sniffed = sniff_document(read_object_head(bucket, key))
+        if not sniffed.valid:
+            logger.warning("Rejecting s3://%s/%s: %s", bucket, key, sniffed.error)
+            return {
+                'statusCode': 415,
+                'error': {'message': f'{sniffed.error}. Please upload a photo or PDF of a receipt.'}
             }
-            logger.info(f"Successfully parsed {len(parsed_receipts)} receipt(s)")
 
+        if document_bytes is not None:
+            content_hash = gen_hash(document_bytes)
+        else:
+            with span('hash_object'):
+                content_hash = get_content_hash(bucket, key)
+
+        # Identical uploads are served from the result cache instead of Textract
+        with span('cache_get'):
+            parsed_receipts = cache_get(content_hash) if content_hash else None
+
+        if parsed_receipts is not None:
+            logger.info("Result cache hit for s3://%s/%s", bucket, key)
+            put_metric('cache_hits', 1)
+        else:
+            put_metric('cache_hits', 0)
+            with span('analyze_expense'):
+                response = analyze_document(
+                    bucket,
+                    key,
+                    content_length,
+                    document_bytes,
+                    is_pdf(key, content_type),
+                    etag
+                )
+            if response is None:
+                return None
+
+            logger.info("Textract analysis complete, parsing results...")
+            # pages of asynchronous jobs are fetched while parsing, so they count here
+            with span('parse_extracted_text'):
+                parsed_receipts = parse_extracted_text(response)
+            if content_hash:
+                cache_put(content_hash, parsed_receipts)
+
+        put_metric('line_items', sum(len(receipt['items']) for receipt in parsed_receipts))
+        return build_output_body(parsed_receipts)
 
     except InvalidTextractResponse as e:
-        logger.error(f"Invalid Textract response: {e}")
-        output_body =  {
+        logger.error("Invalid Textract response: %s", e)
+        return {
             'statusCode': 400,
             'body': {'error': f"Invalid Textract response: {e}"}
         }
 
     except Exception as e:
-        logger.error(f"Error processing receipt: {e}", exc_info=True)
-        output_body = {
+        if is_throttling_error(e):
+            logger.error("Textract still throttled after retries: %s", e)
+            return {
+                'statusCode': 503,
+                'body': {'error': 'Receipt processing is busy, please try again.'}
+            }
+        logger.error("Error processing receipt: %s", e, exc_info=True)
+        return {
             'statusCode': 500,
             'body': {'error': 'Internal processing error.'}
         }
-    
 
-    # Always write to websocket to notify frontend of request status
-    try:
-        gateway_client.post_to_connection(
-            ConnectionId=connection_id,
-            Data=json.dumps(
-                {
-                    'body': output_body,
-                    'type': 'extractText',
-                    'fileId': file_id
-                }
-            ) 
+
+def build_output_body(parsed_receipts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Wrap parsed receipts in the output body sent to the frontend."""
+    if not parsed_receipts:
+        # Valid execution, but useless result
+        return {
+            'statusCode': 422,
+            'error': {'message': 'No receipt data found in image.'}
+        }
+
+    # Success
+    logger.info("Successfully parsed %d receipt(s)", len(parsed_receipts))
+    return {
+        'statusCode': 200,
+        'data': parsed_receipts,
+    }
+
+
+def use_async_mode(content_length: int, page_count: int) -> bool:
+    """Return True if a document should be analyzed with an asynchronous Textract job."""
+    return content_length > ASYNC_SIZE_THRESHOLD or page_count > ASYNC_PAGE_THRESHOLD
+
+
+def analyze_document(bucket: str, key: str, content_length: int = 0,
+                     document_bytes: Optional[bytes] = None,
+                     pdf: bool = False, etag: str = '') -> Optional[Dict[str, Any]]:
+    """
+    Run Textract expense analysis on a receipt.
+
+    Large or long documents are submitted as an asynchronous job. Multi-page
+    PDFs below the async thresholds are split and their pages analyzed
+    concurrently. Images are downscaled and sent as bytes when that shrinks
+    them; everything else is analyzed in place through its S3 reference.
+
+    Args:
+        bucket: Name of the S3 bucket holding the receipt
+        key: Object key of the receipt
+        content_length: Size of the object in bytes
+        document_bytes: Contents of the receipt when already downloaded
+        pdf: Whether the receipt is a PDF
+        etag: ETag of the object, keeps retried job starts from starting a second job
+
+    Returns:
+        Textract analyze_expense style response, or None if completion of an
+        asynchronous job will be delivered to completion_handler
+    """
+    # pages are only counted here, the PDF is split once it is known to stay synchronous
+    page_count = count_pdf_pages(document_bytes) if pdf and document_bytes is not None else 0
+
+    if use_async_mode(content_length, page_count):
+        if TEXTRACT_SNS_TOPIC_ARN and TEXTRACT_SNS_ROLE_ARN:
+            start_expense_job(
+                get_textract_client(),
+                bucket,
+                key,
+                notification_channel={
+                    'SNSTopicArn': TEXTRACT_SNS_TOPIC_ARN,
+                    'RoleArn': TEXTRACT_SNS_ROLE_ARN,
+                },
+                output_config=job_output_config(),
+                version=etag
+            )
+            return None
+
+        logger.info("Calling Textract start_expense_analysis and polling for results...")
+        textract_client = get_textract_client()
+        job_id = start_expense_job(textract_client, bucket, key, output_config=job_output_config(), version=etag)
+        # with S3 output only the job status is read from GetExpenseAnalysis
+        first_page = poll_expense_job(
+            textract_client,
+            job_id,
+            max_results=1 if TEXTRACT_OUTPUT_BUCKET else MAX_RESULTS_PER_PAGE
         )
+        # results are fetched lazily while the documents are parsed
+        return {'ExpenseDocuments': iter_job_documents(job_id, first_page)}
+
+    pages = split_pdf_pages(document_bytes) if page_count > 1 else []
+    if len(pages) > 1:
+        logger.info("Calling Textract analyze_expense on %d PDF pages...", len(pages))
+        return analyze_pages(pages)
+
+    if not pdf and document_bytes is not None:
+        image_bytes = preprocess_image(document_bytes)
+        if image_bytes is not None:
+            logger.info("Calling Textract analyze_expense with preprocessed image...")
+            return get_textract_client().analyze_expense(Document={'Bytes': image_bytes})
+
+    if TEXTRACT_SEND_BYTES and document_bytes is not None:
+        logger.info("Calling Textract analyze_expense with document bytes...")
+        return get_textract_client().analyze_expense(Document={'Bytes': document_bytes})
+
+    # Call Textract with S3 reference
+    logger.info("Calling Textract analyze_expense...")
+    return get_textract_client().analyze_expense(
+        Document={
+            'S3Object': {
+                'Bucket': bucket,
+                'Name': key
+            }
+        }
+    )
+
+
+def job_output_config() -> Optional[Dict[str, str]]:
+    """Return the OutputConfig of asynchronous jobs, None unless TEXTRACT_OUTPUT_BUCKET is set."""
+    if not TEXTRACT_OUTPUT_BUCKET:
+        return None
+    return {'S3Bucket': TEXTRACT_OUTPUT_BUCKET, 'S3Prefix': TEXTRACT_OUTPUT_PREFIX}
+
+
+def iter_job_documents(job_id: str, first_page: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the ExpenseDocuments of a finished asynchronous job one at a time.
+
+    With TEXTRACT_OUTPUT_BUCKET set they are parsed incrementally from the
+    job's S3 output; otherwise result pages are fetched from GetExpenseAnalysis.
+
+    Args:
+        job_id: Textract JobId
+        first_page: Already fetched first get_expense_analysis page, if any
+
+    Raises:
+        TextractJobError: If the job did not succeed
+        InvalidTextractResponse: If the S3 output is not a valid Textract response
+    """
+    textract_client = get_textract_client()
+    if not TEXTRACT_OUTPUT_BUCKET:
+        yield from iter_expense_job_documents(textract_client, job_id, first_page)
+        return
+
+    check_job_status(job_id, first_page or textract_client.get_expense_analysis(JobId=job_id, MaxResults=1))
+    try:
+        yield from iter_job_output_documents(get_s3_client(), job_id, TEXTRACT_OUTPUT_BUCKET, TEXTRACT_OUTPUT_PREFIX)
+    except StreamFormatError as e:
+        logger.error("Invalid Textract job output: %s", e)
+        raise InvalidTextractResponse(f"ExpenseDocuments - {str(e)}")
+
+
+def analyze_pages(pages: List[bytes]) -> Dict[str, Any]:
+    """
+    Analyze single-page PDFs concurrently and merge them into one response.
+
+    Args:
+        pages: One single-page PDF per page of the original document
+
+    Returns:
+        Textract analyze_expense response covering every page
+    """
+    def analyze_page(page: bytes) -> Dict[str, Any]:
+        return get_textract_client().analyze_expense(Document={'Bytes': page})
+
+    put_metric('pdf_pages', len(pages))
+    max_workers = min(PDF_PAGE_WORKERS, len(pages))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        page_responses = list(executor.map(in_invocation(profiled(analyze_page)), pages))
+
+    return merge_expense_responses(page_responses)
+
+
+def read_object_head(bucket: str, key: str) -> bytes:
+    """Fetch the first SNIFF_BYTES of an S3 object with a ranged GET."""
+    response = get_s3_client().get_object(Bucket=bucket, Key=key, Range=f'bytes=0-{SNIFF_BYTES - 1}')
+    return response['Body'].read()
+
+
+def get_content_hash(bucket: str, key: str) -> Optional[str]:
+    """
+    Hash the contents of an S3 object for result cache lookups.
 
+    Returns:
+        Hex SHA-256 of the object, or None if it could not be read
+    """
+    try:
+        response = get_s3_client().get_object(Bucket=bucket, Key=key)
+        return gen_stream_hash(response['Body'])
     except Exception as e:
-        logger.error(f'Failed to write to socket: {e}')
+        logger.warning("Failed to hash s3://%s/%s, skipping result cache: %s", bucket, key, e)
+        return None
+
+
+def get_outbox() -> WebsocketOutbox:
+    """Return the websocket outbox shared by every record of this container."""
+    global _outbox
+    if not _outbox:
+        with _client_lock:
+            if not _outbox:
+                _outbox = WebsocketOutbox(post_to_connection)
+    return _outbox
+
+
+def post_to_connection(connection_id: str, data: str) -> None:
+    """Post one websocket frame, recording its size and latency."""
+    put_metric('frame_size', len(data), BYTES)
+    with span('post_to_connection'):
+        get_gateway_client().post_to_connection(ConnectionId=connection_id, Data=data)
+
+
+def notify_connection(connection_id: str, file_id: str, output_body: Dict[str, Any],
+                      encoding: str = DEFAULT_ENCODING) -> bool:
+    """
+    Send a file's extraction result to the frontend over the websocket.
+
+    Results of the same connection finishing within a short window are
+    coalesced into one message by the outbox, compressed if the client asked
+    for it and chunked when larger than a websocket frame.
+
+    Args:
+        connection_id: Websocket connection that uploaded the file
+        file_id: Frontend identifier of the file
+        output_body: Result produced by extract_receipt
+        encoding: Wire encoding negotiated with the client (see wire_encoding.py)
+
+    Returns:
+        True if the message was delivered, False otherwise
+    """
+    return get_outbox().send(connection_id, file_id, output_body, encoding)
+
+
+@profile_scope('completion_handler')
+@metrics_scope('completion_handler')
+def completion_handler(event, context):
+    """
+    Lambda handler subscribed to the Textract job completion SNS topic.
+
+    Collects the results of finished asynchronous jobs, caches them and
+    notifies the frontend just like lambda_handler does for synchronous calls.
+
+    Args:
+        event: SNS event whose messages are Textract completion notifications
+        context: Lambda context object
+
+    Returns:
+        Response with statusCode and the per-job results
+    """
+    try:
+        messages = [json.loads(record['Sns']['Message']) for record in event['Records']]
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error("Invalid SNS event structure: %s", e)
         return {
-            'statusCode': 500,
+            'statusCode': 400,
+            'body': {'error': 'Invalid SNS event'}
         }
-    
+
+    max_workers = max(1, min(MAX_WORKERS, len(messages)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(in_invocation(profiled(process_job_completion)), messages))
+
+    failed = [result for result in results if result['statusCode'] >= 400]
     return {
-            'statusCode': 200,
+        'statusCode': 500 if failed else 200,
+        'results': results,
+    }
+
+
+def process_job_completion(message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Finish one asynchronous Textract job and notify the frontend.
+
+    Args:
+        message: Textract completion notification (JobId, Status, DocumentLocation)
+
+    Returns:
+        Dictionary with the job's 'jobId', 'statusCode' and, on failure, an 'error'
+    """
+    try:
+        job_id = message['JobId']
+        bucket = message['DocumentLocation']['S3Bucket']
+        key = message['DocumentLocation']['S3ObjectName']
+        metadata = get_s3_client().head_object(Key=key, Bucket=bucket)['Metadata']
+        connection_id = metadata['connectionid']
+        file_id = metadata['fileid']
+        encoding = metadata.get('encoding', DEFAULT_ENCODING)
+        session_id = metadata.get('sessionid')
+    except Exception as e:
+        logger.error("Failed to resolve Textract job completion %s: %s", message, e)
+        return {
+            'jobId': message.get('JobId') if isinstance(message, dict) else None,
+            'statusCode': 400,
+            'error': 'Invalid job completion message'
+        }
+
+    logger.info("Textract job %s finished with status %s", job_id, message.get('Status'))
+    try:
+        # results are fetched lazily while the documents are parsed
+        with span('parse_extracted_text'):
+            parsed_receipts = list(iter_parsed_receipts(iter_job_documents(job_id)))
+        put_metric('line_items', sum(len(receipt['items']) for receipt in parsed_receipts))
+        content_hash = get_content_hash(bucket, key)
+        if content_hash:
+            cache_put(content_hash, parsed_receipts)
+        output_body = build_output_body(parsed_receipts)
+
+    except InvalidTextractResponse as e:
+        logger.error("Invalid Textract response: %s", e)
+        output_body = {
+            'statusCode': 400,
+            'body': {'error': f"Invalid Textract response: {e}"}
+        }
+
+    except Exception as e:
+        logger.error("Error processing receipt: %s", e, exc_info=True)
+        output_body = {
+            'statusCode': 500,
+            'body': {'error': 'Internal processing error.'}
+        }
+
+    with span('store_result'):
+        store_result(file_id, session_id, output_body)
+    if not notify_connection(connection_id, file_id, output_body, encoding):
+        return {
+            'jobId': job_id,
+            'fileId': file_id,
+            'statusCode': 500,
+            'error': 'Failed to write to socket'
         }
 
+    return {
+        'jobId': job_id,
+        'fileId': file_id,
+        'statusCode': 200,
+    }
+
 # ===========================
 # TEXTRACT PARSING FUNCTIONS
 # ===========================
 
-def parse_extracted_text(textract_response: Dict[str, Any]) -> List[Dict[str, Any]]:
+def parse_extracted_text(textract_response: Dict[str, Any], strict: bool = STRICT_PARSING) -> List[Dict[str, Any]]:
     """
     Parse Textract response into structured receipt data.
 
     Args:
         textract_response: Raw response from Textract analyze_expense call
+        strict: Validate every line item and receipt with the pydantic models
+            instead of the equivalent plain checks of the fast path
 
     Returns:
         List of dictionaries, each representing a parsed receipt
@@ -196,30 +786,141 @@ def parse_extracted_text(textract_response: Dict[str, Any]) -> List[Dict[str, An
     """
 
     expense_docs = get_expense_documents(textract_response)
-    parsed_docs: List[Dict[str, Any]] = []
+    return list(iter_parsed_receipts(expense_docs, strict))
+
+
+def iter_parsed_receipts(expense_docs: Iterable[Dict[str, Any]],
+                         strict: bool = STRICT_PARSING) -> Iterator[Dict[str, Any]]:
+    """
+    Parse expense documents lazily, one receipt per valid document.
+
+    Args:
+        expense_docs: Any iterable of ExpenseDocuments, e.g. a list, the pages of
+            an asynchronous job, or iter_job_documents
+        strict: Validate with the pydantic models, see parse_extracted_text
+
+    Yields:
+        Parsed receipts
+
+    Raises:
+        InvalidTextractResponse: If a document's format is invalid
+    """
+    parse_document = parse_expense_document_strict if strict else parse_expense_document
 
     # Every expense doc has a summary and lineitems
     for i, doc in enumerate(expense_docs):
-        try:
-            summary_fields = get_summary_fields(doc)
-            parsed_fields = parse_summaryfields(summary_fields)
+        receipt = parse_document(doc, i)
+        if receipt is not None:
+            yield receipt
 
-            line_item_groups = get_line_item_groups(doc)
-            parsed_item_group = parse_lineitemgroups(line_item_groups)
 
-            receipt = {
-                **parsed_fields,
-                'items': parsed_item_group
-            }
+def parse_expense_document(expense_doc: Dict[str, Any], index: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    Parse one expense document in a single pass without pydantic.
+
+    Applies the same rules as the ReceiptItem/Receipt models in plain code, and
+    produces exactly the output of parse_expense_document_strict.
+
+    Args:
+        expense_doc: Single expense document from Textract
+        index: Position of the document, used in log messages
+
+    Returns:
+        Parsed receipt, or None if the document is not a valid receipt
+
+    Raises:
+        InvalidTextractResponse: If the document structure is invalid
+    """
+    summary_fields = get_summary_fields(expense_doc)
+    receipt: Dict[str, Any] = {}
+    try:
+        for summary in summary_fields:
+            summary_type = summary['Type']['Text']
+            if summary_type in SUMMARY_TYPE_MAP:
+                receipt[SUMMARY_TYPE_MAP[summary_type]] = summary['ValueDetection']['Text']
+
+    except KeyError as e:
+        logger.error("Missing expected key in summary field structure: %s", e)
+        raise InvalidTextractResponse(f"SummaryFields - missing key: {str(e)}")
+    except Exception as e:
+        logger.error("Error parsing summary fields: %s", e, exc_info=True)
+        raise InvalidTextractResponse(f"SummaryFields - parsing error: {str(e)}")
+
+    line_item_groups = get_line_item_groups(expense_doc)
+    items: List[Dict[str, str]] = []
+    try:
+        for item_group in line_item_groups:
+            for line in item_group['LineItems']:
+                row: Dict[str, str] = {}
+                for field in line['LineItemExpenseFields']:
+                    value = field['ValueDetection']['Text']
+                    field_label = field['Type']['Text']
+                    if field_label == 'ITEM':
+                        row['item_name'] = value
+                    elif field_label == 'PRICE':
+                        row['price'] = value
+
+                # same checks as ReceiptItem: both fields present and strings
+                if len(row) == 2 and isinstance(row['item_name'], str) and isinstance(row['price'], str):
+                    items.append(row)
+                else:
+                    logger.info("Skipping invalid line item: %s", row)
+
+    except KeyError as e:
+        logger.error("Missing expected key in line item structure: %s", e)
+        raise InvalidTextractResponse(f"LineItems - missing key: {str(e)}")
+    except Exception as e:
+        logger.error("Error parsing line items: %s", e, exc_info=True)
+        raise InvalidTextractResponse(f"LineItems - parsing error: {str(e)}")
+
+    # same checks as Receipt: total is a required string, the rest optional strings
+    if not isinstance(receipt.get('total'), str) or not all(
+        value is None or isinstance(value, str)
+        for key, value in receipt.items() if key != 'total'
+    ):
+        logger.warning("Failed to validate receipt document %s: invalid or missing total", index)
+        return None
+
+    receipt['items'] = items
+    return receipt
+
 
-            Receipt.model_validate(receipt)
-            parsed_docs.append(receipt)
+def parse_expense_document_strict(expense_doc: Dict[str, Any], index: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    Parse one expense document, validating it with the pydantic models.
+
+    Args:
+        expense_doc: Single expense document from Textract
+        index: Position of the document, used in log messages
+
+    Returns:
+        Parsed receipt, or None if the document fails validation
+
+    Raises:
+        InvalidTextractResponse: If the document structure is invalid
+    """
+    # pydantic is only imported when strict parsing is used
+    from pydantic import ValidationError
+    from receipt_models import Receipt
 
-        except ValidationError as e:
-            logger.warning(f"Failed to validate receipt document {i}: {e}")
-            continue
+    try:
+        summary_fields = get_summary_fields(expense_doc)
+        parsed_fields = parse_summaryfields(summary_fields)
+
+        line_item_groups = get_line_item_groups(expense_doc)
+        parsed_item_group = parse_lineitemgroups(line_item_groups)
+
+        receipt = {
+            **parsed_fields,
+            'items': parsed_item_group
+        }
 
-    return parsed_docs
+        Receipt.model_validate(receipt)
+        return receipt
+
+    except ValidationError as e:
+        logger.warning("Failed to validate receipt document %s: %s", index, e)
+        return None
 
 
 def get_expense_documents(textract_response: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -259,6 +960,9 @@ def parse_lineitemgroups(line_item_groups: List[Dict[str, Any]]) -> List[Dict[st
     Raises:
         InvalidTextractResponse: If line item structure is invalid
     """
+    from pydantic import ValidationError
+    from receipt_models import ReceiptItem
+
     item_list: List[Dict[str, str]] = []
 
     try:
@@ -285,14 +989,14 @@ def parse_lineitemgroups(line_item_groups: List[Dict[str, Any]]) -> List[Dict[st
                     ReceiptItem.model_validate(row)
                     item_list.append(row)
                 except ValidationError as e:
-                    logger.info(f"Skipping invalid line item: {e}")
+                    logger.info("Skipping invalid line item: %s", e)
                     continue
 
     except KeyError as e:
-        logger.error(f"Missing expected key in line item structure: {e}")
+        logger.error("Missing expected key in line item structure: %s", e)
         raise InvalidTextractResponse(f"LineItems - missing key: {str(e)}")
     except Exception as e:
-        logger.error(f"Error parsing line items: {e}", exc_info=True)
+        logger.error("Error parsing line items: %s", e, exc_info=True)
         raise InvalidTextractResponse(f"LineItems - parsing error: {str(e)}")
 
     return item_list
@@ -312,13 +1016,7 @@ def parse_summaryfields(summary_fields: List[Dict[str, Any]]) -> Dict[str, str]:
         InvalidTextractResponse: If summary field structure is invalid
     """
     important_fields: Dict[str, str] = {}
-
-    # hardcoded map of values to look for in the summary part
-    type_map = {
-        'INVOICE_RECEIPT_DATE': 'date',
-        'TOTAL': 'total',
-        'VENDOR_NAME': 'store_name',
-    }
+    type_map = SUMMARY_TYPE_MAP
 
     try:
         for summary in summary_fields:
@@ -328,10 +1026,10 @@ def parse_summaryfields(summary_fields: List[Dict[str, Any]]) -> Dict[str, str]:
                 important_fields[type_map[summary_type]] = value
 
     except KeyError as e:
-        logger.error(f"Missing expected key in summary field structure: {e}")
+        logger.error("Missing expected key in summary field structure: %s", e)
         raise InvalidTextractResponse(f"SummaryFields - missing key: {str(e)}")
     except Exception as e:
-        logger.error(f"Error parsing summary fields: {e}", exc_info=True)
+        logger.error("Error parsing summary fields: %s", e, exc_info=True)
         raise InvalidTextractResponse(f"SummaryFields - parsing error: {str(e)}")
 
     return important_fields
@@ -0,0 +1,330 @@
+"""
+End-to-end load test of the upload -> extract -> notify flow, without AWS.
+
+N simulated browser clients each ask accept-files-dev for presigned urls, PUT
+their receipts through them and wait on their websocket for the extractText
+results, exactly like the frontend. Everything runs in this process against
+the fakes of fake_aws.py and fake_textract.py:
+    - FakeS3 checks every presigned PUT and turns it into an S3 event, which
+      is handed to lambda_s3_textract on a pool of simulated lambda instances
+    - FakeGateway delivers websocket messages to the client that owns the
+      connection
+    - FakeTextract serves sample, synthetic or recorded responses with the
+      configured latency and throttling, behind the real rate limiter
+
+Reports throughput and p50/p95/p99 latencies of the presign request, of the
+upload -> result leg and of the whole round trip.
+
+Usage:
+    python load_test.py --clients 20 --files 5
+    python load_test.py --clients 50 --textract-latency 1.5 --throttle-rate 0.05
+    python load_test.py --responses response1.json response2.json --json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# applied unless already set, before the handlers read their configuration
+HARNESS_ENV = {
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_DEFAULT_REGION': 'us-west-1',
+    'BUCKET_NAME': 'receipts',
+    # every upload must reach Textract, and no state is left behind
+    'RESULT_CACHE_BACKEND': 'none',
+    'RESULT_STORE_BACKEND': 'none',
+    'IDEMPOTENCY_BACKEND': 'none',
+    # the generated receipts are headers only, there is nothing to downscale
+    'IMAGE_PREPROCESSING': 'off',
+    'LOG_LEVEL': 'WARNING',
+}
+
+
+def make_receipt_png(width: int = 800, height: int = 1600, size: int = 4096) -> bytes:
+    """
+    Build a unique PNG of roughly size bytes that passes the upload sniffing.
+
+    Only the header is meaningful; the rest is random bytes in a private chunk,
+    so no two receipts share a content hash.
+    """
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    ihdr = chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+    padding = chunk(b'prVt', os.urandom(max(0, size - 57)))
+    return b'\x89PNG\r\n\x1a\n' + ihdr + padding + chunk(b'IEND', b'')
+
+
+# ==================
+# Harness
+# ==================
+class Harness:
+    """The handlers wired to in-process fakes."""
+
+    def __init__(self, textract, lambda_concurrency: int, s3_latency: float, gateway_latency: float):
+        from fake_aws import FakeGateway, FakeS3
+        from rate_limiter import RateLimitedClient, get_rate_limiter
+
+        spec = importlib.util.spec_from_file_location('accept_files_dev', os.path.join(BACKEND_DIR, 'accept-files-dev.py'))
+        self.accept_files = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.accept_files)
+        import lambda_s3_textract
+        self.textract_lambda = lambda_s3_textract
+
+        self.textract = textract
+        self.s3 = FakeS3(on_object_created=self.dispatch_s3_event, latency=s3_latency)
+        self.gateway = FakeGateway(latency=gateway_latency)
+        self.lambda_pool = ThreadPoolExecutor(max_workers=lambda_concurrency)
+        self.lambda_errors = 0
+        self._lock = threading.Lock()
+
+        for module in (self.accept_files, self.textract_lambda):
+            module.get_s3_client = lambda: self.s3
+            module.get_gateway_client = lambda: self.gateway
+        self.textract_lambda._textract_client = RateLimitedClient(textract, get_rate_limiter())
+
+    def dispatch_s3_event(self, record: Dict[str, Any]) -> None:
+        # S3 invokes the lambda asynchronously, one record per object
+        self.lambda_pool.submit(self.invoke_textract_lambda, record)
+
+    def invoke_textract_lambda(self, record: Dict[str, Any]) -> None:
+        try:
+            self.textract_lambda.lambda_handler({'Records': [record]}, None)
+        except Exception as e:
+            print(f'lambda_s3_textract raised: {e!r}', file=sys.stderr)
+            with self._lock:
+                self.lambda_errors += 1
+
+    def close(self) -> None:
+        self.lambda_pool.shutdown(wait=True)
+
+
+class SimulatedClient:
+    """One browser session: request urls, upload, wait for every result."""
+
+    def __init__(self, harness: Harness, index: int, files: int, file_size: int,
+                 encodings: List[str], timeout: float):
+        from wire_encoding import ChunkAssembler
+
+        self.harness = harness
+        self.connection_id = f'load-{index}-{uuid4().hex[:8]}'
+        self.session_id = uuid4().hex
+        self.encodings = encodings
+        self.timeout = timeout
+        self.receipts = {
+            str(i): (f'receipt-{index}-{i}.png', make_receipt_png(size=file_size))
+            for i in range(files)
+        }
+        self.started_at = 0.0
+        self.presign_ms: Optional[float] = None
+        self.upload_failures = 0
+        # fileId -> monotonic time of the PUT / of the result, and the result's statusCode
+        self.uploaded_at: Dict[str, float] = {}
+        self.result_at: Dict[str, float] = {}
+        self.statuses: Dict[str, int] = {}
+        self._presigned: List[Dict[str, Any]] = []
+        self._assembler = ChunkAssembler()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def on_message(self, data: Any) -> None:
+        message = self._assembler.receive(data)
+        if message is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if message.get('type') == 'presignedUrls':
+                self._presigned.append(message)
+                results = [{'fileId': file_id, 'body': body} for file_id, body in message['cached_results'].items()]
+            elif message.get('type') == 'extractText':
+                results = message['results'] if 'results' in message else [message]
+            else:
+                return
+            for result in results:
+                self.result_at.setdefault(result['fileId'], now)
+                self.statuses.setdefault(result['fileId'], result['body'].get('statusCode'))
+            if len(self.result_at) >= len(self.receipts):
+                self._done.set()
+
+    def run(self) -> None:
+        self.harness.gateway.connect(self.connection_id, self.on_message)
+        self.started_at = time.monotonic()
+        body = {
+            'files': [
+                {'id': file_id, 'name': name, 'type': 'image/png', 'size': len(data)}
+                for file_id, (name, data) in self.receipts.items()
+            ],
+            'encodings': self.encodings,
+            'sessionId': self.session_id,
+        }
+        self.harness.accept_files.lambda_handler(
+            {'body': json.dumps(body), 'requestContext': {'connectionId': self.connection_id}},
+            None
+        )
+        self.presign_ms = (time.monotonic() - self.started_at) * 1000
+
+        file_ids = {name: file_id for file_id, (name, _) in self.receipts.items()}
+        for message in self._presigned:
+            for name, url in message['file_urls'].items():
+                file_id = file_ids[name]
+                headers = {
+                    'Content-Type': 'image/png',
+                    'x-amz-meta-connectionid': message['connectionId'],
+                    'x-amz-meta-fileid': file_id,
+                }
+                if message.get('encoding', 'json') != 'json':
+                    headers['x-amz-meta-encoding'] = message['encoding']
+                if message.get('sessionId'):
+                    headers['x-amz-meta-sessionid'] = message['sessionId']
+                self.uploaded_at[file_id] = time.monotonic()
+                if self.harness.s3.put_presigned(url, self.receipts[file_id][1], headers) != 200:
+                    self.upload_failures += 1
+
+        self._done.wait(self.timeout)
+        self.harness.gateway.disconnect(self.connection_id)
+
+
+# ==================
+# Running
+# ==================
+def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    from fake_textract import FakeTextract, recorded_response_factory, synthetic_response_factory
+    from metrics import percentile
+
+    if args.responses:
+        response_factory = recorded_response_factory(args.responses)
+    elif args.line_items:
+        response_factory = synthetic_response_factory(args.line_items)
+    else:
+        response_factory = None
+    textract = FakeTextract(
+        response_factory,
+        latency=args.textract_latency,
+        latency_jitter=args.textract_jitter,
+        throttle_rate=args.throttle_rate,
+    )
+    harness = Harness(textract, args.lambda_concurrency, args.s3_latency, args.gateway_latency)
+    clients = [
+        SimulatedClient(harness, index, args.files, args.file_size, args.encodings, args.timeout)
+        for index in range(args.clients)
+    ]
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        # simulated users arrive spread over the ramp-up period
+        futures = []
+        for client in clients:
+            futures.append(executor.submit(client.run))
+            if args.ramp_up:
+                time.sleep(args.ramp_up / args.clients)
+        for future in futures:
+            future.result()
+    elapsed = time.monotonic() - start
+    harness.close()
+
+    presign_ms = [client.presign_ms for client in clients if client.presign_ms is not None]
+    extract_ms: List[float] = []
+    total_ms: List[float] = []
+    statuses: Dict[str, int] = {}
+    for client in clients:
+        for file_id, result_at in client.result_at.items():
+            total_ms.append((result_at - client.started_at) * 1000)
+            if file_id in client.uploaded_at:
+                extract_ms.append((result_at - client.uploaded_at[file_id]) * 1000)
+        for status in client.statuses.values():
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    receipts = args.clients * args.files
+    completed = len(total_ms)
+    return {
+        'clients': args.clients,
+        'receipts': receipts,
+        'completed': completed,
+        'timed_out': receipts - completed,
+        'upload_failures': sum(client.upload_failures for client in clients),
+        'lambda_errors': harness.lambda_errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_per_s': round(completed / elapsed, 2) if elapsed else 0.0,
+        'statuses': statuses,
+        'latency_ms': {
+            name: {
+                'p50': round(percentile(values, 50), 1),
+                'p95': round(percentile(values, 95), 1),
+                'p99': round(percentile(values, 99), 1),
+                'max': round(max(values, default=0.0), 1),
+            }
+            for name, values in (('presign', presign_ms), ('upload_to_result', extract_ms), ('end_to_end', total_ms))
+        },
+        'textract_calls': dict(textract.calls),
+        'rate_limiter': harness.textract_lambda.get_rate_limiter().stats(),
+        'websocket_posts': harness.gateway.post_count,
+        's3_calls': dict(harness.s3.calls),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['clients']} client(s), {report['completed']}/{report['receipts']} receipt(s) "
+          f"in {report['elapsed_s']:.2f}s ({report['throughput_per_s']:.1f} receipts/s)")
+    header = f"{'latency ms':<20}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, stats in report['latency_ms'].items():
+        print(f"{name:<20}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+    print(f"result statuses: {report['statuses']}, timed out: {report['timed_out']}, "
+          f"upload failures: {report['upload_failures']}, lambda errors: {report['lambda_errors']}")
+    print(f"textract calls: {report['textract_calls']}")
+    print(f"rate limiter: {report['rate_limiter']}")
+    print(f"websocket posts: {report['websocket_posts']}, s3 calls: {report['s3_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=10, help='simulated browser sessions')
+    parser.add_argument('--files', type=int, default=5, help='receipts uploaded per client')
+    parser.add_argument('--file-size', type=int, default=4096, help='bytes per receipt')
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='seconds over which clients start')
+    parser.add_argument('--encodings', nargs='+', default=['json'], help='encodings clients accept, preferred first')
+    parser.add_argument('--lambda-concurrency', type=int, default=10,
+                        help='lambda_s3_textract invocations running at once')
+    parser.add_argument('--textract-latency', type=float, default=0.3, help='seconds per analyze_expense call')
+    parser.add_argument('--textract-jitter', type=float, default=0.2, help='random extra seconds per call')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of Textract calls throttled')
+    parser.add_argument('--textract-rate', type=float, help='initial Textract rate limit (TEXTRACT_RATE_LIMIT)')
+    parser.add_argument('--line-items', type=int, help='serve synthetic responses with this many line items')
+    parser.add_argument('--responses', nargs='+', help='recorded analyze_expense responses (JSON files) to replay')
+    parser.add_argument('--s3-latency', type=float, default=0.01, help='seconds per S3 call')
+    parser.add_argument('--gateway-latency', type=float, default=0.02, help='seconds per post_to_connection')
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds a client waits for its results')
+    parser.add_argument('--seed', type=int, help='seed for the simulated latency and throttling')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    for name, value in HARNESS_ENV.items():
+        os.environ.setdefault(name, value)
+    if args.textract_rate:
+        os.environ['TEXTRACT_RATE_LIMIT'] = str(args.textract_rate)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    report = run_load_test(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
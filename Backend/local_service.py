@@ -0,0 +1,286 @@
+"""
+Local service mode: the whole backend as one long-lived asyncio process.
+
+For on-prem and development deployments, one process replaces API Gateway,
+S3 and the two lambdas:
+
+    GET  /ws                      websocket endpoint. Every message is handled by
+                                  accept-files-dev.lambda_handler, as the gateway
+                                  would invoke it
+    PUT  /upload/<bucket>/<key>   upload endpoint for the presigned urls it hands
+                                  out, checked like S3 presigned PUTs
+    GET  /health                  queue depth and counters
+
+Uploads are stored in a local directory (fake_aws.FakeS3 with storage_dir).
+Every stored receipt is put on an internal work queue as an S3 event record.
+Worker tasks take up to SERVICE_BATCH_SIZE queued records at a time and run
+lambda_s3_textract.lambda_handler on a thread pool, which analyzes a batch
+concurrently; results go back over the websocket the upload came from. The
+handlers, clients, rate limiter and caches are created once and stay warm, so
+there are no cold starts and no gateway round trips. Several invocations run
+at once; METRICS and PROFILING keep their data per invocation (context
+variables), though the rate limiter stats and allocation snapshots are
+process wide.
+
+Textract is called for real (AWS credentials required) with documents sent as
+bytes, since it cannot read local storage. SERVICE_TEXTRACT=fake serves
+fake_textract responses instead, for development without AWS. Flows that need
+Textract to read S3 (asynchronous jobs for PDFs over ASYNC_PAGE_THRESHOLD
+pages) and multipart uploads are not available in this mode.
+
+Requires aiohttp (pip install aiohttp). Point the frontend at the service with
+VITE_SOCKET_GATEWAY_URL=ws://127.0.0.1:8080/ws.
+
+Environment:
+    SERVICE_HOST          listen address (default 127.0.0.1)
+    SERVICE_PORT          listen port (default 8080)
+    SERVICE_PUBLIC_URL    url browsers reach the service at (default http://<host>:<port>)
+    SERVICE_STORAGE_DIR   upload directory (default ./local-storage)
+    SERVICE_WORKERS       lambda_s3_textract invocations running at once (default 4)
+    SERVICE_BATCH_SIZE    most records handled by one invocation (default 8)
+    SERVICE_IO_THREADS    threads for websocket messages and uploads (default 16)
+    SERVICE_TEXTRACT      'aws' (default) or 'fake'
+
+Usage:
+    python local_service.py
+    SERVICE_TEXTRACT=fake SERVICE_PORT=9000 python local_service.py
+"""
+
+import asyncio
+import importlib.util
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
+from uuid import uuid4
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HOST = os.getenv('SERVICE_HOST', '127.0.0.1')
+PORT = int(os.getenv('SERVICE_PORT', '8080'))
+PUBLIC_URL = os.getenv('SERVICE_PUBLIC_URL', f'http://{HOST}:{PORT}')
+STORAGE_DIR = os.getenv('SERVICE_STORAGE_DIR', os.path.join(os.getcwd(), 'local-storage'))
+WORKERS = int(os.getenv('SERVICE_WORKERS', '4'))
+BATCH_SIZE = int(os.getenv('SERVICE_BATCH_SIZE', '8'))
+IO_THREADS = int(os.getenv('SERVICE_IO_THREADS', '16'))
+TEXTRACT_BACKEND = os.getenv('SERVICE_TEXTRACT', 'aws')
+
+UPLOAD_PATH = '/upload'
+# seconds a handler waits for a websocket message to be written
+SEND_TIMEOUT = 10
+# room for the request around the largest accepted file
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+# applied unless already set, before the handlers read their configuration
+SERVICE_ENV = {
+    'BUCKET_NAME': 'receipts',
+    # Textract cannot read the local storage
+    'TEXTRACT_SEND_BYTES': 'on',
+}
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'PUT, OPTIONS',
+}
+
+
+def load_handler(name: str, filename: str):
+    """Import a handler module from its (possibly hyphenated) file name."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(BACKEND_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LocalService:
+    """The handlers wired to local storage, an in-process gateway and a work queue."""
+
+    def __init__(self, storage_dir: str = STORAGE_DIR, public_url: str = PUBLIC_URL,
+                 workers: int = WORKERS, batch_size: int = BATCH_SIZE,
+                 textract_backend: str = TEXTRACT_BACKEND):
+        for name, value in SERVICE_ENV.items():
+            os.environ.setdefault(name, value)
+        from fake_aws import FakeGateway, FakeS3
+
+        import lambda_s3_textract
+
+        self.accept_files = load_handler('accept_files_dev', 'accept-files-dev.py')
+        self.textract_lambda = lambda_s3_textract
+
+        self.s3 = FakeS3(
+            on_object_created=self.enqueue_record,
+            endpoint_url=f"{public_url.rstrip('/')}{UPLOAD_PATH}",
+            storage_dir=storage_dir
+        )
+        # messages are delivered to the sockets, none are kept
+        self.gateway = FakeGateway(max_posts=0)
+        for module in (self.accept_files, self.textract_lambda):
+            module.get_s3_client = lambda: self.s3
+            module.get_gateway_client = lambda: self.gateway
+        if textract_backend == 'fake':
+            from fake_textract import FakeTextract
+            from rate_limiter import RateLimitedClient, get_rate_limiter
+
+            self.textract_lambda._textract_client = RateLimitedClient(FakeTextract(latency=0.5), get_rate_limiter())
+
+        self.workers = workers
+        self.batch_size = batch_size
+        self.io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='io')
+        self.lambda_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='textract')
+        self.counters: Dict[str, int] = {'messages': 0, 'uploads': 0, 'records': 0, 'invocations': 0, 'errors': 0}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        # the loop only keeps weak references to tasks, running ones are held here
+        self._message_tasks: Set[asyncio.Task] = set()
+
+    # work queue
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info('Local service started with %d worker(s), storage in %s', self.workers, self.s3.storage_dir)
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self.io_pool.shutdown(wait=False)
+        self.lambda_pool.shutdown(wait=True)
+
+    def enqueue_record(self, record: Dict[str, Any]) -> None:
+        # called by FakeS3 on an io thread once an upload is stored
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, record)
+
+    async def _work(self) -> None:
+        while True:
+            records = [await self.queue.get()]
+            # records that queued up meanwhile share one invocation
+            while len(records) < self.batch_size and not self.queue.empty():
+                records.append(self.queue.get_nowait())
+            try:
+                await self.loop.run_in_executor(
+                    self.lambda_pool, self.textract_lambda.lambda_handler, {'Records': records}, None
+                )
+                self.counters['invocations'] += 1
+            except Exception as e:
+                self.counters['errors'] += 1
+                logger.error(f'lambda_s3_textract failed on {len(records)} record(s): {e}', exc_info=True)
+            finally:
+                self.counters['records'] += len(records)
+                for _ in records:
+                    self.queue.task_done()
+
+    # websocket
+    async def handle_websocket(self, request):
+        from aiohttp import WSMsgType, web
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        connection_id = uuid4().hex
+        self.gateway.connect(connection_id, lambda data: self._send(ws, data))
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                self.counters['messages'] += 1
+                event = {
+                    'body': message.data,
+                    'requestContext': {
+                        'connectionId': connection_id,
+                        'eventType': 'MESSAGE',
+                        'requestId': uuid4().hex,
+                    },
+                }
+                # handled concurrently, like separate lambda invocations
+                task = asyncio.create_task(self._dispatch_message(event))
+                self._message_tasks.add(task)
+                task.add_done_callback(self._message_tasks.discard)
+        finally:
+            self.gateway.disconnect(connection_id)
+        return ws
+
+    async def _dispatch_message(self, event: Dict[str, Any]) -> None:
+        try:
+            await self.loop.run_in_executor(self.io_pool, self.accept_files.lambda_handler, event, None)
+        except Exception as e:
+            self.counters['errors'] += 1
+            logger.error(f'accept-files-dev failed: {e}', exc_info=True)
+
+    def _send(self, ws, data: Any) -> None:
+        # post_to_connection runs on handler threads, the socket belongs to the loop
+        from fake_aws import client_error
+
+        if ws.closed:
+            raise client_error('GoneException', 'PostToConnection')
+        future = asyncio.run_coroutine_threadsafe(ws.send_str(data), self.loop)
+        try:
+            future.result(SEND_TIMEOUT)
+        except Exception as e:
+            raise client_error('GoneException', 'PostToConnection', str(e))
+
+    # uploads
+    async def handle_upload(self, request):
+        from aiohttp import web
+
+        body = await request.read()
+        status = await self.loop.run_in_executor(
+            self.io_pool, self.s3.put_presigned, str(request.url), body, dict(request.headers)
+        )
+        if status == 200:
+            self.counters['uploads'] += 1
+        return web.Response(status=status, headers=CORS_HEADERS)
+
+    async def handle_preflight(self, request):
+        from aiohttp import web
+
+        headers = {
+            **CORS_HEADERS,
+            'Access-Control-Allow-Headers': request.headers.get('Access-Control-Request-Headers', '*'),
+        }
+        return web.Response(status=204, headers=headers)
+
+    async def handle_health(self, request):
+        from aiohttp import web
+
+        return web.json_response({'queued': self.queue.qsize(), **self.counters})
+
+
+def create_app(service: Optional[LocalService] = None):
+    """Build the aiohttp application of a service."""
+    try:
+        from aiohttp import web
+    except ImportError:
+        raise SystemExit('local_service.py requires aiohttp: pip install aiohttp')
+
+    service = service or LocalService()
+    app = web.Application(client_max_size=service.accept_files.MAX_FILE_SIZE + UPLOAD_OVERHEAD_BYTES)
+    app['service'] = service
+    app.router.add_get('/ws', service.handle_websocket)
+    app.router.add_put(UPLOAD_PATH + '/{path:.+}', service.handle_upload)
+    app.router.add_route('OPTIONS', UPLOAD_PATH + '/{path:.+}', service.handle_preflight)
+    app.router.add_get('/health', service.handle_health)
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        await service.stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main():
+    app = create_app()
+    from aiohttp import web
+
+    web.run_app(app, host=HOST, port=PORT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Cheap, structured logging shared by every backend module.
+
+    - get_logger sets each module logger to LOG_LEVEL, so INFO chatter can be
+      switched off in production without a code change. Info messages use
+      %-style arguments and are only formatted when the level is enabled.
+    - log_verbose logs large payloads (events, S3 and Textract responses) for
+      a sampled fraction of calls only, reduced to an allow-list of fields and
+      with every value truncated.
+    - LOG_FORMAT=json writes one JSON object per line, with the fields of
+      verbose records as top-level keys, for CloudWatch Logs Insights.
+
+Environment:
+    LOG_LEVEL            level of the backend loggers (default INFO)
+    LOG_FORMAT           'text' (default) or 'json'
+    LOG_SAMPLE_RATE      fraction of verbose records written (default 0.01);
+                         all of them when LOG_LEVEL=DEBUG
+    LOG_MAX_FIELD_CHARS  values of verbose records are truncated to this length (default 256)
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', '256'))
+
+# allow-lists of the payloads logged with log_verbose
+WEBSOCKET_EVENT_FIELDS = (
+    'requestContext.routeKey',
+    'requestContext.eventType',
+    'requestContext.connectionId',
+    'requestContext.requestId',
+    'body',
+)
+HEAD_OBJECT_FIELDS = ('ContentLength', 'ContentType', 'ETag', 'Metadata')
+TEXTRACT_RESPONSE_FIELDS = ('DocumentMetadata', 'ExpenseDocuments')
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging() -> None:
+    """Install the JSON formatter on the root handlers when LOG_FORMAT=json. Idempotent."""
+    global _configured
+    if _configured or LOG_FORMAT != 'json':
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        root = logging.getLogger()
+        if not root.handlers:
+            root.addHandler(logging.StreamHandler())
+        for handler in root.handlers:
+            handler.setFormatter(JsonFormatter())
+        _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Return a module logger set to LOG_LEVEL."""
+    configure_logging()
+    logger = logging.getLogger(name)
+    logger.setLevel(LOG_LEVEL)
+    return logger
+
+
+def truncate(value: Any, max_chars: int = MAX_FIELD_CHARS) -> Any:
+    """Shorten a value to at most max_chars characters of its JSON form."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    if len(text) <= max_chars:
+        return value
+    return f'{text[:max_chars]}...(+{len(text) - max_chars} chars)'
+
+
+def summarize(payload: Any, fields: Optional[Iterable[str]] = None,
+              max_chars: int = MAX_FIELD_CHARS) -> Dict[str, Any]:
+    """
+    Reduce a payload to an allow-list of fields with truncated values.
+
+    Args:
+        payload: Event or response to summarize
+        fields: Dotted paths of the fields to keep, e.g. 'requestContext.connectionId'.
+            All top-level fields when None
+        max_chars: Longest value kept, see truncate
+
+    Returns:
+        {path: truncated value} for every allowed field present in payload
+    """
+    if not isinstance(payload, dict):
+        return {'value': truncate(payload, max_chars)}
+    if fields is None:
+        fields = payload.keys()
+
+    summary: Dict[str, Any] = {}
+    for path in fields:
+        value: Any = payload
+        for part in path.split('.'):
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            summary[path] = truncate(value, max_chars)
+    return summary
+
+
+def log_verbose(logger: logging.Logger, message: str, payload: Any,
+                fields: Optional[Iterable[str]] = None,
+                sample_rate: float = LOG_SAMPLE_RATE) -> None:
+    """
+    Log a summary of a large payload for a sampled fraction of calls.
+
+    Nothing is formatted unless the record is actually written.
+
+    Args:
+        logger: Logger to write to, at INFO
+        message: Description of the payload, e.g. 'Event'
+        payload: Event or response to summarize
+        fields: Allow-list of dotted paths, see summarize
+        sample_rate: Fraction of calls logged; every call at DEBUG level
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if not logger.isEnabledFor(logging.DEBUG) and random.random() >= sample_rate:
+        return
+
+    summary = summarize(payload, fields)
+    if LOG_FORMAT == 'json':
+        logger.info(message, extra={'fields': summary})
+    else:
+        logger.info('%s: %s', message, json.dumps(summary, default=str))
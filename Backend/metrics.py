@@ -0,0 +1,225 @@
+"""
+Per-stage timings and counters emitted as CloudWatch Embedded Metric Format.
+
+A handler wrapped with metrics_scope collects, for one invocation:
+    - stage spans, e.g. `with span('analyze_expense'):`, in milliseconds
+    - values recorded with put_metric (payload sizes, line items, retries)
+and at the end prints them as one EMF JSON line. In Lambda, CloudWatch turns
+the line into metrics with p50/p95/p99 statistics per stage; locally it is a
+readable JSON log line (or appended to METRICS_FILE).
+
+The invocation being measured is held in a context variable, so invocations
+running concurrently in one process (local_service.py) keep their metrics
+apart. Worker threads do not inherit it; functions handed to them are wrapped
+with in_invocation.
+
+Metrics are off unless METRICS=on. When off, span returns a shared no-op
+context manager and put_metric returns immediately, so the instrumentation
+costs a flag check.
+
+Environment:
+    METRICS            'on' / 'off' (default off)
+    METRICS_NAMESPACE  CloudWatch namespace (default ReceiptScanner)
+    METRICS_FILE       append EMF lines to this file instead of stdout
+"""
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS', 'off') == 'on'
+NAMESPACE = os.getenv('METRICS_NAMESPACE', 'ReceiptScanner')
+METRICS_FILE = os.getenv('METRICS_FILE')
+
+# EMF limits: 100 metrics per document and 100 values per metric
+MAX_METRICS_PER_DOCUMENT = 100
+MAX_VALUES_PER_METRIC = 100
+
+MILLISECONDS = 'Milliseconds'
+BYTES = 'Bytes'
+COUNT = 'Count'
+
+
+class MetricsContext:
+    """Metric values and properties collected during one invocation. Thread safe."""
+
+    def __init__(self, handler: str):
+        self.dimensions = {'Handler': handler}
+        self.properties: Dict[str, Any] = {}
+        self._values: Dict[str, Tuple[str, List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def put_metric(self, name: str, value: float, unit: str = COUNT) -> None:
+        with self._lock:
+            self._values.setdefault(name, (unit, []))[1].append(value)
+
+    def set_property(self, key: str, value: Any) -> None:
+        self.properties[key] = value
+
+    def to_emf(self, timestamp: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Serialize to EMF documents, split to stay within the EMF limits."""
+        timestamp_ms = int((timestamp or time.time()) * 1000)
+        with self._lock:
+            metrics = [(name, unit, list(values)) for name, (unit, values) in self._values.items()]
+
+        documents: List[Dict[str, Any]] = []
+        # metrics with more than MAX_VALUES_PER_METRIC values continue in later documents
+        while metrics:
+            batch = metrics[:MAX_METRICS_PER_DOCUMENT]
+            metrics = metrics[MAX_METRICS_PER_DOCUMENT:]
+            document: Dict[str, Any] = {
+                '_aws': {
+                    'Timestamp': timestamp_ms,
+                    'CloudWatchMetrics': [{
+                        'Namespace': NAMESPACE,
+                        'Dimensions': [list(self.dimensions)],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, unit, _ in batch],
+                    }],
+                },
+                **self.dimensions,
+                **self.properties,
+            }
+            for name, unit, values in batch:
+                document[name] = values[:MAX_VALUES_PER_METRIC]
+                if len(values) > MAX_VALUES_PER_METRIC:
+                    metrics.append((name, unit, values[MAX_VALUES_PER_METRIC:]))
+            documents.append(document)
+        return documents
+
+
+# the invocation being measured; worker threads of that invocation report into
+# it through in_invocation
+_current: contextvars.ContextVar[Optional[MetricsContext]] = contextvars.ContextVar('metrics', default=None)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """
+    Time a stage of the current invocation, recorded in milliseconds.
+
+    Usage:
+        with span('head_object'):
+            ...
+    """
+    context = _current.get()
+    if context is None:
+        return _NULL_SPAN
+    return _timed(context, name)
+
+
+@contextmanager
+def _timed(context: MetricsContext, name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        context.put_metric(name, round((time.perf_counter() - start) * 1000, 3), MILLISECONDS)
+
+
+def put_metric(name: str, value: float, unit: str = COUNT) -> None:
+    """Record a value for the current invocation, if it is being measured."""
+    context = _current.get()
+    if context is not None:
+        context.put_metric(name, value, unit)
+
+
+def set_property(key: str, value: Any) -> None:
+    """Attach a searchable, non-metric field (e.g. a request id) to the current invocation."""
+    context = _current.get()
+    if context is not None:
+        context.set_property(key, value)
+
+
+def in_invocation(func: Callable) -> Callable:
+    """
+    Bind func to the invocation it is created in, for running on worker threads.
+
+    Threads start in an empty context; the wrapper runs func in a copy of the
+    creating thread's context, so the metrics and profile of the invocation
+    (see profiling.py) are the ones recorded into.
+
+    Usage:
+        executor.map(in_invocation(process_record), records)
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # a context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def emit(context: MetricsContext) -> None:
+    """Write the EMF documents of a finished invocation."""
+    lines = [json.dumps(document) for document in context.to_emf()]
+    if not lines:
+        return
+    if METRICS_FILE:
+        with open(METRICS_FILE, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+    else:
+        # EMF is picked up from the function's stdout
+        print('\n'.join(lines), flush=True)
+
+
+def metrics_scope(handler: str) -> Callable:
+    """
+    Decorator measuring every invocation of a lambda handler.
+
+    Records the total duration as 'invocation' and emits the collected metrics
+    when the handler returns or raises. A no-op unless METRICS=on.
+    """
+    def decorator(func: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(event, context):
+            metrics_context = MetricsContext(handler)
+            request_id = getattr(context, 'aws_request_id', None)
+            if request_id:
+                metrics_context.set_property('RequestId', request_id)
+            token = _current.set(metrics_context)
+            start = time.perf_counter()
+            try:
+                return func(event, context)
+            finally:
+                metrics_context.put_metric('invocation', round((time.perf_counter() - start) * 1000, 3), MILLISECONDS)
+                _current.reset(token)
+                try:
+                    emit(metrics_context)
+                except Exception as e:
+                    logger.warning('Failed to emit metrics: %s', e)
+        return wrapper
+    return decorator
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the pct-th percentile (0-100) of values, interpolated between ranks, 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
@@ -0,0 +1,324 @@
+"""
+Presigned S3 multipart uploads for large receipts and scanned PDFs.
+
+The browser uploads a file as numbered parts straight to S3, in parallel
+and with any failed part retried on its own:
+    1. create_upload     starts the upload and presigns a URL for every part
+    2. PUT each part     to its URL (any order, concurrently)
+    3. complete_upload   stitches the uploaded parts into the final object
+or abort_upload to throw the parts away. An interrupted upload is resumed with
+presign_parts, which reports the parts S3 already has and presigns the rest.
+
+create_upload also returns an uploadToken, an HMAC of the key and uploadId
+bound to the session (or connection) that created the upload. Every later
+step must present it (check_upload_token), so nobody else can sign, complete
+or abort the upload. Set UPLOAD_TOKEN_SECRET to the same value for every
+container; without it each container signs with its own random secret and
+an upload can only be continued by the container that created it.
+
+The connectionId / fileId metadata is attached when the upload is created, so
+the completed object looks exactly like a single presigned PUT to
+lambda_s3_textract. Its S3 trigger must include
+s3:ObjectCreated:CompleteMultipartUpload (or s3:ObjectCreated:*), and the
+bucket should have an AbortIncompleteMultipartUpload lifecycle rule so parts
+of abandoned uploads do not accumulate.
+"""
+
+import hashlib
+import hmac
+import math
+import os
+import secrets
+from typing import Any, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# S3 requires every part but the last to be at least 5MB, and allows 10000 parts
+MIN_PART_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_PARTS = 10000
+PART_SIZE = max(MIN_PART_SIZE, int(os.getenv('MULTIPART_PART_SIZE', str(8 * 1024 * 1024))))  # 8MB
+# 500MB is the largest document asynchronous Textract accepts
+MAX_MULTIPART_FILE_SIZE = int(os.getenv('MAX_MULTIPART_FILE_SIZE', str(500 * 1024 * 1024)))
+# only PDFs get the asynchronous limit, Textract rejects JPEG / PNG over 10MB on
+# both the synchronous and asynchronous paths
+MAX_MULTIPART_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
+PDF_CONTENT_TYPE = 'application/pdf'
+URL_EXPIRES_IN = 3600  # seconds
+UPLOAD_TOKEN_SECRET = os.getenv('UPLOAD_TOKEN_SECRET', '').encode()
+if not UPLOAD_TOKEN_SECRET:
+    logger.warning('UPLOAD_TOKEN_SECRET is not set, multipart uploads can only be continued '
+                   'by the container that created them')
+    UPLOAD_TOKEN_SECRET = secrets.token_bytes(32)
+
+
+class MultipartUploadError(Exception):
+    """Exception raised when a multipart upload request cannot be served."""
+    def __init__(self, message: str, status_code: int = 400):
+        self.message = message
+        self.status_code = status_code
+        super().__init__(self.message)
+
+
+def upload_token(key: str, upload_id: str, owner: str) -> str:
+    """
+    Sign an upload for its owner.
+
+    Args:
+        key: Object key given by create_upload
+        upload_id: UploadId given by create_upload
+        owner: Session id, or connection id for clients without a session
+
+    Returns:
+        Hex HMAC-SHA256 of key, upload_id and owner
+    """
+    signed = '\n'.join([key, upload_id, owner])
+    return hmac.new(UPLOAD_TOKEN_SECRET, signed.encode(), hashlib.sha256).hexdigest()
+
+
+def check_upload_token(key: str, upload_id: str, owner: str, token: Any) -> None:
+    """
+    Check that an upload was created by owner.
+
+    Raises:
+        MultipartUploadError: If token is missing or was issued for another upload or owner
+    """
+    if not isinstance(token, str) or not hmac.compare_digest(token, upload_token(key, upload_id, owner)):
+        raise MultipartUploadError(f'Upload {upload_id} does not belong to this session', 403)
+
+
+def get_max_file_size(content_type: str) -> int:
+    """Return the largest file of this content type Textract can analyze."""
+    return MAX_MULTIPART_FILE_SIZE if content_type == PDF_CONTENT_TYPE else MAX_MULTIPART_IMAGE_SIZE
+
+
+def is_integer(value: Any) -> bool:
+    # bool is an int subclass, but never a size or part number
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def get_part_size(file_size: int) -> int:
+    """Return the part size for a file, grown if needed to stay within MAX_PARTS."""
+    return max(PART_SIZE, math.ceil(file_size / MAX_PARTS))
+
+
+def get_part_count(file_size: int, part_size: int) -> int:
+    return max(1, math.ceil(file_size / part_size))
+
+
+def presign_part_urls(s3_client, bucket: str, key: str, upload_id: str,
+                      part_numbers: List[int]) -> Dict[int, str]:
+    """
+    Presign an upload_part URL for each part number.
+
+    Returns:
+        Dictionary of part number to presigned PUT URL
+    """
+    return {
+        part_number: s3_client.generate_presigned_url(
+            ClientMethod='upload_part',
+            Params={
+                'Bucket': bucket,
+                'Key': key,
+                'UploadId': upload_id,
+                'PartNumber': part_number,
+            },
+            ExpiresIn=URL_EXPIRES_IN
+        )
+        for part_number in part_numbers
+    }
+
+
+def list_uploaded_parts(s3_client, bucket: str, key: str, upload_id: str) -> List[Dict[str, Any]]:
+    """
+    List the parts S3 has received so far.
+
+    Returns:
+        [{'PartNumber', 'ETag', 'Size'}, ...] ordered by part number
+
+    Raises:
+        MultipartUploadError: If the upload does not exist (completed or aborted)
+    """
+    parts: List[Dict[str, Any]] = []
+    params: Dict[str, Any] = {'Bucket': bucket, 'Key': key, 'UploadId': upload_id}
+    try:
+        while True:
+            response = s3_client.list_parts(**params)
+            parts.extend(
+                {'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']}
+                for part in response.get('Parts', [])
+            )
+            if not response.get('IsTruncated'):
+                return parts
+            params['PartNumberMarker'] = response['NextPartNumberMarker']
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+            raise MultipartUploadError(f'Upload {upload_id} does not exist', 404)
+        raise
+
+
+def create_upload(s3_client, bucket: str, key: str, content_type: str, file_size: int,
+                  metadata: Dict[str, str], owner: str) -> Dict[str, Any]:
+    """
+    Start a multipart upload and presign a URL for every part.
+
+    Args:
+        s3_client: Boto3 S3 client
+        bucket: Name of the upload bucket
+        key: Object key of the final object
+        content_type: MIME type of the file
+        file_size: Size of the file in bytes, used to plan the parts
+        metadata: Object metadata, e.g. connectionId and fileId
+        owner: Session or connection the upload token is bound to
+
+    Returns:
+        {'key', 'uploadId', 'uploadToken', 'partSize', 'partCount', 'partUrls'}
+
+    Raises:
+        MultipartUploadError: If the file size is invalid or too large for its content type
+    """
+    if not is_integer(file_size) or file_size < 0:
+        raise MultipartUploadError('File size must be a non-negative integer')
+    max_file_size = get_max_file_size(content_type)
+    if file_size > max_file_size:
+        raise MultipartUploadError(f'File is over the {max_file_size // (1024 * 1024)}MB limit')
+
+    response = s3_client.create_multipart_upload(
+        Bucket=bucket,
+        Key=key,
+        ContentType=content_type,
+        Metadata=metadata
+    )
+    upload_id = response['UploadId']
+
+    part_size = get_part_size(file_size)
+    part_count = get_part_count(file_size, part_size)
+    logger.info('Created multipart upload %s for %s (%d part(s) of %d bytes)', upload_id, key, part_count, part_size)
+
+    return {
+        'key': key,
+        'uploadId': upload_id,
+        'uploadToken': upload_token(key, upload_id, owner),
+        'partSize': part_size,
+        'partCount': part_count,
+        'partUrls': presign_part_urls(s3_client, bucket, key, upload_id, list(range(1, part_count + 1))),
+    }
+
+
+def presign_parts(s3_client, bucket: str, key: str, upload_id: str, part_count: int,
+                  part_numbers: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Resume an upload: report the parts S3 already has and presign the others.
+
+    Args:
+        s3_client: Boto3 S3 client
+        bucket: Name of the upload bucket
+        key: Object key given by create_upload
+        upload_id: UploadId given by create_upload
+        part_count: Total number of parts of the upload
+        part_numbers: Parts to presign, defaults to every part not yet uploaded
+
+    Returns:
+        {'key', 'uploadId', 'uploadedParts', 'partUrls'}
+
+    Raises:
+        MultipartUploadError: If a part number is out of range or the upload does not exist
+    """
+    if not is_integer(part_count) or not 1 <= part_count <= MAX_PARTS:
+        raise MultipartUploadError(f'partCount must be between 1 and {MAX_PARTS}')
+    if part_numbers is not None and (
+            not isinstance(part_numbers, list) or not all(is_integer(number) for number in part_numbers)):
+        raise MultipartUploadError('partNumbers must be a list of integers')
+
+    uploaded_parts = list_uploaded_parts(s3_client, bucket, key, upload_id)
+    if part_numbers is None:
+        uploaded = {part['PartNumber'] for part in uploaded_parts}
+        part_numbers = [number for number in range(1, part_count + 1) if number not in uploaded]
+    elif any(not 1 <= number <= part_count for number in part_numbers):
+        raise MultipartUploadError(f'Part numbers must be between 1 and {part_count}')
+
+    return {
+        'key': key,
+        'uploadId': upload_id,
+        'uploadedParts': uploaded_parts,
+        'partUrls': presign_part_urls(s3_client, bucket, key, upload_id, part_numbers),
+    }
+
+
+def complete_upload(s3_client, bucket: str, key: str, upload_id: str,
+                    parts: Optional[List[Dict[str, Any]]] = None,
+                    part_count: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Assemble the uploaded parts into the final object, which triggers lambda_s3_textract.
+
+    Args:
+        s3_client: Boto3 S3 client
+        bucket: Name of the upload bucket
+        key: Object key given by create_upload
+        upload_id: UploadId given by create_upload
+        parts: [{'PartNumber', 'ETag'}, ...] as returned by the part PUTs. When
+            omitted the parts are listed from S3, so browsers that cannot read
+            the ETag header can still complete
+        part_count: Expected number of parts; when given, completing with parts
+            missing is refused instead of producing a truncated document
+
+    Returns:
+        {'key', 'uploadId', 'partCount'}
+
+    Raises:
+        MultipartUploadError: If parts are malformed or missing, or S3 rejects them
+    """
+    if parts is None:
+        parts = list_uploaded_parts(s3_client, bucket, key, upload_id)
+    if not isinstance(parts, list) or not all(
+            isinstance(part, dict) and is_integer(part.get('PartNumber'))
+            and isinstance(part.get('ETag'), str) for part in parts):
+        raise MultipartUploadError('parts must be a list of {PartNumber, ETag}')
+    if not parts:
+        raise MultipartUploadError('No parts have been uploaded')
+    if part_count is not None:
+        if not is_integer(part_count) or not 1 <= part_count <= MAX_PARTS:
+            raise MultipartUploadError(f'partCount must be between 1 and {MAX_PARTS}')
+        missing = set(range(1, part_count + 1)) - {part['PartNumber'] for part in parts}
+        if missing:
+            raise MultipartUploadError(f'Parts {sorted(missing)} have not been uploaded')
+
+    completed_parts = sorted(
+        ({'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in parts),
+        key=lambda part: part['PartNumber']
+    )
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': completed_parts}
+        )
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code in ('InvalidPart', 'InvalidPartOrder', 'EntityTooSmall', 'NoSuchUpload'):
+            raise MultipartUploadError(f'Could not complete upload {upload_id}: {code}')
+        raise
+
+    logger.info('Completed multipart upload %s for %s (%d part(s))', upload_id, key, len(completed_parts))
+    return {'key': key, 'uploadId': upload_id, 'partCount': len(completed_parts)}
+
+
+def abort_upload(s3_client, bucket: str, key: str, upload_id: str) -> Dict[str, Any]:
+    """
+    Abort an upload and delete the parts uploaded so far.
+
+    Returns:
+        {'key', 'uploadId'}
+    """
+    try:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+    except ClientError as e:
+        # aborting twice is not an error
+        if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+            raise
+    logger.info('Aborted multipart upload %s for %s', upload_id, key)
+    return {'key': key, 'uploadId': upload_id}
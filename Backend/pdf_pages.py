@@ -0,0 +1,143 @@
+"""
+Helpers to fan a multi-page PDF out to Textract one page at a time.
+
+Counting and splitting require pypdf. Without it, or for PDFs that cannot be
+read, count_pdf_pages returns 1 and split_pdf_pages returns the document
+unchanged, so it is analyzed whole.
+"""
+
+import io
+from typing import Any, Dict, List, Tuple
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+PDF_CONTENT_TYPE = 'application/pdf'
+# summary field found on the last page of a receipt
+RECEIPT_END_FIELD = 'TOTAL'
+
+
+def is_pdf(key: str, content_type: str = '') -> bool:
+    """Return True if the object is a PDF, judged by content type or extension."""
+    return content_type == PDF_CONTENT_TYPE or key.lower().endswith('.pdf')
+
+
+def count_pdf_pages(document: bytes) -> int:
+    """Return the number of pages of a PDF without rewriting it, 1 if it cannot be read."""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return 1
+
+    try:
+        return max(1, len(PdfReader(io.BytesIO(document)).pages))
+    except Exception as e:
+        logger.warning('Failed to count PDF pages: %s', e)
+        return 1
+
+
+def split_pdf_pages(document: bytes) -> List[bytes]:
+    """
+    Split a PDF into single-page PDFs.
+
+    Args:
+        document: Raw PDF contents
+
+    Returns:
+        One single-page PDF per page, or [document] if it could not be split
+    """
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        logger.warning('pypdf is not installed, analyzing PDF as a single document')
+        return [document]
+
+    try:
+        reader = PdfReader(io.BytesIO(document))
+        if len(reader.pages) <= 1:
+            return [document]
+
+        pages: List[bytes] = []
+        for page in reader.pages:
+            writer = PdfWriter()
+            writer.add_page(page)
+            buffer = io.BytesIO()
+            writer.write(buffer)
+            pages.append(buffer.getvalue())
+        return pages
+
+    except Exception as e:
+        logger.warning('Failed to split PDF, analyzing it as a single document: %s', e)
+        return [document]
+
+
+def merge_expense_responses(page_responses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge per-page analyze_expense responses into one response for the whole PDF.
+
+    A PDF may hold several receipts, or one long receipt spanning pages (items
+    on the first, total on the last). A receipt is taken to end at the page
+    carrying its TOTAL: the expense documents of each page are folded into the
+    current receipt until one with a TOTAL, and the next page starts a new
+    receipt. Pages after the last TOTAL belong to the last receipt.
+
+    Within a receipt line items of every page are kept, and each summary field
+    type is taken from the first page that has it, so a later page cannot
+    overwrite e.g. the vendor. Field page numbers refer to the original document.
+
+    Args:
+        page_responses: analyze_expense responses, in page order
+
+    Returns:
+        Response shaped like analyze_expense output with one ExpenseDocument
+        per receipt
+    """
+    receipts: List[List[Tuple[int, Dict[str, Any]]]] = []
+    current: List[Tuple[int, Dict[str, Any]]] = []
+    for page_number, response in enumerate(page_responses, start=1):
+        for doc in response.get('ExpenseDocuments', []):
+            current.append((page_number, doc))
+            if any(_field_type(field) == RECEIPT_END_FIELD for field in doc.get('SummaryFields', [])):
+                receipts.append(current)
+                current = []
+    if current:
+        if receipts:
+            receipts[-1].extend(current)
+        else:
+            receipts.append(current)
+
+    return {
+        'DocumentMetadata': {'Pages': len(page_responses)},
+        'ExpenseDocuments': [
+            _merge_receipt(index, docs) for index, docs in enumerate(receipts, start=1)
+        ],
+    }
+
+
+def _merge_receipt(index: int, docs: List[Tuple[int, Dict[str, Any]]]) -> Dict[str, Any]:
+    summary_fields: List[Dict[str, Any]] = []
+    line_item_groups: List[Dict[str, Any]] = []
+    # field type -> page it is taken from
+    field_pages: Dict[str, int] = {}
+
+    for page_number, doc in docs:
+        for field in doc.get('SummaryFields', []):
+            field_type = _field_type(field)
+            if field_pages.setdefault(field_type, page_number) == page_number:
+                summary_fields.append({**field, 'PageNumber': page_number})
+        for group in doc.get('LineItemGroups', []):
+            line_item_groups.append({
+                **group,
+                'LineItemGroupIndex': len(line_item_groups) + 1,
+            })
+
+    return {
+        'ExpenseIndex': index,
+        'SummaryFields': summary_fields,
+        'LineItemGroups': line_item_groups,
+    }
+
+
+def _field_type(field: Dict[str, Any]) -> Any:
+    return field.get('Type', {}).get('Text')
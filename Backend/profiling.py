@@ -0,0 +1,246 @@
+"""
+Opt-in CPU and allocation profiling of lambda invocations.
+
+A handler wrapped with profile_scope is, when profiling is switched on, run
+under cProfile with tracemalloc tracing. At the end of the invocation three
+files are written for offline analysis:
+
+    <name>.prof        cProfile stats, for pstats / snakeviz
+    <name>.tracemalloc tracemalloc snapshot, for tracemalloc.Snapshot.load
+    <name>.txt         top functions by cumulative time and top allocating lines
+
+Before Python 3.12, cProfile only sees the thread it runs on, so work handed
+to worker threads is profiled by wrapping the worker function with profiled();
+the profiles of all threads are merged into one .prof file. From 3.12 cProfile
+is built on sys.monitoring, which allows one active profiler per process but
+sees every thread, so the invocation's profiler covers its workers and
+profiled() adds nothing. tracemalloc covers every thread.
+
+The invocation being profiled is held in a context variable, which worker
+threads get through metrics.in_invocation. When invocations run concurrently in
+one process (local_service.py), tracemalloc runs until the last of them ends,
+and each snapshot (and, from 3.12, each profile) also includes the work of the
+others.
+
+Environment:
+    PROFILING              'on' profiles every invocation (default off)
+    PROFILING_SAMPLE_RATE  fraction of invocations profiled when PROFILING is off, e.g. 0.01
+    PROFILING_DIR          local output directory (default <tmp>/receipt-profiles)
+    PROFILING_BUCKET       also upload the files to this bucket under finished/profiles/
+    PROFILING_FRAMES       traceback depth stored by tracemalloc (default 10)
+
+When neither PROFILING nor PROFILING_SAMPLE_RATE is set, profile_scope and
+profiled return the function unchanged.
+"""
+
+import contextvars
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, List, Optional
+from uuid import uuid4
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+PROFILING = os.getenv('PROFILING', 'off') == 'on'
+SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_ENABLED = PROFILING or SAMPLE_RATE > 0
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'receipt-profiles'))
+PROFILING_BUCKET = os.getenv('PROFILING_BUCKET')
+TRACEMALLOC_FRAMES = int(os.getenv('PROFILING_FRAMES', '10'))
+
+# one profiler per thread before 3.12; from 3.12 a second enable() raises ValueError
+PER_THREAD_PROFILERS = sys.version_info < (3, 12)
+
+# outside uploads/, so profiles never trigger the S3 lambda
+PROFILE_PREFIX = 'finished/profiles/'
+# entries listed in the .txt summary
+SUMMARY_LIMIT = 30
+
+
+class ProfileSession:
+    """The cProfile profiles of one invocation, one per thread that did work."""
+
+    def __init__(self, handler: str, request_id: Optional[str] = None):
+        self.handler = handler
+        self.name = f"{handler}-{time.strftime('%Y%m%dT%H%M%S')}-{request_id or uuid4().hex[:8]}"
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Call func on this thread under a new profiler.
+
+        When another profiler is already active in the process, func runs
+        unprofiled rather than failing.
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            logger.warning('Profiling %s skipped on this thread: %s', self.name, e)
+            return func(*args, **kwargs)
+        _local.profiler = profiler
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _local.profiler = None
+            with self._lock:
+                self.profiles.append(profiler)
+
+    def stats(self) -> pstats.Stats:
+        """Merge the profiles of every thread."""
+        with self._lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(profiles[0])
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        return stats
+
+
+# the invocation being profiled; worker threads of that invocation report into it
+_session: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar('profile', default=None)
+# the profiler running on the current thread, cProfile cannot nest on one thread
+_local = threading.local()
+
+# tracemalloc is process wide: started by the first profiled invocation and
+# stopped after the last one, unless something else had started it
+_tracing_lock = threading.Lock()
+_tracing_sessions = 0
+_started_tracing = False
+
+
+def _start_tracing() -> None:
+    global _tracing_sessions, _started_tracing
+    with _tracing_lock:
+        if _tracing_sessions == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _started_tracing = True
+        _tracing_sessions += 1
+
+
+def _stop_tracing() -> tracemalloc.Snapshot:
+    """Take the snapshot of an ending invocation, stopping tracemalloc after the last one."""
+    global _tracing_sessions, _started_tracing
+    with _tracing_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _tracing_sessions -= 1
+        if _tracing_sessions == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+    return snapshot
+
+
+def should_profile() -> bool:
+    """Decide whether this invocation is profiled."""
+    return PROFILING or random.random() < SAMPLE_RATE
+
+
+def profiled(func: Callable) -> Callable:
+    """
+    Wrap a function run on worker threads, so its work shows up in the profile.
+
+    Outside a profiled invocation, or on a thread already being profiled, the
+    wrapper just calls func. From Python 3.12 the invocation's profiler already
+    sees every thread, so func is returned unchanged.
+    """
+    if not PROFILING_ENABLED or not PER_THREAD_PROFILERS:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _session.get()
+        if session is None or getattr(_local, 'profiler', None) is not None:
+            return func(*args, **kwargs)
+        return session.run(func, *args, **kwargs)
+    return wrapper
+
+
+def profile_scope(handler: str) -> Callable:
+    """
+    Decorator profiling sampled invocations of a lambda handler.
+
+    Profiles are written after the handler returns or raises; failing to write
+    them is logged and never fails the invocation.
+    """
+    def decorator(func: Callable) -> Callable:
+        if not PROFILING_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(event, context):
+            if not should_profile():
+                return func(event, context)
+
+            session = ProfileSession(handler, getattr(context, 'aws_request_id', None))
+            _start_tracing()
+            token = _session.set(session)
+            try:
+                return session.run(func, event, context)
+            finally:
+                _session.reset(token)
+                snapshot = _stop_tracing()
+                # no profile when another profiler was already active
+                if session.profiles:
+                    try:
+                        paths = write_profile(session, snapshot)
+                        if PROFILING_BUCKET:
+                            upload_profile(paths, handler)
+                    except Exception as e:
+                        logger.warning('Failed to write profile %s: %s', session.name, e)
+        return wrapper
+    return decorator
+
+
+def write_profile(session: ProfileSession, snapshot: tracemalloc.Snapshot,
+                  directory: str = PROFILING_DIR) -> List[str]:
+    """
+    Write the profile files of a finished invocation.
+
+    Returns:
+        Paths of the .prof, .tracemalloc and .txt files
+    """
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, session.name)
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+
+    stats = session.stats()
+    stats.dump_stats(f'{base}.prof')
+    snapshot.dump(f'{base}.tracemalloc')
+
+    summary = io.StringIO()
+    pstats.Stats(f'{base}.prof', stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LIMIT)
+    summary.write(f'Top {SUMMARY_LIMIT} allocating lines:\n')
+    for stat in snapshot.statistics('lineno')[:SUMMARY_LIMIT]:
+        summary.write(f'{stat}\n')
+    with open(f'{base}.txt', 'w') as f:
+        f.write(summary.getvalue())
+
+    logger.info('Profile written to %s.prof / .tracemalloc / .txt', base)
+    return [f'{base}.prof', f'{base}.tracemalloc', f'{base}.txt']
+
+
+def upload_profile(paths: List[str], handler: str, bucket: Optional[str] = PROFILING_BUCKET) -> None:
+    """Copy profile files to s3://bucket/finished/profiles/<handler>/."""
+    from aws_clients import get_client
+
+    s3_client = get_client('s3')
+    for path in paths:
+        key = f'{PROFILE_PREFIX}{handler}/{os.path.basename(path)}'
+        s3_client.upload_file(path, bucket, key)
+        logger.info('Profile uploaded to s3://%s/%s', bucket, key)
@@ -0,0 +1,243 @@
+"""
+Client-side rate governor for Textract calls.
+
+A token bucket whose refill rate adapts to throttling (AIMD): every successful
+call nudges the rate up additively, every throttle response halves it.
+Throttled calls are retried with full-jitter exponential backoff, and so are
+transient failures (5xx responses, connection errors and timeouts), which
+leave the rate alone. The wrapped clients are created with botocore retries
+off, so every retry is paced by the limiter.
+
+The limiter is shared by every thread of a process, so a lambda fanning out
+over many records or PDF pages does not stampede Textract:
+
+    textract_client = RateLimitedClient(boto3.client('textract'), get_rate_limiter())
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Error codes Textract returns when it is over capacity
+THROTTLE_ERROR_CODES = {
+    'ThrottlingException',
+    'ProvisionedThroughputExceededException',
+    'LimitExceededException',
+}
+
+# Error codes of server-side failures worth retrying, as botocore's standard mode does
+TRANSIENT_ERROR_CODES = {
+    'InternalServerError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'RequestTimeout',
+    'RequestTimeoutException',
+}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+# Client methods that go through the limiter
+RATE_LIMITED_OPERATIONS = {
+    'analyze_expense',
+    'start_expense_analysis',
+    'get_expense_analysis',
+}
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """Return True if error is a botocore ClientError caused by throttling."""
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Return True if error is a server-side failure, connection error or timeout."""
+    from botocore.exceptions import ConnectionError, HTTPClientError
+
+    # connection failures and read / connect timeouts
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return True
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return (response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES
+            or response.get('ResponseMetadata', {}).get('HTTPStatusCode') in TRANSIENT_STATUS_CODES)
+
+
+class AdaptiveRateLimiter:
+    """
+    Thread-safe AIMD token bucket with throttling-aware retries.
+
+    Args:
+        rate: Initial requests per second
+        min_rate: Floor the rate never decreases below
+        max_rate: Ceiling the rate never increases above
+        increase: Requests per second added after every success
+        decrease: Factor the rate is multiplied by after a throttle. Throttles
+            within decrease_cooldown seconds of the last decrease count once,
+            so a burst of concurrent rejections does not collapse the rate
+        decrease_cooldown: Seconds between two multiplicative decreases
+        max_retries: Retries of a throttled call before the error is raised
+        max_transient_retries: Retries of a call failing transiently before
+            the error is raised
+        base_delay: First retry backoff in seconds, doubled per attempt
+        max_delay: Upper bound on a single retry backoff
+    """
+
+    def __init__(self, rate: float = 5.0, min_rate: float = 0.5, max_rate: float = 50.0,
+                 increase: float = 0.5, decrease: float = 0.5, decrease_cooldown: float = 1.0,
+                 max_retries: int = 5, max_transient_retries: int = 2,
+                 base_delay: float = 0.25, max_delay: float = 8.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.decrease_cooldown = decrease_cooldown
+        self.max_retries = max_retries
+        self.max_transient_retries = max_transient_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        # Time at which the next token becomes available
+        self._next_slot = time.monotonic()
+        self._last_decrease = float('-inf')
+        self._counters: Dict[str, float] = {
+            'calls': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'throttles': 0,
+            'transient_errors': 0,
+            'retries': 0,
+            'failures': 0,
+        }
+
+    def acquire(self) -> float:
+        """
+        Block until the caller may make one request.
+
+        Returns:
+            Seconds spent waiting
+        """
+        with self._lock:
+            now = time.monotonic()
+            # allow at most one second worth of burst after an idle period
+            slot = max(self._next_slot, now - 1.0)
+            self._next_slot = slot + 1.0 / self.rate
+            wait = max(0.0, slot - now)
+            self._counters['calls'] += 1
+            if wait > 0:
+                self._counters['waits'] += 1
+                self._counters['wait_seconds'] += wait
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record_success(self) -> None:
+        """Additively increase the rate after a successful call."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def record_throttle(self) -> None:
+        """Multiplicatively decrease the rate after a throttle response."""
+        with self._lock:
+            self._counters['throttles'] += 1
+            now = time.monotonic()
+            if now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            rate = self.rate
+        logger.warning('Textract throttled, rate lowered to %.2f req/s', rate)
+
+    def backoff(self, attempt: int) -> float:
+        """Return the full-jitter backoff before retry number attempt (0-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Call func through the limiter, retrying throttling and transient errors.
+
+        Raises:
+            Exception: Whatever func raised, once retries are exhausted or the
+                error is neither a throttle nor transient
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if is_throttling_error(e):
+                    self.record_throttle()
+                    max_retries = self.max_retries
+                elif is_transient_error(e):
+                    with self._lock:
+                        self._counters['transient_errors'] += 1
+                    max_retries = self.max_transient_retries
+                else:
+                    raise
+                if attempt >= max_retries:
+                    with self._lock:
+                        self._counters['failures'] += 1
+                    raise
+                with self._lock:
+                    self._counters['retries'] += 1
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+
+            self.record_success()
+            return result
+
+    def stats(self) -> Dict[str, float]:
+        """Return a snapshot of the counters and the current rate."""
+        with self._lock:
+            return {**self._counters, 'rate': self.rate}
+
+
+class RateLimitedClient:
+    """Proxy around a boto3 client that routes RATE_LIMITED_OPERATIONS through a limiter."""
+
+    def __init__(self, client, limiter: AdaptiveRateLimiter):
+        self._client = client
+        self.limiter = limiter
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name not in RATE_LIMITED_OPERATIONS:
+            return attr
+
+        def rate_limited(*args, **kwargs):
+            return self.limiter.call(attr, *args, **kwargs)
+        return rate_limited
+
+
+# ==================
+# Limiter handling
+# ==================
+_rate_limiter: Optional[AdaptiveRateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    """Return the process-wide Textract limiter, configured from the environment."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if not _rate_limiter:
+            _rate_limiter = AdaptiveRateLimiter(
+                rate=float(os.getenv('TEXTRACT_RATE_LIMIT', '5')),
+                max_rate=float(os.getenv('TEXTRACT_MAX_RATE_LIMIT', '50')),
+                max_retries=int(os.getenv('TEXTRACT_MAX_RETRIES', '5')),
+                max_transient_retries=int(os.getenv('TEXTRACT_MAX_TRANSIENT_RETRIES', '2')),
+            )
+    return _rate_limiter
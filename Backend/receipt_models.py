@@ -0,0 +1,22 @@
+"""
+Pydantic models of a parsed receipt.
+
+Kept out of lambda_s3_textract so pydantic is only imported when strict
+parsing is used, not on every cold start.
+"""
+
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class ReceiptItem(BaseModel):
+    item_name: str
+    price: str
+
+
+class Receipt(BaseModel):
+    store_name: Optional[str] = None
+    date: Optional[str] = None
+    items: List[ReceiptItem]
+    total: str
@@ -0,0 +1,180 @@
+"""
+Content-hash cache of parsed receipts.
+
+Maps the SHA-256 of a receipt file to the output of parse_extracted_text so
+identical uploads never go through Textract twice. Entries expire after a TTL.
+
+Backends are selected with RESULT_CACHE_BACKEND / RESULT_CACHE_TABLE, see
+store_backends.py. Only the dynamodb backend shares hits between Lambda
+containers and with accept-files-dev's pre-upload check.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from log_utils import get_logger
+from store_backends import DYNAMODB, SQLITE, DynamoDBBackend, SQLiteBackend, select_backend
+
+logger = get_logger(__name__)
+
+DEFAULT_TTL_SECONDS = int(os.getenv('RESULT_CACHE_TTL', str(24 * 60 * 60)))  # 24 hours
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), 'receipt-cache.sqlite3')
+HASH_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+
+# ==================
+# Hashing
+# ==================
+def gen_hash(data: bytes) -> str:
+    """Return the hex SHA-256 digest of a file's contents."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def gen_stream_hash(stream) -> str:
+    """
+    Return the hex SHA-256 digest of a file-like object without loading it whole.
+
+    Args:
+        stream: Object with a read(size) method, e.g. an open file or S3 StreamingBody
+
+    Returns:
+        Hex digest of everything read from the stream
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ==================
+# Cache backends
+# ==================
+class ResultCache(ABC):
+    """Interface of a content hash -> parsed receipts cache."""
+
+    @abstractmethod
+    def get(self, content_hash: str) -> Optional[List[Dict[str, Any]]]:
+        """Return the cached receipts for content_hash, or None on a miss or expired entry."""
+
+    @abstractmethod
+    def put(self, content_hash: str, receipts: List[Dict[str, Any]]) -> None:
+        """Store the parsed receipts for content_hash."""
+
+
+class NullResultCache(ResultCache):
+    """Cache that never stores anything."""
+
+    def get(self, content_hash: str) -> Optional[List[Dict[str, Any]]]:
+        return None
+
+    def put(self, content_hash: str, receipts: List[Dict[str, Any]]) -> None:
+        return None
+
+
+class SQLiteResultCache(SQLiteBackend, ResultCache):
+    """Local file backed cache."""
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(path, ttl_seconds, [
+            'CREATE TABLE IF NOT EXISTS results ('
+            'content_hash TEXT PRIMARY KEY, '
+            'result TEXT NOT NULL, '
+            'expires_at REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)',
+        ])
+
+    def get(self, content_hash: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result FROM results WHERE content_hash = ? AND expires_at > ?',
+                (content_hash, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, content_hash: str, receipts: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._evict('results', now)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (content_hash, result, expires_at) VALUES (?, ?, ?)',
+                (content_hash, json.dumps(receipts), now + self.ttl_seconds)
+            )
+
+
+class DynamoDBResultCache(DynamoDBBackend, ResultCache):
+    """
+    DynamoDB backed cache shared by every lambda.
+
+    The table needs a string partition key 'content_hash' and should have
+    DynamoDB TTL enabled on the numeric 'expires_at' attribute.
+    """
+
+    def __init__(self, table_name: str, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(table_name, ttl_seconds)
+
+    def get(self, content_hash: str) -> Optional[List[Dict[str, Any]]]:
+        item = self.table.get_item(Key={'content_hash': content_hash}).get('Item')
+        if item is None or self._expired(item, time.time()):
+            return None
+        return json.loads(item['result'])
+
+    def put(self, content_hash: str, receipts: List[Dict[str, Any]]) -> None:
+        self.table.put_item(
+            Item={
+                'content_hash': content_hash,
+                'result': json.dumps(receipts),
+                'expires_at': self._expires_at(time.time()),
+            }
+        )
+
+
+# ==================
+# Cache handling
+# ==================
+_result_cache: Optional[ResultCache] = None
+# records are processed by several threads, only one of them may create the backend
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Return the process-wide cache, creating it from the environment on first use."""
+    global _result_cache
+    with _result_cache_lock:
+        if not _result_cache:
+            _result_cache = select_backend('RESULT_CACHE', {
+                DYNAMODB: lambda: DynamoDBResultCache(os.environ['RESULT_CACHE_TABLE']),
+                SQLITE: lambda: SQLiteResultCache(os.getenv('RESULT_CACHE_PATH', DEFAULT_SQLITE_PATH)),
+            }, NullResultCache, 'identical uploads to other containers are sent to Textract again')
+        return _result_cache
+
+
+def set_result_cache(cache: Optional[ResultCache]) -> None:
+    """Replace the process-wide cache, e.g. with a fresh SQLite file in tests."""
+    global _result_cache
+    with _result_cache_lock:
+        _result_cache = cache
+
+
+def cache_get(content_hash: str) -> Optional[List[Dict[str, Any]]]:
+    """Look up content_hash, treating any backend failure as a miss."""
+    try:
+        return get_result_cache().get(content_hash)
+    except Exception as e:
+        logger.warning('Result cache lookup failed: %s', e)
+        return None
+
+
+def cache_put(content_hash: str, receipts: List[Dict[str, Any]]) -> None:
+    """Store receipts for content_hash, ignoring backend failures."""
+    try:
+        get_result_cache().put(content_hash, receipts)
+    except Exception as e:
+        logger.warning('Result cache write failed: %s', e)
@@ -0,0 +1,258 @@
+"""
+Durable store of delivered results, for replay to reconnecting clients.
+
+Every output body lambda_s3_textract sends over the websocket is also saved
+here, keyed by fileId and indexed by the client's session id. A browser whose
+websocket reconnected (new connectionId) asks accept-files-dev to replay its
+session and gets everything it missed in one bulk read, instead of uploading
+the files again. Only results stored under the requesting session are ever
+returned, so the session id is the credential for its results. Entries expire
+after a TTL.
+
+Backends are selected with RESULT_STORE_BACKEND / RESULT_STORE_TABLE, see
+store_backends.py. Results are written by lambda_s3_textract and replayed by
+accept-files-dev, so deployed lambdas need the dynamodb backend.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from log_utils import get_logger
+from store_backends import DYNAMODB, SQLITE, DynamoDBBackend, SQLiteBackend, select_backend
+
+logger = get_logger(__name__)
+
+DEFAULT_TTL_SECONDS = int(os.getenv('RESULT_STORE_TTL', str(24 * 60 * 60)))  # 24 hours
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), 'receipt-results.sqlite3')
+# upper bound on results returned by one replay
+MAX_REPLAY_RESULTS = 500
+
+
+# ==================
+# Store backends
+# ==================
+class ResultStore(ABC):
+    """Interface of a fileId -> output body store with a session index."""
+
+    @abstractmethod
+    def put(self, file_id: str, session_id: Optional[str], body: Dict[str, Any]) -> None:
+        """Store the output body of a file, replacing an earlier one."""
+
+    @abstractmethod
+    def get_session(self, session_id: str, since: float = 0.0,
+                    limit: int = MAX_REPLAY_RESULTS) -> List[Dict[str, Any]]:
+        """
+        Return the unexpired results of a session, oldest first.
+
+        Returns:
+            [{'fileId', 'body', 'createdAt'}, ...] created after since
+        """
+
+    @abstractmethod
+    def get_files(self, session_id: str, file_ids: List[str]) -> List[Dict[str, Any]]:
+        """Return the unexpired results of the given files stored under session_id, as get_session does."""
+
+
+class NullResultStore(ResultStore):
+    """Store that never keeps anything."""
+
+    def put(self, file_id: str, session_id: Optional[str], body: Dict[str, Any]) -> None:
+        return None
+
+    def get_session(self, session_id: str, since: float = 0.0,
+                    limit: int = MAX_REPLAY_RESULTS) -> List[Dict[str, Any]]:
+        return []
+
+    def get_files(self, session_id: str, file_ids: List[str]) -> List[Dict[str, Any]]:
+        return []
+
+
+class SQLiteResultStore(SQLiteBackend, ResultStore):
+    """Local file backed store."""
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(path, ttl_seconds, [
+            'CREATE TABLE IF NOT EXISTS results ('
+            'file_id TEXT PRIMARY KEY, '
+            'session_id TEXT, '
+            'body TEXT NOT NULL, '
+            'created_at REAL NOT NULL, '
+            'expires_at REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS results_session ON results (session_id, created_at)',
+            'CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)',
+        ])
+
+    def put(self, file_id: str, session_id: Optional[str], body: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._evict('results', now)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (file_id, session_id, body, created_at, expires_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (file_id, session_id, json.dumps(body), now, now + self.ttl_seconds)
+            )
+
+    def get_session(self, session_id: str, since: float = 0.0,
+                    limit: int = MAX_REPLAY_RESULTS) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT file_id, body, created_at FROM results '
+                'WHERE session_id = ? AND created_at > ? AND expires_at > ? '
+                'ORDER BY created_at LIMIT ?',
+                (session_id, since, time.time(), limit)
+            ).fetchall()
+        return [_result(*row) for row in rows]
+
+    def get_files(self, session_id: str, file_ids: List[str]) -> List[Dict[str, Any]]:
+        if not file_ids:
+            return []
+        placeholders = ', '.join('?' * len(file_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT file_id, body, created_at FROM results '
+                f'WHERE file_id IN ({placeholders}) AND session_id = ? AND expires_at > ? ORDER BY created_at',
+                (*file_ids, session_id, time.time())
+            ).fetchall()
+        return [_result(*row) for row in rows]
+
+
+class DynamoDBResultStore(DynamoDBBackend, ResultStore):
+    """
+    DynamoDB backed store shared by every lambda.
+
+    The table needs a string partition key 'file_id', a global secondary index
+    'session_id-created_at-index' (partition key 'session_id', numeric sort key
+    'created_at'), and DynamoDB TTL enabled on the numeric 'expires_at' attribute.
+    """
+
+    SESSION_INDEX = 'session_id-created_at-index'
+
+    def __init__(self, table_name: str, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(table_name, ttl_seconds)
+
+    def put(self, file_id: str, session_id: Optional[str], body: Dict[str, Any]) -> None:
+        now = time.time()
+        item = {
+            'file_id': file_id,
+            'body': json.dumps(body),
+            # stored as an integer of milliseconds, DynamoDB rejects floats
+            'created_at': int(now * 1000),
+            'expires_at': self._expires_at(now),
+        }
+        # items without a session simply stay out of the sparse index
+        if session_id:
+            item['session_id'] = session_id
+        self.table.put_item(Item=item)
+
+    def get_session(self, session_id: str, since: float = 0.0,
+                    limit: int = MAX_REPLAY_RESULTS) -> List[Dict[str, Any]]:
+        from boto3.dynamodb.conditions import Key
+
+        items: List[Dict[str, Any]] = []
+        params: Dict[str, Any] = {
+            'IndexName': self.SESSION_INDEX,
+            'KeyConditionExpression': Key('session_id').eq(session_id) & Key('created_at').gt(int(since * 1000)),
+        }
+        while len(items) < limit:
+            response = self.table.query(**params)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return self._results(items)[:limit]
+
+    def get_files(self, session_id: str, file_ids: List[str]) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        table_name = self.table.name
+        # batch_get_item reads at most 100 keys per call
+        for start in range(0, len(file_ids), 100):
+            request = {table_name: {'Keys': [{'file_id': file_id} for file_id in file_ids[start:start + 100]]}}
+            while request:
+                response = self.resource.batch_get_item(RequestItems=request)
+                items.extend(
+                    item for item in response['Responses'].get(table_name, [])
+                    if item.get('session_id') == session_id
+                )
+                request = response.get('UnprocessedKeys')
+        results = self._results(items)
+        return sorted(results, key=lambda result: result['createdAt'])
+
+    def _results(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        now = time.time()
+        return [
+            _result(item['file_id'], item['body'], int(item['created_at']) / 1000)
+            for item in items
+            if not self._expired(item, now)
+        ]
+
+
+def _result(file_id: str, body: str, created_at: float) -> Dict[str, Any]:
+    return {'fileId': file_id, 'body': json.loads(body), 'createdAt': created_at}
+
+
+# ==================
+# Store handling
+# ==================
+_result_store: Optional[ResultStore] = None
+# records are processed by several threads, only one of them may create the backend
+_result_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """Return the process-wide store, creating it from the environment on first use."""
+    global _result_store
+    with _result_store_lock:
+        if not _result_store:
+            _result_store = select_backend('RESULT_STORE', {
+                DYNAMODB: lambda: DynamoDBResultStore(os.environ['RESULT_STORE_TABLE']),
+                SQLITE: lambda: SQLiteResultStore(os.getenv('RESULT_STORE_PATH', DEFAULT_SQLITE_PATH)),
+            }, NullResultStore, 'results written by the other lambda or other containers cannot be replayed')
+        return _result_store
+
+
+def set_result_store(store: Optional[ResultStore]) -> None:
+    """Replace the process-wide store, e.g. with a fresh SQLite file in tests."""
+    global _result_store
+    with _result_store_lock:
+        _result_store = store
+
+
+def store_result(file_id: str, session_id: Optional[str], body: Dict[str, Any]) -> None:
+    """Persist a file's output body, ignoring backend failures."""
+    try:
+        get_result_store().put(file_id, session_id, body)
+    except Exception as e:
+        logger.warning('Result store write failed: %s', e)
+
+
+def replay_results(session_id: str, file_ids: Optional[List[str]] = None,
+                   since: float = 0.0) -> List[Dict[str, Any]]:
+    """
+    Read back the stored results of a session.
+
+    Args:
+        session_id: Session whose results to return
+        file_ids: Files of the session whose results to return regardless of since
+        since: Only return session results stored after this epoch time
+
+    Returns:
+        [{'fileId', 'body', 'createdAt'}, ...] without duplicates, oldest first.
+        Empty if the backend fails.
+    """
+    store = get_result_store()
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        for result in store.get_session(session_id, since):
+            results[result['fileId']] = result
+        if file_ids:
+            for result in store.get_files(session_id, file_ids[:MAX_REPLAY_RESULTS]):
+                results[result['fileId']] = result
+    except Exception as e:
+        logger.warning('Result store read failed: %s', e)
+        return []
+    return sorted(results.values(), key=lambda result: result['createdAt'])
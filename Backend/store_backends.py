@@ -0,0 +1,118 @@
+"""
+Scaffolding shared by the key-value stores (result_cache, result_store, idempotency).
+
+Each store has the same three backends, selected with <PREFIX>_BACKEND:
+    sqlite   - file in the local temp directory. Only shared by the threads and
+               processes of one machine: in Lambda every container gets its own
+               /tmp, so entries written by other containers (or by the other
+               lambda) are never seen. For local runs and tests.
+    dynamodb - table named by <PREFIX>_TABLE, shared by every lambda. Entries
+               carry a numeric 'expires_at' for DynamoDB TTL.
+    none     - the store is disabled.
+
+Outside Lambda the default is sqlite. Inside Lambda it is dynamodb when
+<PREFIX>_TABLE is set; otherwise sqlite is used with a warning, since a store
+private to one container silently does less than it should.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, TypeVar
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar('T')
+
+SQLITE = 'sqlite'
+DYNAMODB = 'dynamodb'
+NONE = 'none'
+
+
+def in_lambda() -> bool:
+    """Return True when running inside AWS Lambda."""
+    return 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
+
+
+def select_backend(prefix: str, factories: Dict[str, Callable[[], T]], disabled: Callable[[], T],
+                   shared_purpose: str) -> T:
+    """
+    Create the backend <PREFIX>_BACKEND names.
+
+    Args:
+        prefix: Environment variable prefix, e.g. 'RESULT_CACHE'
+        factories: Backend name ('sqlite', 'dynamodb') to constructor
+        disabled: Constructor of the null backend, used for 'none' and unknown names
+        shared_purpose: What is lost when the store is private to one Lambda
+            container, for the warning
+
+    Returns:
+        The backend instance
+    """
+    backend = os.getenv(f'{prefix}_BACKEND')
+    if backend is None:
+        backend = DYNAMODB if in_lambda() and os.getenv(f'{prefix}_TABLE') else SQLITE
+    if backend == SQLITE and in_lambda():
+        logger.warning(
+            '%s uses sqlite inside Lambda: the store is private to this container, '
+            'so %s. Set %s_TABLE (and %s_BACKEND=dynamodb).',
+            prefix, shared_purpose, prefix, prefix
+        )
+    factory = factories.get(backend)
+    if factory is None:
+        if backend != NONE:
+            logger.warning('Unknown %s_BACKEND %r, store disabled', prefix, backend)
+        return disabled()
+    return factory()
+
+
+class SQLiteBackend:
+    """
+    Local SQLite file with expiring rows. Safe to share between threads.
+
+    Args:
+        path: Database file
+        ttl_seconds: Lifetime of a row
+        schema: Statements creating the tables and indexes, run once
+        **connect_kwargs: Extra sqlite3.connect arguments
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, schema: List[str], **connect_kwargs):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, **connect_kwargs)
+        with self._lock, self._conn:
+            for statement in schema:
+                self._conn.execute(statement)
+
+    def _evict(self, table: str, now: float) -> None:
+        # expired rows are deleted on write, so the file does not grow without bound
+        self._conn.execute(f'DELETE FROM {table} WHERE expires_at <= ?', (now,))
+
+
+class DynamoDBBackend:
+    """
+    DynamoDB table with TTL-expiring items.
+
+    Args:
+        table_name: Name of the table
+        ttl_seconds: Lifetime of an item, stored as the epoch 'expires_at'
+    """
+
+    def __init__(self, table_name: str, ttl_seconds: int):
+        import boto3
+
+        self.resource = boto3.resource('dynamodb')
+        self.table = self.resource.Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def _expires_at(self, now: float) -> int:
+        return int(now + self.ttl_seconds)
+
+    @staticmethod
+    def _expired(item: Dict, now: float) -> bool:
+        # DynamoDB TTL deletion is lazy, so expired items can still be returned
+        return item['expires_at'] <= now
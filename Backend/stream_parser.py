@@ -0,0 +1,175 @@
+"""
+Incremental reader for large Textract expense responses.
+
+Reads a serialized analyze_expense / get_expense_analysis response from a
+file, an S3 StreamingBody or any other file-like object chunk by chunk and
+yields its ExpenseDocuments one at a time. Subtrees the parser never reads
+(Geometry, Blocks, ...) are dropped while each document is decoded, so peak
+memory is bounded by one trimmed document rather than the whole response.
+
+Only the standard library is used: values are decoded with
+json.JSONDecoder.raw_decode on a sliding text buffer.
+"""
+
+import codecs
+import json
+import os
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+DEFAULT_CHUNK_SIZE = 64 * 1024  # 64KB
+
+# keys of the response that parse_extracted_text never looks at
+DROPPED_KEYS = frozenset({'Geometry', 'Blocks', 'Relationships', 'Polygon', 'BoundingBox'})
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class StreamFormatError(ValueError):
+    """Exception raised when a streamed response is not a valid expense response."""
+
+
+def _drop_unused(pairs: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    return {key: value for key, value in pairs if key not in DROPPED_KEYS}
+
+
+_document_decoder = json.JSONDecoder(object_pairs_hook=_drop_unused)
+_value_decoder = json.JSONDecoder()
+
+
+class _StreamReader:
+    """Sliding text buffer over a text or binary stream."""
+
+    def __init__(self, stream, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self._decoder: Optional[codecs.IncrementalDecoder] = None
+
+    def fill(self, min_chars: int = 1) -> bool:
+        """Read at least min_chars more characters, returns False at end of stream."""
+        if self.eof:
+            return False
+
+        # forget what has already been consumed
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+        added = 0
+        while added < min_chars:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+                if self._decoder:
+                    tail = self._decoder.decode(b'', final=True)
+                    self.buffer += tail
+                    added += len(tail)
+                break
+            if isinstance(chunk, bytes):
+                if self._decoder is None:
+                    self._decoder = codecs.getincrementaldecoder('utf-8')()
+                chunk = self._decoder.decode(chunk)
+            self.buffer += chunk
+            added += len(chunk)
+        return added > 0
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ('' at end)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise StreamFormatError(f"Expected '{char}' but found '{found or 'end of stream'}'")
+        self.pos += 1
+
+    def decode(self, decoder: json.JSONDecoder) -> Any:
+        """Decode the next JSON value, reading more of the stream as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # the value is probably cut off at the end of the buffer
+                if not self.fill(max(self.chunk_size, len(self.buffer) - self.pos)):
+                    raise StreamFormatError(f'Invalid JSON in response: {e}')
+                continue
+            # a number at the very end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_expense_documents(source: Union[str, os.PathLike, Any],
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the ExpenseDocuments of a serialized Textract response one at a time.
+
+    Args:
+        source: Path to a JSON file, or a file-like object opened in text or
+            binary mode (e.g. the 'Body' of an S3 get_object response)
+        chunk_size: Characters/bytes read from the stream at a time
+
+    Yields:
+        ExpenseDocument dictionaries with DROPPED_KEYS removed
+
+    Raises:
+        StreamFormatError: If the response is not valid JSON or has no ExpenseDocuments
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter_expense_documents(f, chunk_size)
+        return
+
+    reader = _StreamReader(source, chunk_size)
+    reader.expect('{')
+    found = False
+
+    if reader.peek() == '}':
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.decode(_value_decoder)
+            reader.expect(':')
+            if key == 'ExpenseDocuments':
+                found = True
+                yield from _iter_array(reader, lambda: reader.decode(_document_decoder))
+            else:
+                # other top-level values (DocumentMetadata, JobStatus, ...) are small
+                reader.decode(_value_decoder)
+
+            separator = reader.peek()
+            reader.pos += 1
+            if separator == '}':
+                break
+            if separator != ',':
+                raise StreamFormatError(f"Expected ',' or '}}' but found '{separator or 'end of stream'}'")
+
+    if not found:
+        raise StreamFormatError('Response has no ExpenseDocuments')
+
+
+def _iter_array(reader: _StreamReader, decode_item: Callable[[], Any]) -> Iterator[Any]:
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+
+    while True:
+        yield decode_item()
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise StreamFormatError(f"Expected ',' or ']' but found '{separator or 'end of stream'}'")
@@ -0,0 +1,184 @@
+"""
+Generator of synthetic Textract analyze_expense responses.
+
+Produces responses shaped like the real API output (see extracted_text.txt):
+summary fields and line items with labels, confidences, geometry and page
+numbers, plus optional Blocks. Used by the parser benchmarks and the local
+fake Textract. Output is deterministic for a given seed.
+"""
+
+import random
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+SUMMARY_TYPES = [
+    'VENDOR_NAME', 'INVOICE_RECEIPT_DATE', 'TOTAL', 'SUBTOTAL', 'TAX',
+    'VENDOR_ADDRESS', 'VENDOR_PHONE', 'RECEIPT_ID', 'AMOUNT_PAID', 'OTHER',
+]
+PRODUCT_NAMES = [
+    'Milk', 'Eggs', 'Bread', 'Coffee', 'Bananas', 'Apples', 'Rice', 'Cheese',
+    'Chicken', 'Pasta', 'Tomatoes', 'Yogurt', 'Butter', 'Cereal', 'Juice',
+]
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(UUID(int=rng.getrandbits(128), version=4))
+
+
+def _geometry(rng: random.Random) -> Dict[str, Any]:
+    left, top = rng.random() * 0.8, rng.random() * 0.9
+    width, height = 0.05 + rng.random() * 0.15, 0.01 + rng.random() * 0.02
+    return {
+        'BoundingBox': {'Width': width, 'Height': height, 'Left': left, 'Top': top},
+        'Polygon': [
+            {'X': left, 'Y': top},
+            {'X': left + width, 'Y': top},
+            {'X': left + width, 'Y': top + height},
+            {'X': left, 'Y': top + height},
+        ],
+    }
+
+
+def _field(rng: random.Random, field_type: str, text: str, page: int,
+           include_geometry: bool, label: Optional[str] = None) -> Dict[str, Any]:
+    value_detection: Dict[str, Any] = {'Text': text, 'Confidence': 90 + rng.random() * 10}
+    if include_geometry:
+        value_detection['Geometry'] = _geometry(rng)
+
+    field: Dict[str, Any] = {
+        'Type': {'Text': field_type, 'Confidence': 90 + rng.random() * 10},
+        'ValueDetection': value_detection,
+        'PageNumber': page,
+    }
+    if label is not None:
+        label_detection: Dict[str, Any] = {'Text': label, 'Confidence': 90 + rng.random() * 10}
+        if include_geometry:
+            label_detection['Geometry'] = _geometry(rng)
+        field['LabelDetection'] = label_detection
+    return field
+
+
+def _summary_value(rng: random.Random, summary_type: str) -> str:
+    if summary_type == 'VENDOR_NAME':
+        return f'Store #{rng.randint(1, 999)}'
+    if summary_type == 'INVOICE_RECEIPT_DATE':
+        return f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2025'
+    if summary_type in ('TOTAL', 'SUBTOTAL', 'TAX', 'AMOUNT_PAID'):
+        return f'${rng.uniform(1, 500):.2f}'
+    return f'{summary_type.lower()} {rng.randint(1000, 9999)}'
+
+
+def generate_expense_document(index: int = 1, line_items: int = 20, summary_fields: int = 10,
+                              line_item_groups: int = 1, include_geometry: bool = True,
+                              page: int = 1, invalid_line_items: float = 0.0,
+                              rng: Optional[random.Random] = None) -> Dict[str, Any]:
+    """
+    Generate one ExpenseDocument.
+
+    Args:
+        index: ExpenseIndex of the document
+        line_items: Line items in the document, spread over the groups
+        summary_fields: Summary fields; the first three are always vendor, date and total
+        line_item_groups: Number of LineItemGroups
+        include_geometry: Attach Geometry to every detection like the real API does
+        page: PageNumber reported on every field
+        invalid_line_items: Fraction of line items generated without a PRICE
+        rng: Random source, defaults to one seeded with index
+
+    Returns:
+        ExpenseDocument dictionary
+    """
+    rng = rng or random.Random(index)
+
+    summaries: List[Dict[str, Any]] = []
+    for i in range(summary_fields):
+        summary_type = SUMMARY_TYPES[i % len(SUMMARY_TYPES)]
+        summaries.append(_field(
+            rng, summary_type, _summary_value(rng, summary_type), page,
+            include_geometry, label=summary_type.replace('_', ' ').title()
+        ))
+
+    groups: List[Dict[str, Any]] = []
+    groups_count = max(1, line_item_groups)
+    for group_index in range(groups_count):
+        items_in_group = line_items // groups_count + (1 if group_index < line_items % groups_count else 0)
+        rows: List[Dict[str, Any]] = []
+        for _ in range(items_in_group):
+            name = f'{rng.choice(PRODUCT_NAMES)} {rng.randint(1, 99)}'
+            price = f'{rng.uniform(0.5, 50):.2f}'
+            quantity = str(rng.randint(1, 5))
+            fields = [
+                _field(rng, 'ITEM', name, page, include_geometry),
+                _field(rng, 'QUANTITY', quantity, page, include_geometry),
+                _field(rng, 'PRICE', price, page, include_geometry),
+                _field(rng, 'EXPENSE_ROW', f'{name} {quantity} {price}', page, include_geometry),
+            ]
+            if rng.random() < invalid_line_items:
+                del fields[2]
+            rows.append({'LineItemExpenseFields': fields})
+        groups.append({'LineItemGroupIndex': group_index + 1, 'LineItems': rows})
+
+    return {
+        'ExpenseIndex': index,
+        'SummaryFields': summaries,
+        'LineItemGroups': groups,
+    }
+
+
+def generate_expense_response(documents: int = 1, line_items: int = 20, summary_fields: int = 10,
+                              line_item_groups: int = 1, include_geometry: bool = True,
+                              include_blocks: bool = False, invalid_line_items: float = 0.0,
+                              seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate a full analyze_expense response.
+
+    Args:
+        documents: Number of ExpenseDocuments, one per page
+        line_items: Line items per document
+        summary_fields: Summary fields per document
+        line_item_groups: LineItemGroups per document
+        include_geometry: Attach Geometry to every detection
+        include_blocks: Add a Blocks list (one LINE block per detection) to every
+            document, mimicking the bulk of a real response that the parser ignores
+        invalid_line_items: Fraction of line items generated without a PRICE
+        seed: Seed for deterministic output
+
+    Returns:
+        Response dictionary with DocumentMetadata and ExpenseDocuments
+    """
+    rng = random.Random(seed)
+    expense_documents: List[Dict[str, Any]] = []
+
+    for index in range(1, documents + 1):
+        document = generate_expense_document(
+            index=index,
+            line_items=line_items,
+            summary_fields=summary_fields,
+            line_item_groups=line_item_groups,
+            include_geometry=include_geometry,
+            page=index,
+            invalid_line_items=invalid_line_items,
+            rng=rng,
+        )
+        if include_blocks:
+            blocks: List[Dict[str, Any]] = []
+            detections = [field['ValueDetection'] for field in document['SummaryFields']]
+            for group in document['LineItemGroups']:
+                for row in group['LineItems']:
+                    detections.extend(field['ValueDetection'] for field in row['LineItemExpenseFields'])
+            for detection in detections:
+                blocks.append({
+                    'BlockType': 'LINE',
+                    'Id': _uuid(rng),
+                    'Text': detection['Text'],
+                    'Confidence': detection['Confidence'],
+                    'Geometry': _geometry(rng),
+                    'Page': index,
+                })
+            document['Blocks'] = blocks
+        expense_documents.append(document)
+
+    return {
+        'DocumentMetadata': {'Pages': documents},
+        'ExpenseDocuments': expense_documents,
+    }
@@ -1,20 +1,25 @@
 import json
-import boto3
-import logging
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
+from aws_clients import get_client
+from log_utils import WEBSOCKET_EVENT_FIELDS, get_logger, log_verbose
+from metrics import metrics_scope, span
 
+logger = get_logger(__name__)
+
+
+@metrics_scope('test-websocket')
 def lambda_handler(event, context):
-    logger.info(f'Event: {event}')
+    log_verbose(logger, 'Event', event, WEBSOCKET_EVENT_FIELDS)
     socket_id = event['requestContext']['connectionId']
-    apigateway_client = boto3.client(
-        'apigatewaymanagementapi', 
-        endpoint_url='https://apbvj306i8.execute-api.us-west-1.amazonaws.com/dev/'
+    apigateway_client = get_client(
+        'apigatewaymanagementapi',
+        endpoint_url='https://apbvj306i8.execute-api.us-west-1.amazonaws.com/dev/',
+        name='apigateway'
     )
 
-    apigateway_client.post_to_connection(
-            ConnectionId=socket_id,
-            Data="Hello from lambda"
-        )
+    with span('post_to_connection'):
+        apigateway_client.post_to_connection(
+                ConnectionId=socket_id,
+                Data="Hello from lambda"
+            )
     return {'statusCode': 200}
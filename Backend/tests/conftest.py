@@ -0,0 +1,87 @@
+"""
+Shared fixtures. The Backend modules are flat, so the Backend directory is put
+on sys.path; Textract is replaced by fake_textract.FakeTextract and S3 by
+fake_aws.FakeS3, and every store gets a fresh SQLite file.
+
+Run from the Backend directory:
+
+    python -m pytest -q tests
+"""
+
+import importlib.util
+import io
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fake_aws import FakeS3  # noqa: E402
+from fake_textract import FakeTextract  # noqa: E402
+from idempotency import SQLiteIdempotencyStore, set_idempotency_store  # noqa: E402
+from result_cache import SQLiteResultCache, set_result_cache  # noqa: E402
+
+
+def build_pdf(pages: int) -> bytes:
+    """Build a PDF with the given number of blank pages."""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def make_pdf():
+    """build_pdf, for tests that need PDF documents."""
+    return build_pdf
+
+
+@pytest.fixture
+def result_cache(tmp_path):
+    cache = SQLiteResultCache(str(tmp_path / 'cache.sqlite3'))
+    set_result_cache(cache)
+    yield cache
+    set_result_cache(None)
+
+
+@pytest.fixture
+def idempotency_store(tmp_path):
+    store = SQLiteIdempotencyStore(str(tmp_path / 'idempotency.sqlite3'))
+    set_idempotency_store(store)
+    yield store
+    set_idempotency_store(None)
+
+
+@pytest.fixture
+def textract(monkeypatch):
+    """FakeTextract installed as the Textract client of lambda_s3_textract."""
+    import lambda_s3_textract
+
+    client = FakeTextract()
+    monkeypatch.setattr(lambda_s3_textract, '_textract_client', client)
+    return client
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """FakeS3 installed as the S3 client of lambda_s3_textract."""
+    import lambda_s3_textract
+
+    client = FakeS3()
+    monkeypatch.setattr(lambda_s3_textract, 'get_s3_client', lambda: client)
+    return client
+
+
+@pytest.fixture(scope='session')
+def accept_files():
+    """accept-files-dev.py, whose file name is not importable."""
+    spec = importlib.util.spec_from_file_location('accept_files_dev', os.path.join(BACKEND_DIR, 'accept-files-dev.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
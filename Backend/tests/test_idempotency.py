@@ -0,0 +1,140 @@
+"""Idempotency claims and run_once."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import idempotency
+from idempotency import (
+    COMPLETED,
+    IN_PROGRESS,
+    LEASE_MARGIN_SECONDS,
+    LEASE_SECONDS,
+    IdempotencyStore,
+    NullIdempotencyStore,
+    get_idempotency_store,
+    lease_for,
+    run_once,
+    set_idempotency_store,
+)
+
+OUTCOME = {'statusCode': 200}
+
+
+def test_claim_and_complete(idempotency_store):
+    claim = idempotency_store.claim('key')
+    assert claim.status == IN_PROGRESS and claim.token
+
+    idempotency_store.complete('key', claim.token, OUTCOME)
+
+    duplicate = idempotency_store.claim('key')
+    assert duplicate.status == COMPLETED
+    assert duplicate.outcome == OUTCOME
+    assert duplicate.token is None
+
+
+def test_claim_held_by_another_run(idempotency_store):
+    idempotency_store.claim('key')
+
+    claim = idempotency_store.claim('key')
+
+    assert claim.status == IN_PROGRESS
+    assert claim.token is None
+
+
+def test_released_claim_can_be_taken_again(idempotency_store):
+    claim = idempotency_store.claim('key')
+
+    idempotency_store.release('key', claim.token)
+
+    assert idempotency_store.claim('key').token
+
+
+def test_release_with_a_stale_token_is_ignored(idempotency_store):
+    idempotency_store.claim('key')
+
+    idempotency_store.release('key', 'stale')
+
+    assert idempotency_store.claim('key').token is None
+
+
+def test_expired_lease_can_be_taken_over(idempotency_store):
+    idempotency_store.claim('key', lease_seconds=0)
+
+    assert idempotency_store.claim('key').token
+
+
+def test_run_once_serves_duplicates_the_stored_outcome(idempotency_store):
+    calls = []
+
+    def process():
+        calls.append(1)
+        return OUTCOME
+
+    assert run_once('key', process) == OUTCOME
+    assert run_once('key', process) == OUTCOME
+    assert len(calls) == 1
+
+
+def test_run_once_releases_outcomes_that_are_not_final(idempotency_store):
+    outcomes = iter([{'statusCode': 503, 'retryable': True}, OUTCOME])
+
+    def should_store(outcome):
+        return not outcome.get('retryable')
+
+    assert run_once('key', lambda: next(outcomes), should_store)['statusCode'] == 503
+    assert run_once('key', lambda: next(outcomes), should_store) == OUTCOME
+
+
+def test_run_once_releases_the_claim_when_func_raises(idempotency_store):
+    def fail():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        run_once('key', fail)
+
+    assert run_once('key', lambda: OUTCOME) == OUTCOME
+
+
+def test_run_once_gives_up_on_a_run_in_progress(idempotency_store):
+    idempotency_store.claim('key')
+
+    assert run_once('key', lambda: OUTCOME, wait_seconds=0) is None
+
+
+def test_lease_covers_the_rest_of_the_invocation():
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 120_000
+
+    assert lease_for(Context()) == 120 + LEASE_MARGIN_SECONDS
+    assert lease_for(None) == LEASE_SECONDS
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        IdempotencyStore()
+
+
+def test_concurrent_first_use_creates_one_store(monkeypatch):
+    created = []
+    lock = threading.Lock()
+
+    def select_backend(*args):
+        time.sleep(0.01)
+        with lock:
+            created.append(NullIdempotencyStore())
+            return created[-1]
+
+    monkeypatch.setattr(idempotency, 'select_backend', select_backend)
+    set_idempotency_store(None)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            stores = list(executor.map(lambda _: get_idempotency_store(), range(8)))
+    finally:
+        set_idempotency_store(None)
+
+    assert len(created) == 1
+    assert all(store is created[0] for store in stores)
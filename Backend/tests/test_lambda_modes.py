@@ -0,0 +1,117 @@
+"""Sync vs async mode selection of lambda_s3_textract, driven by FakeTextract."""
+
+import lambda_s3_textract
+from lambda_s3_textract import extract_receipt, use_async_mode
+
+BUCKET = 'receipts'
+
+
+def upload(s3, key: str, body: bytes) -> int:
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body, ContentType='application/pdf')
+    return len(body)
+
+
+def test_use_async_mode_thresholds(monkeypatch):
+    monkeypatch.setattr(lambda_s3_textract, 'ASYNC_SIZE_THRESHOLD', 1000)
+    monkeypatch.setattr(lambda_s3_textract, 'ASYNC_PAGE_THRESHOLD', 10)
+
+    assert not use_async_mode(1000, 10)
+    assert use_async_mode(1001, 1)
+    assert use_async_mode(10, 11)
+
+
+def test_small_document_is_analyzed_synchronously(s3, textract, result_cache, make_pdf):
+    key = 'uploads/receipt.pdf'
+    size = upload(s3, key, make_pdf(1))
+
+    body = extract_receipt(BUCKET, key, 'application/pdf', size)
+
+    assert body['statusCode'] == 200
+    assert body['data'][0]['store_name'] == 'Sample Market'
+    assert textract.calls == {'analyze_expense': 1}
+
+
+def test_long_pdf_uses_an_async_job(monkeypatch, s3, textract, result_cache, make_pdf):
+    def split_pdf_pages(document):
+        raise AssertionError('a PDF analyzed by an async job is not split')
+
+    monkeypatch.setattr(lambda_s3_textract, 'ASYNC_PAGE_THRESHOLD', 2)
+    monkeypatch.setattr(lambda_s3_textract, 'split_pdf_pages', split_pdf_pages)
+    key = 'uploads/long.pdf'
+    size = upload(s3, key, make_pdf(3))
+
+    body = extract_receipt(BUCKET, key, 'application/pdf', size)
+
+    assert body['statusCode'] == 200
+    assert 'analyze_expense' not in textract.calls
+    assert textract.calls['start_expense_analysis'] == 1
+    assert textract.calls['get_expense_analysis'] == 1
+
+
+def test_large_document_uses_an_async_job(monkeypatch, s3, textract, result_cache, make_pdf):
+    key = 'uploads/large.pdf'
+    size = upload(s3, key, make_pdf(1))
+    monkeypatch.setattr(lambda_s3_textract, 'ASYNC_SIZE_THRESHOLD', size - 1)
+
+    body = extract_receipt(BUCKET, key, 'application/pdf', size)
+
+    assert body['statusCode'] == 200
+    assert 'analyze_expense' not in textract.calls
+    assert textract.calls['start_expense_analysis'] == 1
+
+
+def test_async_job_output_is_streamed_from_s3(monkeypatch, s3, textract, result_cache, make_pdf):
+    monkeypatch.setattr(lambda_s3_textract, 'ASYNC_PAGE_THRESHOLD', 0)
+    monkeypatch.setattr(lambda_s3_textract, 'TEXTRACT_OUTPUT_BUCKET', 'results')
+    textract.output_s3 = s3
+    key = 'uploads/receipt.pdf'
+    size = upload(s3, key, make_pdf(1))
+
+    body = extract_receipt(BUCKET, key, 'application/pdf', size)
+
+    assert body['statusCode'] == 200
+    assert body['data'][0]['store_name'] == 'Sample Market'
+    # GetExpenseAnalysis only reports the status, the documents come from S3
+    assert textract.calls['get_expense_analysis'] == 1
+    assert s3.calls['list_objects_v2'] == 1
+
+
+def test_invalid_async_job_output_is_rejected(monkeypatch, s3, textract, result_cache, make_pdf):
+    monkeypatch.setattr(lambda_s3_textract, 'ASYNC_PAGE_THRESHOLD', 0)
+    monkeypatch.setattr(lambda_s3_textract, 'TEXTRACT_OUTPUT_BUCKET', 'results')
+    textract.output_s3 = s3
+    start_expense_job = lambda_s3_textract.start_expense_job
+
+    def start_job_with_truncated_output(*args, **kwargs):
+        job_id = start_expense_job(*args, **kwargs)
+        s3.put_object(Bucket='results', Key=f'textract-output/{job_id}/1', Body=b'{"ExpenseDocuments": [{')
+        return job_id
+
+    monkeypatch.setattr(lambda_s3_textract, 'start_expense_job', start_job_with_truncated_output)
+    key = 'uploads/receipt.pdf'
+    size = upload(s3, key, make_pdf(1))
+
+    body = extract_receipt(BUCKET, key, 'application/pdf', size)
+
+    assert body['statusCode'] == 400
+
+
+def test_async_job_with_sns_is_left_to_completion_handler(monkeypatch, s3, textract, result_cache, make_pdf):
+    monkeypatch.setattr(lambda_s3_textract, 'ASYNC_PAGE_THRESHOLD', 0)
+    monkeypatch.setattr(lambda_s3_textract, 'TEXTRACT_SNS_TOPIC_ARN', 'arn:aws:sns:topic')
+    monkeypatch.setattr(lambda_s3_textract, 'TEXTRACT_SNS_ROLE_ARN', 'arn:aws:iam::role')
+    key = 'uploads/receipt.pdf'
+    size = upload(s3, key, make_pdf(1))
+
+    assert extract_receipt(BUCKET, key, 'application/pdf', size) is None
+    assert textract.calls == {'start_expense_analysis': 1}
+
+
+def test_rejected_document_never_reaches_textract(s3, textract, result_cache):
+    key = 'uploads/notes.txt'
+    size = upload(s3, key, b'just some text, not a receipt')
+
+    body = extract_receipt(BUCKET, key, 'text/plain', size)
+
+    assert body['statusCode'] == 415
+    assert textract.calls == {}
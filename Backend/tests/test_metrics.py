@@ -0,0 +1,22 @@
+"""Shared percentile helper used by the latency summaries."""
+
+import pytest
+
+from metrics import percentile
+
+
+def test_percentile_of_no_values_is_zero():
+    assert percentile([], 95) == 0.0
+
+
+def test_percentile_of_one_value_is_that_value():
+    assert percentile([7.0], 50) == 7.0
+    assert percentile([7.0], 99) == 7.0
+
+
+def test_percentile_interpolates_between_ranks():
+    values = [40.0, 10.0, 30.0, 20.0]
+    assert percentile(values, 0) == 10.0
+    assert percentile(values, 100) == 40.0
+    assert percentile(values, 50) == pytest.approx(25.0)
+    assert percentile(values, 95) == pytest.approx(38.5)
@@ -0,0 +1,60 @@
+"""Ownership of multipart uploads started through accept-files-dev."""
+
+import pytest
+
+from multipart_upload import MultipartUploadError, check_upload_token, upload_token
+
+KEY = 'uploads/receipt_1.pdf'
+SESSION_A = 'session-a'
+SESSION_B = 'session-b'
+
+
+class StubS3:
+    def __init__(self):
+        self.aborted = []
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+
+
+def test_token_is_accepted_for_its_own_upload():
+    token = upload_token(KEY, 'upload-1', SESSION_A)
+
+    check_upload_token(KEY, 'upload-1', SESSION_A, token)
+
+
+@pytest.mark.parametrize('key, upload_id, owner, token', [
+    (KEY, 'upload-1', SESSION_B, upload_token(KEY, 'upload-1', SESSION_A)),
+    (KEY, 'upload-2', SESSION_A, upload_token(KEY, 'upload-1', SESSION_A)),
+    ('uploads/receipt_2.pdf', 'upload-1', SESSION_A, upload_token(KEY, 'upload-1', SESSION_A)),
+    (KEY, 'upload-1', SESSION_A, None),
+])
+def test_token_of_another_upload_or_owner_is_rejected(key, upload_id, owner, token):
+    with pytest.raises(MultipartUploadError) as excinfo:
+        check_upload_token(key, upload_id, owner, token)
+    assert excinfo.value.status_code == 403
+
+
+def test_uploads_are_bound_to_the_session_that_created_them(accept_files):
+    s3 = StubS3()
+    token = upload_token(KEY, 'upload-1', accept_files.get_upload_owner({'sessionId': SESSION_A}, 'conn-1'))
+    body = {'key': KEY, 'uploadId': 'upload-1', 'uploadToken': token}
+
+    with pytest.raises(MultipartUploadError):
+        accept_files.run_multipart_action(s3, 'abortMultipartUpload', {**body, 'sessionId': SESSION_B}, 'bucket', 'conn-2')
+    assert s3.aborted == []
+
+    # the same session may continue after reconnecting with a new connection id
+    accept_files.run_multipart_action(s3, 'abortMultipartUpload', {**body, 'sessionId': SESSION_A}, 'bucket', 'conn-2')
+    assert s3.aborted == ['upload-1']
+
+
+def test_uploads_without_a_session_are_bound_to_the_connection(accept_files):
+    s3 = StubS3()
+    token = upload_token(KEY, 'upload-1', accept_files.get_upload_owner({}, 'conn-1'))
+    body = {'key': KEY, 'uploadId': 'upload-1', 'uploadToken': token}
+
+    with pytest.raises(MultipartUploadError):
+        accept_files.run_multipart_action(s3, 'abortMultipartUpload', body, 'bucket', 'conn-2')
+    accept_files.run_multipart_action(s3, 'abortMultipartUpload', body, 'bucket', 'conn-1')
+    assert s3.aborted == ['upload-1']
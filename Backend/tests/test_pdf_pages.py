@@ -0,0 +1,97 @@
+"""Splitting PDFs into pages and merging the per-page Textract responses."""
+
+from lambda_s3_textract import extract_receipt
+from pdf_pages import count_pdf_pages, is_pdf, merge_expense_responses, split_pdf_pages
+
+BUCKET = 'receipts'
+
+
+def field(field_type: str, text: str) -> dict:
+    return {'Type': {'Text': field_type}, 'ValueDetection': {'Text': text}}
+
+
+def page_response(*summary_fields, items=()) -> dict:
+    return {
+        'ExpenseDocuments': [{
+            'SummaryFields': list(summary_fields),
+            'LineItemGroups': [{
+                'LineItemGroupIndex': 1,
+                'LineItems': [{'LineItemExpenseFields': [field('ITEM', item)]} for item in items],
+            }],
+        }]
+    }
+
+
+def test_is_pdf():
+    assert is_pdf('uploads/receipt.PDF')
+    assert is_pdf('uploads/receipt', 'application/pdf')
+    assert not is_pdf('uploads/receipt.jpg', 'image/jpeg')
+
+
+def test_split_pdf_pages(make_pdf):
+    pages = split_pdf_pages(make_pdf(3))
+
+    assert len(pages) == 3
+    assert all(len(split_pdf_pages(page)) == 1 for page in pages)
+
+
+def test_count_pdf_pages(make_pdf):
+    assert count_pdf_pages(make_pdf(3)) == 3
+    assert count_pdf_pages(b'%PDF-1.4 garbage') == 1
+
+
+def test_single_page_and_unreadable_documents_are_kept_whole(make_pdf):
+    document = make_pdf(1)
+
+    assert split_pdf_pages(document) == [document]
+    assert split_pdf_pages(b'%PDF-1.4 garbage') == [b'%PDF-1.4 garbage']
+
+
+def test_long_receipt_is_merged_into_one_document():
+    merged = merge_expense_responses([
+        page_response(field('VENDOR_NAME', 'Market'), items=['Coffee']),
+        page_response(field('TOTAL', '$5.25'), items=['Bagel']),
+    ])
+
+    assert merged['DocumentMetadata'] == {'Pages': 2}
+    [doc] = merged['ExpenseDocuments']
+    assert [(f['Type']['Text'], f['PageNumber']) for f in doc['SummaryFields']] == [('VENDOR_NAME', 1), ('TOTAL', 2)]
+    assert [group['LineItemGroupIndex'] for group in doc['LineItemGroups']] == [1, 2]
+
+
+def test_receipts_end_at_their_total():
+    merged = merge_expense_responses([
+        page_response(field('VENDOR_NAME', 'Market'), field('TOTAL', '$5.25'), items=['Coffee']),
+        page_response(field('VENDOR_NAME', 'Bakery'), items=['Bagel']),
+        page_response(field('TOTAL', '$2.25')),
+        # pages after the last total belong to the last receipt
+        page_response(items=['Napkins']),
+    ])
+
+    first, second = merged['ExpenseDocuments']
+    assert [doc['ExpenseIndex'] for doc in (first, second)] == [1, 2]
+    assert [f['ValueDetection']['Text'] for f in first['SummaryFields']] == ['Market', '$5.25']
+    assert [f['ValueDetection']['Text'] for f in second['SummaryFields']] == ['Bakery', '$2.25']
+    assert len(second['LineItemGroups']) == 3
+
+
+def test_first_page_with_a_field_wins():
+    merged = merge_expense_responses([
+        page_response(field('VENDOR_NAME', 'Market')),
+        page_response(field('VENDOR_NAME', 'Page footer'), field('TOTAL', '$5.25')),
+    ])
+
+    [doc] = merged['ExpenseDocuments']
+    vendors = [f['ValueDetection']['Text'] for f in doc['SummaryFields'] if f['Type']['Text'] == 'VENDOR_NAME']
+    assert vendors == ['Market']
+
+
+def test_pdf_pages_are_analyzed_separately(s3, textract, result_cache, make_pdf):
+    key = 'uploads/receipt.pdf'
+    s3.put_object(Bucket=BUCKET, Key=key, Body=make_pdf(3))
+
+    body = extract_receipt(BUCKET, key, 'application/pdf')
+
+    assert textract.calls == {'analyze_expense': 3}
+    # every sample page ends with a TOTAL, so each page is its own receipt
+    assert len(body['data']) == 3
@@ -0,0 +1,101 @@
+"""Content hash -> parsed receipts cache."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import result_cache as result_cache_module
+from lambda_s3_textract import extract_receipt
+from result_cache import (
+    NullResultCache,
+    ResultCache,
+    SQLiteResultCache,
+    cache_get,
+    cache_put,
+    gen_hash,
+    get_result_cache,
+    set_result_cache,
+)
+
+BUCKET = 'receipts'
+RECEIPTS = [{'store_name': 'Sample Market', 'total': '$5.25', 'items': []}]
+
+
+def test_hit_after_put(result_cache):
+    content_hash = gen_hash(b'receipt')
+
+    assert cache_get(content_hash) is None
+    cache_put(content_hash, RECEIPTS)
+    assert cache_get(content_hash) == RECEIPTS
+
+
+def test_entries_are_shared_through_the_file(result_cache):
+    cache_put('hash', RECEIPTS)
+
+    assert SQLiteResultCache(result_cache.path).get('hash') == RECEIPTS
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = SQLiteResultCache(str(tmp_path / 'cache.sqlite3'), ttl_seconds=0)
+
+    cache.put('hash', RECEIPTS)
+
+    assert cache.get('hash') is None
+
+
+def test_backend_failures_are_misses():
+    class BrokenCache(ResultCache):
+        def get(self, content_hash):
+            raise RuntimeError('unreachable')
+
+        def put(self, content_hash, receipts):
+            raise RuntimeError('unreachable')
+
+    set_result_cache(BrokenCache())
+    try:
+        cache_put('hash', RECEIPTS)
+        assert cache_get('hash') is None
+    finally:
+        set_result_cache(None)
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        ResultCache()
+
+
+def test_concurrent_first_use_creates_one_cache(monkeypatch):
+    created = []
+    lock = threading.Lock()
+
+    def select_backend(*args):
+        time.sleep(0.01)
+        with lock:
+            created.append(NullResultCache())
+            return created[-1]
+
+    monkeypatch.setattr(result_cache_module, 'select_backend', select_backend)
+    set_result_cache(None)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            caches = list(executor.map(lambda _: get_result_cache(), range(8)))
+    finally:
+        set_result_cache(None)
+
+    assert len(created) == 1
+    assert all(cache is created[0] for cache in caches)
+
+
+def test_identical_upload_is_served_from_the_result_cache(s3, textract, result_cache, make_pdf):
+    document = make_pdf(1)
+    s3.put_object(Bucket=BUCKET, Key='uploads/a.pdf', Body=document)
+    s3.put_object(Bucket=BUCKET, Key='uploads/b.pdf', Body=document)
+
+    first = extract_receipt(BUCKET, 'uploads/a.pdf', 'application/pdf', len(document))
+    second = extract_receipt(BUCKET, 'uploads/b.pdf', 'application/pdf', len(document))
+
+    assert first['statusCode'] == 200
+    assert second == first
+    assert textract.calls == {'analyze_expense': 1}
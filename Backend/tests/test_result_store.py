@@ -0,0 +1,107 @@
+"""Stored results replayed to reconnecting clients."""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import result_store as result_store_module
+from fake_aws import FakeGateway
+from result_store import (
+    NullResultStore,
+    ResultStore,
+    SQLiteResultStore,
+    get_result_store,
+    replay_results,
+    set_result_store,
+    store_result,
+)
+
+BODY = {'statusCode': 200, 'data': [{'store_name': 'Sample Market'}]}
+
+
+@pytest.fixture
+def result_store(tmp_path):
+    store = SQLiteResultStore(str(tmp_path / 'results.sqlite3'))
+    set_result_store(store)
+    yield store
+    set_result_store(None)
+
+
+def test_results_are_replayed_by_session(result_store):
+    store_result('file-1', 'session-a', BODY)
+    store_result('file-2', 'session-b', BODY)
+
+    replayed = replay_results('session-a')
+
+    assert [result['fileId'] for result in replayed] == ['file-1']
+    assert replayed[0]['body'] == BODY
+
+
+def test_expired_results_are_not_replayed(tmp_path):
+    set_result_store(SQLiteResultStore(str(tmp_path / 'results.sqlite3'), ttl_seconds=0))
+    try:
+        store_result('file-1', 'session-a', BODY)
+        assert replay_results('session-a') == []
+    finally:
+        set_result_store(None)
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        ResultStore()
+
+
+def test_concurrent_first_use_creates_one_store(monkeypatch):
+    created = []
+    lock = threading.Lock()
+
+    def select_backend(*args):
+        time.sleep(0.01)
+        with lock:
+            created.append(NullResultStore())
+            return created[-1]
+
+    monkeypatch.setattr(result_store_module, 'select_backend', select_backend)
+    set_result_store(None)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            stores = list(executor.map(lambda _: get_result_store(), range(8)))
+    finally:
+        set_result_store(None)
+
+    assert len(created) == 1
+    assert all(store is created[0] for store in stores)
+
+
+def test_files_of_other_sessions_are_never_replayed(result_store):
+    store_result('file-1', 'session-a', BODY)
+    store_result('file-2', 'session-b', BODY)
+    store_result('file-3', None, BODY)
+
+    replayed = replay_results('session-a', file_ids=['file-1', 'file-2', 'file-3'])
+
+    assert [result['fileId'] for result in replayed] == ['file-1']
+
+
+def test_requested_files_are_replayed_regardless_of_since(result_store):
+    store_result('file-1', 'session-a', BODY)
+
+    assert replay_results('session-a', since=time.time() + 60) == []
+    assert [result['fileId'] for result in replay_results('session-a', ['file-1'], since=time.time() + 60)] == ['file-1']
+
+
+def test_replay_needs_the_session_that_stored_the_results(monkeypatch, accept_files, result_store):
+    gateway = FakeGateway()
+    monkeypatch.setattr(accept_files, 'get_gateway_client', lambda: gateway)
+    store_result('file-1', 'session-a', BODY)
+
+    assert accept_files.handle_replay({'fileIds': ['file-1']}, 'conn-2')['statusCode'] == 400
+    accept_files.handle_replay({'sessionId': 'session-b', 'fileIds': ['file-1']}, 'conn-2')
+    accept_files.handle_replay({'sessionId': 'session-a'}, 'conn-3')
+
+    replayed = {connection_id: json.loads(data)['results'] for _, connection_id, data in gateway.posts}
+    assert replayed['conn-2'] == []
+    assert [result['fileId'] for result in replayed['conn-3']] == ['file-1']
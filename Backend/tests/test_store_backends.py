@@ -0,0 +1,53 @@
+"""Backend selection shared by the stores."""
+
+import pytest
+
+from store_backends import select_backend
+
+FACTORIES = {'sqlite': lambda: 'sqlite store', 'dynamodb': lambda: 'dynamodb store'}
+
+
+def disabled():
+    return 'null store'
+
+
+def select() -> str:
+    return select_backend('TEST_STORE', FACTORIES, disabled, 'nothing is shared')
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    for name in ('TEST_STORE_BACKEND', 'TEST_STORE_TABLE', 'AWS_LAMBDA_FUNCTION_NAME'):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_sqlite_is_the_default_outside_lambda(monkeypatch):
+    monkeypatch.setenv('TEST_STORE_TABLE', 'table')
+
+    assert select() == 'sqlite store'
+
+
+def test_backend_is_chosen_by_name(monkeypatch):
+    monkeypatch.setenv('TEST_STORE_BACKEND', 'dynamodb')
+
+    assert select() == 'dynamodb store'
+
+
+def test_none_and_unknown_names_disable_the_store(monkeypatch):
+    for name in ('none', 'redis'):
+        monkeypatch.setenv('TEST_STORE_BACKEND', name)
+        assert select() == 'null store'
+
+
+def test_dynamodb_is_the_default_inside_lambda_when_a_table_is_set(monkeypatch):
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'receipts')
+    monkeypatch.setenv('TEST_STORE_TABLE', 'table')
+
+    assert select() == 'dynamodb store'
+
+
+def test_sqlite_inside_lambda_warns(monkeypatch, caplog):
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'receipts')
+
+    assert select() == 'sqlite store'
+    assert 'nothing is shared' in caplog.text
@@ -0,0 +1,83 @@
+"""Incremental parsing of serialized Textract responses."""
+
+import io
+import json
+
+import pytest
+
+from stream_parser import DROPPED_KEYS, StreamFormatError, iter_expense_documents
+from synthetic_textract import generate_expense_response
+
+
+def without_dropped_keys(value):
+    if isinstance(value, dict):
+        return {key: without_dropped_keys(item) for key, item in value.items() if key not in DROPPED_KEYS}
+    if isinstance(value, list):
+        return [without_dropped_keys(item) for item in value]
+    return value
+
+
+def parse(text: str, chunk_size: int = 64 * 1024):
+    return list(iter_expense_documents(io.BytesIO(text.encode()), chunk_size))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64 * 1024])
+def test_documents_match_a_full_parse_at_any_chunk_size(chunk_size):
+    response = generate_expense_response(documents=3, line_items=5, include_geometry=True, include_blocks=True)
+
+    documents = parse(json.dumps(response, indent=1), chunk_size)
+
+    assert documents == without_dropped_keys(response['ExpenseDocuments'])
+    assert 'Blocks' not in documents[0]
+
+
+def test_values_cut_at_chunk_boundaries_are_completed():
+    # the number ends the first chunk but continues in the next one
+    text = '{"ExpenseDocuments": [{"ExpenseIndex": 12345}], "Pages": 67890}'
+
+    assert parse(text, chunk_size=len('{"ExpenseDocuments": [{"ExpenseIndex": 12')) == [{'ExpenseIndex': 12345}]
+
+
+def test_utf8_sequences_split_across_chunks_are_decoded():
+    document = {'ExpenseIndex': 1, 'Vendor': 'Café ☕ 😀'}
+    data = json.dumps({'ExpenseDocuments': [document]}, ensure_ascii=False).encode()
+
+    for chunk_size in (1, 2, 3):
+        assert list(iter_expense_documents(io.BytesIO(data), chunk_size)) == [document]
+
+
+def test_text_streams_and_paths_are_read(tmp_path):
+    text = json.dumps({'DocumentMetadata': {'Pages': 1}, 'ExpenseDocuments': [{'ExpenseIndex': 1}]})
+    path = tmp_path / 'response.json'
+    path.write_text(text)
+
+    assert list(iter_expense_documents(io.StringIO(text), chunk_size=4)) == [{'ExpenseIndex': 1}]
+    assert list(iter_expense_documents(str(path))) == [{'ExpenseIndex': 1}]
+
+
+def test_documents_are_yielded_before_the_stream_is_read_to_the_end():
+    stream = io.BytesIO(json.dumps({'ExpenseDocuments': [{'ExpenseIndex': i} for i in range(100)]}).encode())
+
+    documents = iter_expense_documents(stream, chunk_size=16)
+
+    assert next(documents) == {'ExpenseIndex': 0}
+    assert stream.tell() < len(stream.getvalue())
+
+
+def test_empty_document_list():
+    assert parse('{"ExpenseDocuments": []}') == []
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '[]',
+    '{}',
+    '{"DocumentMetadata": {"Pages": 1}}',
+    '{"ExpenseDocuments": [{"ExpenseIndex": 1}',
+    '{"ExpenseDocuments": [{"ExpenseIndex": 1} {"ExpenseIndex": 2}]}',
+    '{"ExpenseDocuments": [{"ExpenseIndex": }]}',
+    '{"ExpenseDocuments": [] "Pages": 1}',
+])
+def test_invalid_responses_raise(text):
+    with pytest.raises(StreamFormatError):
+        parse(text, chunk_size=4)
@@ -0,0 +1,168 @@
+"""Asynchronous Textract jobs: start, poll, pagination and failures."""
+
+import json
+
+import pytest
+
+from fake_aws import FakeS3
+from fake_textract import FakeTextract, sample_expense_response
+from rate_limiter import AdaptiveRateLimiter, RateLimitedClient
+from textract_jobs import (
+    MAX_RESULTS_PER_PAGE,
+    TextractJobError,
+    collect_expense_job,
+    iter_expense_job_documents,
+    iter_job_output_documents,
+    list_job_output_keys,
+    poll_expense_job,
+    start_expense_job,
+    wait_for_expense_job,
+)
+
+
+def documents_factory(count: int):
+    """Serve a response holding count copies of the sample expense document."""
+    [document] = sample_expense_response()['ExpenseDocuments']
+    return lambda location: {'ExpenseDocuments': [document] * count}
+
+
+def test_start_returns_the_job_id():
+    textract = FakeTextract()
+
+    job_id = start_expense_job(textract, 'receipts', 'uploads/receipt.pdf')
+
+    assert job_id
+    assert textract.calls == {'start_expense_analysis': 1}
+
+
+def test_starting_the_same_object_version_again_returns_the_same_job():
+    textract = FakeTextract()
+
+    first = start_expense_job(textract, 'receipts', 'uploads/receipt.pdf', version='"etag-1"')
+    again = start_expense_job(textract, 'receipts', 'uploads/receipt.pdf', version='"etag-1"')
+    reuploaded = start_expense_job(textract, 'receipts', 'uploads/receipt.pdf', version='"etag-2"')
+
+    assert again == first
+    assert reuploaded != first
+
+
+def test_start_retried_after_a_timeout_does_not_start_a_second_job():
+    from botocore.exceptions import ReadTimeoutError
+
+    class TimesOutOnce(FakeTextract):
+        def start_expense_analysis(self, **kwargs):
+            response = super().start_expense_analysis(**kwargs)
+            if self.calls['start_expense_analysis'] == 1:
+                # the job was started, but the response never arrived
+                raise ReadTimeoutError(endpoint_url='https://textract')
+            return response
+
+    textract = TimesOutOnce()
+    client = RateLimitedClient(textract, AdaptiveRateLimiter(rate=1000, base_delay=0))
+
+    job_id = start_expense_job(client, 'receipts', 'uploads/receipt.pdf', version='etag')
+
+    assert textract.calls['start_expense_analysis'] == 2
+    assert list(textract._jobs) == [job_id]
+
+
+def test_poll_waits_until_the_job_finished():
+    textract = FakeTextract(job_duration=0.05)
+    job_id = start_expense_job(textract, 'receipts', 'uploads/receipt.pdf')
+
+    page = poll_expense_job(textract, job_id, timeout=5, initial_delay=0.01, max_delay=0.02)
+
+    assert page['JobStatus'] == 'SUCCEEDED'
+    assert textract.calls['get_expense_analysis'] > 1
+
+
+def test_poll_times_out():
+    textract = FakeTextract(job_duration=60)
+    job_id = start_expense_job(textract, 'receipts', 'uploads/receipt.pdf')
+
+    with pytest.raises(TextractJobError) as excinfo:
+        poll_expense_job(textract, job_id, timeout=0.05, initial_delay=0.01, max_delay=0.01)
+    assert excinfo.value.job_id == job_id
+
+
+def test_every_result_page_is_fetched():
+    documents = 2 * MAX_RESULTS_PER_PAGE + 5
+    textract = FakeTextract(response_factory=documents_factory(documents))
+    job_id = start_expense_job(textract, 'receipts', 'uploads/long.pdf')
+
+    response = wait_for_expense_job(textract, job_id, initial_delay=0.01)
+
+    assert len(response['ExpenseDocuments']) == documents
+    assert textract.calls['get_expense_analysis'] == 3
+
+
+def test_documents_are_yielded_one_page_at_a_time():
+    textract = FakeTextract(response_factory=documents_factory(MAX_RESULTS_PER_PAGE + 5))
+    job_id = start_expense_job(textract, 'receipts', 'uploads/long.pdf')
+
+    documents = iter_expense_job_documents(textract, job_id)
+    for _ in range(MAX_RESULTS_PER_PAGE):
+        next(documents)
+    assert textract.calls['get_expense_analysis'] == 1
+
+    assert len(list(documents)) == 5
+    assert textract.calls['get_expense_analysis'] == 2
+
+
+@pytest.mark.parametrize('first_page, message', [
+    ({'JobStatus': 'FAILED', 'StatusMessage': 'Unsupported document'}, 'Unsupported document'),
+    ({'JobStatus': 'IN_PROGRESS'}, 'still in progress'),
+])
+def test_unfinished_job_raises(first_page, message):
+    with pytest.raises(TextractJobError, match=message):
+        collect_expense_job(FakeTextract(), 'job', first_page=first_page)
+
+
+def test_partial_success_keeps_the_documents():
+    first_page = {
+        'JobStatus': 'PARTIAL_SUCCESS',
+        'Warnings': [{'ErrorCode': 'PAGE_ERROR', 'Pages': [2]}],
+        'ExpenseDocuments': [{'ExpenseIndex': 1}],
+    }
+
+    response = collect_expense_job(FakeTextract(), 'job', first_page=first_page)
+
+    assert response['ExpenseDocuments'] == [{'ExpenseIndex': 1}]
+
+
+def test_job_output_is_streamed_from_s3():
+    s3 = FakeS3()
+    textract = FakeTextract(response_factory=documents_factory(2 * MAX_RESULTS_PER_PAGE + 5), output_s3=s3)
+    job_id = start_expense_job(textract, 'receipts', 'uploads/long.pdf',
+                               output_config={'S3Bucket': 'results', 'S3Prefix': 'textract-output'})
+
+    documents = list(iter_job_output_documents(s3, job_id, 'results', 'textract-output'))
+
+    assert len(documents) == 2 * MAX_RESULTS_PER_PAGE + 5
+    assert s3.calls['get_object'] == 3
+    assert 'get_expense_analysis' not in textract.calls
+
+
+def test_output_files_are_listed_in_page_order():
+    s3 = FakeS3()
+    for name in ('10', '2', '1', '.s3_access_check'):
+        s3.put_object(Bucket='results', Key=f'out/job/{name}', Body=b'{}')
+    s3.put_object(Bucket='results', Key='out/other-job/3', Body=b'{}')
+
+    assert list_job_output_keys(s3, 'job', 'results', 'out/') == ['out/job/1', 'out/job/2', 'out/job/10']
+
+
+def test_output_of_every_file_is_kept_in_order():
+    s3 = FakeS3()
+    for page in (1, 2):
+        body = json.dumps({'ExpenseDocuments': [{'ExpenseIndex': page}]}).encode()
+        s3.put_object(Bucket='results', Key=f'out/job/{page}', Body=body)
+
+    documents = iter_job_output_documents(s3, 'job', 'results', 'out')
+
+    assert [document['ExpenseIndex'] for document in documents] == [1, 2]
+
+
+def test_missing_output_raises():
+    with pytest.raises(TextractJobError, match='no results'):
+        list(iter_job_output_documents(FakeS3(), 'job', 'results', 'out'))
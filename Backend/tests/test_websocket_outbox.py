@@ -0,0 +1,117 @@
+"""Batching and chunking of websocket deliveries."""
+
+import json
+import random
+import threading
+from typing import List, Tuple
+
+from wire_encoding import ChunkAssembler
+from websocket_outbox import WebsocketOutbox, split_frames
+
+BODY = {'statusCode': 200, 'data': [{'store_name': 'Sample Market', 'items': []}]}
+
+
+class Recorder:
+    """post callable recording every (connection_id, data)."""
+
+    def __init__(self, fail: bool = False):
+        self.posts: List[Tuple[str, str]] = []
+        self.fail = fail
+        self._lock = threading.Lock()
+
+    def __call__(self, connection_id: str, data: str) -> None:
+        if self.fail:
+            raise RuntimeError('GoneException')
+        with self._lock:
+            self.posts.append((connection_id, data))
+
+    def messages(self, connection_id: str) -> list:
+        assembler = ChunkAssembler()
+        received = (assembler.receive(data) for conn, data in self.posts if conn == connection_id)
+        return [message for message in received if message is not None]
+
+
+def test_results_of_one_connection_share_a_message():
+    post = Recorder()
+    outbox = WebsocketOutbox(post, window_ms=60_000)
+
+    deliveries = [outbox.enqueue('conn', f'file-{i}', BODY) for i in range(3)]
+    assert post.posts == []
+    outbox.flush()
+
+    assert all(delivery.result(timeout=1) for delivery in deliveries)
+    assert post.messages('conn') == [{
+        'type': 'extractText',
+        'results': [{'fileId': f'file-{i}', 'body': BODY} for i in range(3)],
+    }]
+    assert outbox.stats() == {'messages_sent': 1, 'results_sent': 3}
+
+
+def test_single_result_keeps_the_original_shape():
+    post = Recorder()
+    outbox = WebsocketOutbox(post, window_ms=0)
+
+    assert outbox.send('conn', 'file-1', BODY)
+
+    assert post.messages('conn') == [{'type': 'extractText', 'fileId': 'file-1', 'body': BODY}]
+
+
+def test_connections_and_encodings_are_batched_apart():
+    post = Recorder()
+    outbox = WebsocketOutbox(post, window_ms=60_000)
+
+    outbox.enqueue('a', 'file-1', BODY)
+    outbox.enqueue('b', 'file-2', BODY)
+    outbox.enqueue('a', 'file-3', BODY, encoding='gzip')
+    outbox.flush()
+
+    assert len(post.posts) == 3
+    assert [message['fileId'] for message in post.messages('a')] == ['file-1', 'file-3']
+
+
+def test_window_flushes_on_its_own():
+    post = Recorder()
+    outbox = WebsocketOutbox(post, window_ms=10)
+
+    assert outbox.send('conn', 'file-1', BODY)
+    assert len(post.posts) == 1
+
+
+def test_json_batch_is_split_to_fit_frames():
+    post = Recorder()
+    outbox = WebsocketOutbox(post, window_ms=60_000, max_frame_bytes=400)
+
+    for i in range(6):
+        outbox.enqueue('conn', f'file-{i}', BODY)
+    outbox.flush()
+
+    assert len(post.posts) > 1
+    assert all(json.loads(data)['type'] == 'extractText' for _, data in post.posts)
+    file_ids = []
+    for message in post.messages('conn'):
+        file_ids += [result['fileId'] for result in message.get('results', [message])]
+    assert file_ids == [f'file-{i}' for i in range(6)]
+
+
+def test_oversized_result_is_chunked():
+    post = Recorder()
+    outbox = WebsocketOutbox(post, window_ms=0, max_frame_bytes=1024)
+    # random names, so gzip cannot shrink the result into one frame
+    rng = random.Random(0)
+    body = {'statusCode': 200, 'data': [{'items': [{'name': f'Item {rng.random()}'} for _ in range(200)]}]}
+
+    assert outbox.send('conn', 'file-1', body, encoding='gzip')
+
+    assert len(post.posts) > 1
+    assert post.messages('conn') == [{'type': 'extractText', 'fileId': 'file-1', 'body': body}]
+
+
+def test_failed_post_resolves_false():
+    outbox = WebsocketOutbox(Recorder(fail=True), window_ms=0)
+
+    assert outbox.send('conn', 'file-1', BODY) is False
+    assert outbox.stats() == {'messages_sent': 0, 'results_sent': 0}
+
+
+def test_split_frames_never_splits_a_single_result():
+    assert split_frames(['x' * 500, 'y', 'z'], max_bytes=100) == [[0], [1, 2]]
@@ -0,0 +1,105 @@
+"""Encoding negotiation, chunking and ChunkAssembler round trips."""
+
+import json
+import random
+
+import pytest
+
+from wire_encoding import (
+    DEFAULT_ENCODING,
+    ChunkAssembler,
+    encode_message,
+    negotiate_encoding,
+    supported_encodings,
+)
+
+MAX_FRAME_BYTES = 1024
+
+
+def make_message(items: int) -> dict:
+    rng = random.Random(items)
+    return {
+        'type': 'extractText',
+        'fileId': 'file-1',
+        'body': {
+            'statusCode': 200,
+            'data': [{
+                'store_name': 'Café "Ünïcode"',
+                'items': [{'name': f'Item {i} {rng.random()}', 'price': f'${i}.99'} for i in range(items)],
+            }],
+        },
+    }
+
+
+def receive_all(frames) -> dict:
+    assembler = ChunkAssembler()
+    messages = [message for message in map(assembler.receive, frames) if message is not None]
+    assert len(messages) == 1
+    return messages[0]
+
+
+@pytest.mark.parametrize('accepted, expected', [
+    (None, DEFAULT_ENCODING),
+    ([], DEFAULT_ENCODING),
+    ('gzip', DEFAULT_ENCODING),
+    (['brotli', 'gzip'], 'gzip'),
+    (['brotli'], DEFAULT_ENCODING),
+])
+def test_negotiate_encoding(accepted, expected):
+    assert negotiate_encoding(accepted) == expected
+
+
+@pytest.mark.parametrize('encoding', supported_encodings())
+def test_small_message_is_one_frame(encoding):
+    message = make_message(2)
+
+    frames = encode_message(message, encoding, MAX_FRAME_BYTES)
+
+    assert len(frames) == 1
+    assert receive_all(frames) == message
+
+
+@pytest.mark.parametrize('encoding', supported_encodings())
+def test_large_message_is_chunked_and_reassembled(encoding):
+    message = make_message(500)
+
+    frames = encode_message(message, encoding, MAX_FRAME_BYTES)
+
+    assert len(frames) > 1
+    assert all(len(frame.encode()) <= MAX_FRAME_BYTES for frame in frames)
+    assert all(json.loads(frame)['type'] == 'chunk' for frame in frames)
+    assert receive_all(frames) == message
+
+
+def test_chunks_can_arrive_out_of_order():
+    message = make_message(500)
+    frames = encode_message(message, 'gzip', MAX_FRAME_BYTES)
+
+    random.Random(0).shuffle(frames)
+
+    assert receive_all(frames) == message
+
+
+def test_interleaved_messages_are_kept_apart():
+    first, second = make_message(300), make_message(400)
+    first_frames = encode_message(first, DEFAULT_ENCODING, MAX_FRAME_BYTES)
+    second_frames = encode_message(second, DEFAULT_ENCODING, MAX_FRAME_BYTES)
+
+    assembler = ChunkAssembler()
+    received = []
+    for index in range(max(len(first_frames), len(second_frames))):
+        for frames in (first_frames, second_frames):
+            if index < len(frames):
+                message = assembler.receive(frames[index])
+                if message is not None:
+                    received.append(message)
+
+    assert sorted(received, key=lambda m: len(m['body']['data'][0]['items'])) == [first, second]
+
+
+def test_unknown_encoding_falls_back_to_json():
+    message = make_message(2)
+
+    frames = encode_message(message, 'brotli', MAX_FRAME_BYTES)
+
+    assert json.loads(frames[0]) == message
@@ -8,17 +8,40 @@ NOTES:
 In the real version lambda can send s3 urls rather than the entire file, triggering textract extraction
 """
 
-import boto3
 from pydantic import BaseModel, ValidationError
+import argparse
+import glob
 import logging
-from typing import List, Dict, Any, Optional
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Set
 import json
 
-logger = logging.getLogger(__name__)
+from aws_clients import get_client, log_client_stats
+from image_preprocess import preprocess_image
+from log_utils import TEXTRACT_RESPONSE_FIELDS, get_logger, log_verbose
+from metrics import percentile
+from rate_limiter import RateLimitedClient, get_rate_limiter
+from result_cache import cache_get, cache_put, gen_hash
+
+logger = get_logger(__name__)
 
 file = 'receipts.jpg'
 
-client = boto3.client('textract')
+RECEIPT_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf')
+DEFAULT_BATCH_WORKERS = 8
+MAX_BATCH_WORKERS = 32
+
+# Throttling and transient errors are retried by the shared rate limiter, not botocore
+client = RateLimitedClient(
+    get_client(
+        'textract',
+        pool_size=MAX_BATCH_WORKERS,
+        retries={'mode': 'standard', 'max_attempts': 1}
+    ),
+    get_rate_limiter()
+)
 
 
 class ReceiptItem(BaseModel):
@@ -65,14 +88,28 @@ def extract_single_file(file: str) -> Dict[str, Any]:
         with open(file, 'rb') as f:
             file_byte_data = f.read()
 
+            # identical files are served from the result cache instead of Textract
+            content_hash = gen_hash(file_byte_data)
+            cached_text = cache_get(content_hash)
+            if cached_text is not None:
+                logger.info("Result cache hit for %s", file)
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps(cached_text)
+                }
+
+            # downscaled grayscale copy when it is smaller than the original
+            image_byte_data = preprocess_image(file_byte_data)
+
             response: Dict[str, Any] = client.analyze_expense(
                 Document = {
-                    'Bytes': file_byte_data
+                    'Bytes': image_byte_data or file_byte_data
                 }
             )
-            print(response)
+            log_verbose(logger, "Textract response", response, TEXTRACT_RESPONSE_FIELDS)
             try:
                 cleaned_text = parse_extracted_text(response)
+                cache_put(content_hash, cleaned_text)
                 return {
                     'statusCode': 200,
                     'body': json.dumps(cleaned_text)
@@ -263,7 +300,7 @@ def parse_lineitemgroups(line_item_groups: List[Dict[str, Any]]) -> List[Dict[st
                     ReceiptItem.model_validate(row)
                     item_list.append(row)
                 except ValidationError as e:
-                    logger.info(f"Skipping invalid line item: {e}")
+                    logger.info("Skipping invalid line item: %s", e)
                     continue
 
     except KeyError as e:
@@ -316,6 +353,139 @@ def parse_summaryfields(summary_fields: List[Dict[str, Any]]) -> Dict[str, str]:
 
 
 
+##############
+# BATCH MODE
+##############
+def collect_batch_files(inputs: List[str]) -> List[str]:
+    """
+    Expand batch inputs into a list of receipt files.
+
+    Args:
+        inputs: Directories, glob patterns, receipt files, or manifests
+            (.txt files listing one receipt path per line)
+
+    Returns:
+        Sorted, de-duplicated list of receipt file paths
+    """
+    files: Set[str] = set()
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, names in os.walk(entry):
+                files.update(
+                    os.path.join(root, name) for name in names
+                    if name.lower().endswith(RECEIPT_EXTENSIONS)
+                )
+        elif entry.endswith('.txt') and os.path.isfile(entry):
+            with open(entry) as manifest:
+                files.update(line.strip() for line in manifest if line.strip())
+        elif glob.has_magic(entry):
+            files.update(path for path in glob.glob(entry, recursive=True) if os.path.isfile(path))
+        else:
+            files.add(entry)
+    return sorted(files)
+
+
+def load_checkpoint(output_path: str) -> Set[str]:
+    """
+    Read the files an earlier run already finished from its JSON Lines output.
+
+    Server side failures (5xx) are not considered finished so they are retried.
+    """
+    finished: Set[str] = set()
+    if not os.path.exists(output_path):
+        return finished
+
+    with open(output_path) as output:
+        for line in output:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # last line of an interrupted run may be cut off
+                continue
+            if record.get('statusCode', 500) < 500:
+                finished.add(record['file'])
+    return finished
+
+
+def extract_batch_file(path: str) -> Dict[str, Any]:
+    """Run extract_single_file on one file and shape the result as a JSON Lines record."""
+    start = time.perf_counter()
+    result = extract_single_file(path)
+    latency = time.perf_counter() - start
+    return {
+        'file': path,
+        'statusCode': result['statusCode'],
+        'body': json.loads(result['body']),
+        'latency': round(latency, 4),
+    }
+
+
+def extract_batch(inputs: List[str], output_path: str,
+                  workers: int = DEFAULT_BATCH_WORKERS) -> Dict[str, Any]:
+    """
+    Extract every receipt in inputs on a thread pool.
+
+    Results are appended to output_path as JSON Lines as soon as each file
+    completes. The output doubles as the checkpoint: files already recorded
+    there are skipped, so an interrupted run resumes where it stopped.
+
+    Args:
+        inputs: Directories, glob patterns, receipt files, or manifests
+        output_path: JSON Lines file to append results to
+        workers: Number of files processed concurrently
+
+    Returns:
+        Throughput summary with file counts, files/s and p50/p95 latency
+    """
+    files = collect_batch_files(inputs)
+    finished = load_checkpoint(output_path)
+    pending = [path for path in files if path not in finished]
+    logger.info("%d file(s) found, %d already done, %d to process", len(files), len(files) - len(pending), len(pending))
+
+    latencies: List[float] = []
+    failures = 0
+    start = time.perf_counter()
+
+    workers = max(1, min(workers, MAX_BATCH_WORKERS))
+    with open(output_path, 'a') as output, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(extract_batch_file, path) for path in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+
+            latencies.append(record['latency'])
+            if record['statusCode'] != 200:
+                failures += 1
+
+    elapsed = time.perf_counter() - start
+    log_client_stats()
+    return {
+        'files': len(files),
+        'skipped': len(files) - len(pending),
+        'processed': len(latencies),
+        'failed': failures,
+        'seconds': round(elapsed, 2),
+        'files_per_second': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        'p50_latency': round(percentile(latencies, 50), 4),
+        'p95_latency': round(percentile(latencies, 95), 4),
+    }
+
+
 if __name__ == '__main__':
-    file_content = extract_single_file(file)
-    print(file_content)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Extract receipt data with AWS Textract.')
+    parser.add_argument('inputs', nargs='*',
+                        help='receipt files, directories, glob patterns or .txt manifests (batch mode)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_BATCH_WORKERS,
+                        help='files processed concurrently in batch mode')
+    parser.add_argument('--output', default='results.jsonl',
+                        help='JSON Lines output, also used to resume an interrupted batch')
+    args = parser.parse_args()
+
+    if not args.inputs:
+        file_content = extract_single_file(file)
+        print(file_content)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        summary = extract_batch(args.inputs, args.output, args.workers)
+        print(json.dumps(summary, indent=2))
\ No newline at end of file
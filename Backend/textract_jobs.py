@@ -0,0 +1,286 @@
+"""
+Asynchronous Textract expense analysis (StartExpenseAnalysis / GetExpenseAnalysis).
+
+Used for documents that are too large or have too many pages for the
+synchronous analyze_expense call. A job is started against the S3 object and
+its results are either polled for with exponential backoff, or delivered to
+an SNS topic and collected by a completion handler. Result pages can be
+consumed one at a time with iter_expense_job_documents.
+
+Jobs started with an OutputConfig also write their results to S3, as
+numbered JSON files under <S3Prefix>/<JobId>/. iter_job_output_documents
+parses those files as streams (see stream_parser.py), so large results never
+have to be held in memory as one response.
+"""
+
+import hashlib
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from log_utils import get_logger
+from stream_parser import iter_expense_documents
+
+logger = get_logger(__name__)
+
+POLL_INITIAL_DELAY = float(os.getenv('ASYNC_POLL_INITIAL_DELAY', '1.0'))  # seconds
+POLL_MAX_DELAY = float(os.getenv('ASYNC_POLL_MAX_DELAY', '10.0'))  # seconds
+POLL_TIMEOUT = float(os.getenv('ASYNC_POLL_TIMEOUT', '600.0'))  # seconds
+MAX_RESULTS_PER_PAGE = 20
+
+
+class TextractJobError(Exception):
+    """Exception raised when an asynchronous Textract job fails or times out."""
+    def __init__(self, job_id: str, message: str):
+        self.job_id = job_id
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"Textract job {self.job_id}: {self.message}"
+
+
+def job_request_token(bucket: str, key: str, version: str = '') -> str:
+    """
+    Derive the ClientRequestToken of the job for one version of an S3 object.
+
+    Textract returns the JobId of the earlier job for a repeated token, so a
+    retried start (e.g. after a timeout) never starts and bills a second job.
+    """
+    # sha256 hex is 64 characters, the longest token Textract accepts
+    return hashlib.sha256(f"{bucket}/{key}/{version.strip(chr(34))}".encode()).hexdigest()
+
+
+def start_expense_job(textract_client, bucket: str, key: str,
+                      notification_channel: Optional[Dict[str, str]] = None,
+                      job_tag: Optional[str] = None,
+                      output_config: Optional[Dict[str, str]] = None,
+                      version: str = '') -> str:
+    """
+    Submit an asynchronous expense analysis job for an S3 object.
+
+    Starting the same object version again returns the existing job, see
+    job_request_token.
+
+    Args:
+        textract_client: Boto3 Textract client
+        bucket: Name of the S3 bucket holding the document
+        key: Object key of the document
+        notification_channel: Optional {'SNSTopicArn', 'RoleArn'} to publish completion to
+        job_tag: Optional tag echoed back in the completion notification
+        output_config: Optional {'S3Bucket', 'S3Prefix'} the results are also written to
+        version: ETag or VersionId of the object, so a re-upload under the same key gets a new job
+
+    Returns:
+        Textract JobId
+    """
+    params: Dict[str, Any] = {
+        'DocumentLocation': {
+            'S3Object': {
+                'Bucket': bucket,
+                'Name': key
+            }
+        },
+        'ClientRequestToken': job_request_token(bucket, key, version),
+    }
+    if notification_channel:
+        params['NotificationChannel'] = notification_channel
+    if job_tag:
+        params['JobTag'] = job_tag
+    if output_config:
+        params['OutputConfig'] = output_config
+
+    response = textract_client.start_expense_analysis(**params)
+    job_id = response['JobId']
+    logger.info("Started Textract expense job %s for s3://%s/%s", job_id, bucket, key)
+    return job_id
+
+
+def poll_expense_job(textract_client, job_id: str, timeout: float = POLL_TIMEOUT,
+                     initial_delay: float = POLL_INITIAL_DELAY,
+                     max_delay: float = POLL_MAX_DELAY,
+                     max_results: int = MAX_RESULTS_PER_PAGE) -> Dict[str, Any]:
+    """
+    Poll a job with exponential backoff until it is no longer in progress.
+
+    Args:
+        textract_client: Boto3 Textract client
+        job_id: Textract JobId
+        timeout: Seconds to wait before giving up
+        initial_delay: First delay between polls, doubled after every poll
+        max_delay: Upper bound on the delay between polls
+        max_results: Documents per page, 1 when only the status is needed
+
+    Returns:
+        First get_expense_analysis page of the finished job
+
+    Raises:
+        TextractJobError: If the job did not finish within timeout
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+
+    while True:
+        response = textract_client.get_expense_analysis(JobId=job_id, MaxResults=max_results)
+        if response['JobStatus'] != 'IN_PROGRESS':
+            return response
+        if time.monotonic() + delay > deadline:
+            raise TextractJobError(job_id, f'did not finish within {timeout} seconds')
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def wait_for_expense_job(textract_client, job_id: str, timeout: float = POLL_TIMEOUT,
+                         initial_delay: float = POLL_INITIAL_DELAY,
+                         max_delay: float = POLL_MAX_DELAY) -> Dict[str, Any]:
+    """
+    Poll a job until it finishes, then collect its results.
+
+    Returns:
+        Response shaped like analyze_expense output covering every result page
+
+    Raises:
+        TextractJobError: If the job failed or did not finish within timeout
+    """
+    first_page = poll_expense_job(textract_client, job_id, timeout, initial_delay, max_delay)
+    return collect_expense_job(textract_client, job_id, first_page=first_page)
+
+
+def check_job_status(job_id: str, response: Dict[str, Any]) -> None:
+    """
+    Check that a get_expense_analysis page belongs to a job whose results can be read.
+
+    Raises:
+        TextractJobError: If the job failed or is still in progress
+    """
+    status = response['JobStatus']
+    if status == 'FAILED':
+        raise TextractJobError(job_id, response.get('StatusMessage', 'job failed'))
+    if status == 'IN_PROGRESS':
+        raise TextractJobError(job_id, 'job is still in progress')
+    if status == 'PARTIAL_SUCCESS':
+        logger.warning("Textract job %s partially succeeded: %s", job_id, response.get('Warnings'))
+
+
+def iter_expense_job_documents(textract_client, job_id: str,
+                               first_page: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the ExpenseDocuments of a finished job one result page at a time.
+
+    Only the current page is held in memory, so long jobs can be parsed
+    without materializing every page first.
+
+    Args:
+        textract_client: Boto3 Textract client
+        job_id: Textract JobId
+        first_page: Already fetched first get_expense_analysis page, if any
+
+    Raises:
+        TextractJobError: If the job did not succeed
+    """
+    response = first_page or textract_client.get_expense_analysis(
+        JobId=job_id,
+        MaxResults=MAX_RESULTS_PER_PAGE
+    )
+
+    check_job_status(job_id, response)
+
+    while True:
+        yield from response.get('ExpenseDocuments', [])
+        if 'NextToken' not in response:
+            return
+        response = textract_client.get_expense_analysis(
+            JobId=job_id,
+            MaxResults=MAX_RESULTS_PER_PAGE,
+            NextToken=response['NextToken']
+        )
+
+
+def collect_expense_job(textract_client, job_id: str,
+                        first_page: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Gather every result page of a finished job into one response.
+
+    Args:
+        textract_client: Boto3 Textract client
+        job_id: Textract JobId
+        first_page: Already fetched first get_expense_analysis page, if any
+
+    Returns:
+        Response shaped like analyze_expense output
+
+    Raises:
+        TextractJobError: If the job did not succeed
+    """
+    first_page = first_page or textract_client.get_expense_analysis(
+        JobId=job_id,
+        MaxResults=MAX_RESULTS_PER_PAGE
+    )
+    expense_documents: List[Dict[str, Any]] = list(
+        iter_expense_job_documents(textract_client, job_id, first_page)
+    )
+
+    return {
+        'DocumentMetadata': first_page.get('DocumentMetadata', {}),
+        'ExpenseDocuments': expense_documents,
+    }
+
+
+def list_job_output_keys(s3_client, job_id: str, bucket: str, prefix: str) -> List[str]:
+    """
+    List the result files a job wrote to S3, in page order.
+
+    Args:
+        s3_client: Boto3 S3 client
+        job_id: Textract JobId
+        bucket: OutputConfig S3Bucket of the job
+        prefix: OutputConfig S3Prefix of the job
+
+    Returns:
+        Object keys of the numbered result files
+    """
+    job_prefix = f"{prefix.rstrip('/')}/{job_id}/"
+    pages: List[Tuple[int, str]] = []
+    params: Dict[str, Any] = {'Bucket': bucket, 'Prefix': job_prefix}
+    while True:
+        response = s3_client.list_objects_v2(**params)
+        for item in response.get('Contents', []):
+            name = item['Key'][len(job_prefix):]
+            # only the numbered result files, not Textract's access check object
+            if name.isdigit():
+                pages.append((int(name), item['Key']))
+        if not response.get('IsTruncated'):
+            break
+        params['ContinuationToken'] = response['NextContinuationToken']
+
+    return [key for _, key in sorted(pages)]
+
+
+def iter_job_output_documents(s3_client, job_id: str, bucket: str, prefix: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the ExpenseDocuments a finished job wrote to S3 one at a time.
+
+    Every result file is parsed incrementally from its S3 body, so only one
+    document is held in memory. Check the job status first (check_job_status),
+    a failed job writes no results.
+
+    Args:
+        s3_client: Boto3 S3 client
+        job_id: Textract JobId
+        bucket: OutputConfig S3Bucket of the job
+        prefix: OutputConfig S3Prefix of the job
+
+    Raises:
+        TextractJobError: If the job wrote no results
+        StreamFormatError: If a result file is not a valid expense response
+    """
+    keys = list_job_output_keys(s3_client, job_id, bucket, prefix)
+    if not keys:
+        raise TextractJobError(job_id, f'no results under s3://{bucket}/{prefix}')
+
+    for key in keys:
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+        try:
+            yield from iter_expense_documents(body)
+        finally:
+            body.close()
@@ -0,0 +1,165 @@
+"""
+Coalesced delivery of results to websocket connections.
+
+Every post_to_connection is a full HTTPS round trip to API Gateway. When many
+files of one connection finish at nearly the same time, their results are
+buffered for a short window and sent as one extractText message:
+
+    {'type': 'extractText', 'results': [{'fileId': ..., 'body': ...}, ...]}
+
+A message holding a single result keeps the original shape
+({'type': 'extractText', 'fileId': ..., 'body': ...}). Messages are sent in the
+encoding negotiated with the client (see wire_encoding.py). Plain JSON batches
+are split so that no message exceeds the websocket frame size; compressed
+batches are sent whole. Anything still larger than a frame is chunked.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from log_utils import get_logger
+from wire_encoding import DEFAULT_ENCODING, MAX_FRAME_BYTES, encode_message
+
+logger = get_logger(__name__)
+
+# Results of one connection arriving within this window share a message, 0 disables batching
+BATCH_WINDOW_MS = float(os.getenv('WEBSOCKET_BATCH_WINDOW_MS', '50'))
+
+# bytes of the {"type": "extractText", "results": [...]} envelope, separators included
+_ENVELOPE_BYTES = len(json.dumps({'type': 'extractText', 'results': []}))
+
+
+def build_message(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the extractText message for a list of {'fileId', 'body'} results."""
+    if len(results) == 1:
+        return {'type': 'extractText', **results[0]}
+    return {'type': 'extractText', 'results': results}
+
+
+def split_frames(encoded_results: List[str], max_bytes: int = MAX_FRAME_BYTES) -> List[List[int]]:
+    """
+    Group results into messages that fit in max_bytes.
+
+    Args:
+        encoded_results: JSON encoding of every result, in order
+        max_bytes: Largest message to produce
+
+    Returns:
+        Lists of indexes into encoded_results, one list per message
+    """
+    frames: List[List[int]] = []
+    current: List[int] = []
+    size = _ENVELOPE_BYTES
+    for index, encoded in enumerate(encoded_results):
+        # +2 for the ", " separator between results
+        result_size = len(encoded.encode()) + 2
+        if current and size + result_size > max_bytes:
+            frames.append(current)
+            current, size = [], _ENVELOPE_BYTES
+        current.append(index)
+        size += result_size
+    if current:
+        frames.append(current)
+    return frames
+
+
+class WebsocketOutbox:
+    """Buffers results per connectionId and posts them in batches."""
+
+    def __init__(self, post: Callable[[str, str], None], window_ms: float = BATCH_WINDOW_MS,
+                 max_frame_bytes: int = MAX_FRAME_BYTES):
+        """
+        Args:
+            post: Function sending one message, called as post(connection_id, data)
+            window_ms: How long the first result of a connection waits for others
+            max_frame_bytes: Largest message to send when several results are batched
+        """
+        self.post = post
+        self.window = window_ms / 1000
+        self.max_frame_bytes = max_frame_bytes
+        self.messages_sent = 0
+        self.results_sent = 0
+        # keyed by (connection_id, encoding)
+        self._pending: Dict[Tuple[str, str], List[Tuple[Dict[str, Any], Future]]] = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, connection_id: str, file_id: str, body: Dict[str, Any],
+                encoding: str = DEFAULT_ENCODING) -> Future:
+        """
+        Queue a file's result for its connection.
+
+        Args:
+            connection_id: Websocket connection to send to
+            file_id: Frontend identifier of the file
+            body: Result to send
+            encoding: Encoding negotiated with the client
+
+        Returns:
+            Future resolving to True once the result was delivered, False if sending failed
+        """
+        delivery: Future = Future()
+        result = {'fileId': file_id, 'body': body}
+        key = (connection_id, encoding)
+        if self.window <= 0:
+            self._send(key, [(result, delivery)])
+            return delivery
+
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = []
+                timer = threading.Timer(self.window, self.flush, args=(key,))
+                timer.daemon = True
+                timer.start()
+            pending.append((result, delivery))
+        return delivery
+
+    def send(self, connection_id: str, file_id: str, body: Dict[str, Any],
+             encoding: str = DEFAULT_ENCODING) -> bool:
+        """Queue a result and wait until its batch has been sent."""
+        return self.enqueue(connection_id, file_id, body, encoding).result()
+
+    def flush(self, key: Optional[Tuple[str, str]] = None) -> None:
+        """Send the buffered results of one (connection_id, encoding) now, or of every connection."""
+        with self._lock:
+            if key is None:
+                batches = list(self._pending.items())
+                self._pending.clear()
+            else:
+                batches = [(key, self._pending.pop(key, []))]
+
+        for batch_key, batch in batches:
+            if batch:
+                self._send(batch_key, batch)
+
+    def stats(self) -> Dict[str, int]:
+        return {'messages_sent': self.messages_sent, 'results_sent': self.results_sent}
+
+    def _send(self, key: Tuple[str, str], batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        connection_id, encoding = key
+        if encoding == DEFAULT_ENCODING:
+            encoded = [json.dumps(result) for result, _ in batch]
+            groups = split_frames(encoded, self.max_frame_bytes)
+        else:
+            # compressed batches are sent whole, chunking keeps frames in bounds
+            groups = [list(range(len(batch)))]
+
+        for group in groups:
+            results = [batch[index][0] for index in group]
+            frames = encode_message(build_message(results), encoding, self.max_frame_bytes)
+            try:
+                for frame in frames:
+                    self.post(connection_id, frame)
+                delivered = True
+            except Exception as e:
+                logger.error('Failed to write %d result(s) to socket %s: %s', len(results), connection_id, e)
+                delivered = False
+
+            with self._lock:
+                self.messages_sent += len(frames) if delivered else 0
+                self.results_sent += len(results) if delivered else 0
+            for index in group:
+                batch[index][1].set_result(delivered)
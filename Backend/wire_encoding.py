@@ -0,0 +1,174 @@
+"""
+Compact encoding and chunking of websocket messages.
+
+API Gateway rejects websocket messages over 128KB (32KB frames), and receipts
+with hundreds of line items can exceed that as plain JSON. A client asks for
+an encoding when it requests upload URLs; the negotiated encoding travels with
+the upload as object metadata, so lambda_s3_textract knows how to send back
+the result.
+
+Encodings:
+    json     plain JSON, the default; what older clients understand
+    gzip     gzip compressed JSON, base64 encoded (DecompressionStream in browsers)
+    msgpack  MessagePack, base64 encoded; only offered when msgpack is installed
+
+A message in any encoding other than json is wrapped in an envelope:
+
+    {'type': <message type>, 'encoding': 'gzip', 'payload': <base64>}
+
+Any message whose wire form is larger than one frame is split into sequenced
+chunks, which the client concatenates by seq before decoding the payload:
+
+    {'type': 'chunk', 'messageId': ..., 'seq': 0, 'total': 3,
+     'encoding': 'gzip', 'payload': <part of the payload>}
+
+For json, the payload is the JSON text of the message itself.
+"""
+
+import base64
+import gzip
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+from uuid import uuid4
+
+DEFAULT_ENCODING = 'json'
+# API Gateway websocket frames are limited to 32KB
+MAX_FRAME_BYTES = int(os.getenv('WEBSOCKET_MAX_FRAME_BYTES', str(32 * 1024)))
+GZIP_LEVEL = 6
+
+# room for the chunk envelope around each payload slice
+_CHUNK_OVERHEAD = 200
+
+
+def _msgpack_available() -> bool:
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def supported_encodings() -> List[str]:
+    """Return the encodings this deployment can produce."""
+    encodings = ['json', 'gzip']
+    if _msgpack_available():
+        encodings.append('msgpack')
+    return encodings
+
+
+def negotiate_encoding(accepted: Optional[Iterable[str]]) -> str:
+    """
+    Pick the first encoding of the client's preference list that is supported.
+
+    Args:
+        accepted: Encodings the client can decode, most preferred first
+
+    Returns:
+        Negotiated encoding, DEFAULT_ENCODING if there is no match
+    """
+    if not accepted or isinstance(accepted, str):
+        return DEFAULT_ENCODING
+    supported = supported_encodings()
+    for encoding in accepted:
+        if encoding in supported:
+            return encoding
+    return DEFAULT_ENCODING
+
+
+def encode_payload(message: Dict[str, Any], encoding: str) -> str:
+    """Serialize a message to the text payload of an envelope."""
+    if encoding == 'gzip':
+        raw = gzip.compress(json.dumps(message, separators=(',', ':')).encode(), GZIP_LEVEL)
+    elif encoding == 'msgpack':
+        import msgpack
+        raw = msgpack.packb(message)
+    else:
+        return json.dumps(message)
+    return base64.b64encode(raw).decode('ascii')
+
+
+def decode_payload(payload: str, encoding: str) -> Dict[str, Any]:
+    """Inverse of encode_payload."""
+    if encoding == 'json':
+        return json.loads(payload)
+    raw = base64.b64decode(payload)
+    if encoding == 'gzip':
+        return json.loads(gzip.decompress(raw))
+    if encoding == 'msgpack':
+        import msgpack
+        return msgpack.unpackb(raw)
+    raise ValueError(f'Unknown encoding {encoding}')
+
+
+def encode_message(message: Dict[str, Any], encoding: str = DEFAULT_ENCODING,
+                   max_frame_bytes: int = MAX_FRAME_BYTES) -> List[str]:
+    """
+    Encode a message into one or more websocket frames.
+
+    Args:
+        message: Message to send, e.g. an extractText message
+        encoding: Negotiated encoding, unknown values fall back to json
+        max_frame_bytes: Largest frame to produce
+
+    Returns:
+        Frames to post in order; a single frame when the message fits
+    """
+    if encoding not in supported_encodings():
+        encoding = DEFAULT_ENCODING
+
+    payload = encode_payload(message, encoding)
+    if encoding == DEFAULT_ENCODING:
+        frame = payload
+    else:
+        frame = json.dumps({'type': message.get('type'), 'encoding': encoding, 'payload': payload})
+    if len(frame.encode()) <= max_frame_bytes:
+        return [frame]
+
+    # base64 payloads are copied as is. JSON payloads are escaped again when the
+    # chunk is serialized: quotes double, other characters may become \uXXXX
+    slice_size = max_frame_bytes - _CHUNK_OVERHEAD
+    if encoding == DEFAULT_ENCODING:
+        slice_size //= 2 if payload.isascii() else 6
+    slices = [payload[i:i + slice_size] for i in range(0, len(payload), slice_size)]
+
+    message_id = str(uuid4())
+    return [
+        json.dumps({
+            'type': 'chunk',
+            'messageId': message_id,
+            'seq': seq,
+            'total': len(slices),
+            'encoding': encoding,
+            'payload': part,
+        })
+        for seq, part in enumerate(slices)
+    ]
+
+
+class ChunkAssembler:
+    """Reassembles received frames into messages; the reference for client decoders."""
+
+    def __init__(self):
+        self._partial: Dict[str, Dict[int, str]] = {}
+
+    def receive(self, frame: str) -> Optional[Dict[str, Any]]:
+        """
+        Feed one received frame.
+
+        Returns:
+            The decoded message once it is complete, None while chunks are missing
+        """
+        data = json.loads(frame)
+        if data.get('type') != 'chunk':
+            if 'encoding' in data and 'payload' in data:
+                return decode_payload(data['payload'], data['encoding'])
+            return data
+
+        parts = self._partial.setdefault(data['messageId'], {})
+        parts[data['seq']] = data['payload']
+        if len(parts) < data['total']:
+            return None
+        del self._partial[data['messageId']]
+        payload = ''.join(parts[seq] for seq in range(data['total']))
+        return decode_payload(payload, data['encoding'])
@@ -8,21 +8,24 @@ import ExportActions from './ExportActions';
 interface ResultsSectionProps {
   receipts: Receipt[];
   extractedData: ExtractedData[];
+  fileErrors?: { [fileId: string]: string };
   onBackToUpload?: () => void;
 }
 
-const ResultsSection: React.FC<ResultsSectionProps> = ({ receipts, extractedData, onBackToUpload }) => {
+const ResultsSection: React.FC<ResultsSectionProps> = ({ receipts, extractedData, fileErrors = {}, onBackToUpload }) => {
   const [selectedIndex, setSelectedIndex] = useState(0);
   const sectionRef = useRef<HTMLDivElement>(null);
 
   // Auto-scroll to results when they appear
+  const errorCount = Object.keys(fileErrors).length;
+
   useEffect(() => {
-    if (extractedData.length > 0 && sectionRef.current) {
+    if ((extractedData.length > 0 || errorCount > 0) && sectionRef.current) {
       sectionRef.current.scrollIntoView({ behavior: 'smooth', block: 'start' });
     }
-  }, [extractedData.length]);
+  }, [extractedData.length, errorCount]);
 
-  if (extractedData.length === 0) {
+  if (extractedData.length === 0 && errorCount === 0) {
     return null;
   }
 
@@ -35,10 +38,13 @@ const ResultsSection: React.FC<ResultsSectionProps> = ({ receipts, extractedData
   const currentReceipt = receipts[selectedIndex];
   
   // Match extracted data by fileId instead of index
-  const currentData = extractedData.find(data => data.fileId === currentReceipt.id);
+  // receipts can be empty while replayed errors are shown, so currentReceipt may be undefined
+  const currentData = currentReceipt ? extractedData.find(data => data.fileId === currentReceipt.id) : undefined;
+
+  const currentError = currentReceipt ? fileErrors[currentReceipt.id] : undefined;
 
   // Only show receipt viewer if data is available
-  if (!currentReceipt || !currentData) {
+  if (!currentReceipt || (!currentData && !currentError)) {
     return (
       <div ref={sectionRef} className="bg-gray-50 py-16">
         <div className="max-w-7xl mx-auto px-6">
@@ -84,15 +90,23 @@ const ResultsSection: React.FC<ResultsSectionProps> = ({ receipts, extractedData
 
         {/* Main Content */}
         <div className="mt-8">
-          <ReceiptViewer
-            receiptImage={currentReceipt.previewUrl}
-            isPdf={currentReceipt.isPdf}
-            fileName={currentReceipt.file.name}
-            data={currentData}
-          />
+          {currentData ? (
+            <>
+              <ReceiptViewer
+                receiptImage={currentReceipt.previewUrl}
+                isPdf={currentReceipt.isPdf}
+                fileName={currentReceipt.file.name}
+                data={currentData}
+              />
 
-          {/* Export Actions */}
-          <ExportActions data={extractedData} selectedIndex={selectedIndex} />
+              {/* Export Actions */}
+              <ExportActions data={extractedData} selectedIndex={selectedIndex} />
+            </>
+          ) : (
+            <p className="text-center text-red-600">
+              {currentReceipt.file.name}: {currentError}
+            </p>
+          )}
         </div>
       </div>
     </div>
@@ -11,12 +11,77 @@ interface FileData {
   name: string;
   type: string;
   size: number;
+  hash?: string;
 }
 
 type PresignedUrlResponse =
   | { file_urls: { [name: string]: string } }
   | { error: string };
 
+// Larger files are uploaded in parts, the single presigned PUT is capped at
+// MAX_FILE_SIZE in Backend/accept-files-dev.py
+const MULTIPART_THRESHOLD = 10 * 1024 * 1024 // 10MB
+
+// Result encodings this client can decode, see Backend/wire_encoding.py
+const ACCEPTED_ENCODINGS = typeof DecompressionStream !== 'undefined' ? ['gzip'] : []
+
+// Survives websocket reconnects and page reloads within the tab, so results
+// that arrived while disconnected can be replayed
+const getSessionId = () => {
+  let sessionId = sessionStorage.getItem('receiptSessionId')
+  if (!sessionId) {
+    sessionId = crypto.randomUUID()
+    sessionStorage.setItem('receiptSessionId', sessionId)
+  }
+  return sessionId
+}
+
+// SHA-256 of the file contents, lets the backend answer files it already
+// processed from its result cache. Needs a secure context for crypto.subtle.
+const hashFile = async (file: File) => {
+  if (!crypto.subtle) {
+    return undefined
+  }
+  try {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+    return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('')
+  } catch (error) {
+    // the file is uploaded and processed as usual without a hash
+    console.error(`Could not hash ${file.name}:`, error)
+    return undefined
+  }
+}
+
+// payloads of chunked messages by messageId, until every chunk has arrived
+const pendingChunks = new Map<string, string[]>()
+
+const decodePayload = async (payload: string, encoding: string) => {
+  if (encoding === 'gzip') {
+    const bytes = Uint8Array.from(atob(payload), char => char.charCodeAt(0))
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'))
+    return JSON.parse(await new Response(stream).text())
+  }
+  return JSON.parse(payload)
+}
+
+// Returns the decoded message, or null while chunks of it are still missing
+const decodeMessage = async (data: any) => {
+  if (data.type === 'chunk') {
+    const parts = pendingChunks.get(data.messageId) ?? new Array(data.total)
+    parts[data.seq] = data.payload
+    pendingChunks.set(data.messageId, parts)
+    if (parts.filter(part => part !== undefined).length < data.total) {
+      return null
+    }
+    pendingChunks.delete(data.messageId)
+    return decodePayload(parts.join(''), data.encoding)
+  }
+  if (data.encoding && data.payload) {
+    return decodePayload(data.payload, data.encoding)
+  }
+  return data
+}
+
 
 const LandingPage: React.FC = () => {
   const [currentStep, setCurrentStep] = useState(0);
@@ -24,6 +89,8 @@ const LandingPage: React.FC = () => {
   const [isUploading, setIsUploading] = useState(false);
   const [extractedData, setExtractedData] = useState<ExtractedData[]>([]);
   const [showResults, setShowResults] = useState(false);
+  // error message by fileId, for receipts the backend could not extract
+  const [fileErrors, setFileErrors] = useState<{ [fileId: string]: string }>({});
 
   const socketRef = useRef<WebSocket>(null)
   const receiptsRef = useRef<Receipt[]>([])
@@ -42,6 +109,12 @@ const LandingPage: React.FC = () => {
 
     socketRef.current.onopen = () => {
       console.log("WebSocket Connected");
+      // pull any results of this session that were sent while we were disconnected
+      socketRef.current?.send(JSON.stringify({
+        action: 'replayResults',
+        sessionId: getSessionId(),
+        encodings: ACCEPTED_ENCODINGS,
+      }))
     };
 
 
@@ -57,21 +130,25 @@ const LandingPage: React.FC = () => {
           setIsUploading(false);
           return;
         }
-      const data = JSON.parse(response.data);
+      const data = await decodeMessage(JSON.parse(response.data));
+      if (!data) {
+        return;
+      }
 
       // check event action
       if (data.type === 'presignedUrls') {
-        await uploadToS3(data.file_urls, data.connectionId)
+        // files rejected by the backend get no upload url, so they are answered here
+        Object.entries(data.errors ?? {}).forEach(([fileId, message]) => handleExtractionError(fileId, message as string))
+        // files the backend already processed are answered without an upload
+        Object.entries(data.cached_results ?? {}).forEach(([fileId, body]) => handleResult(body, fileId))
+        await uploadToS3(data.file_urls, data.connectionId, data.encoding, data.sessionId)
+      } else if (data.type === 'multipartUpload') {
+        await handleMultipartUpload(data)
+      } else if (data.type === 'extractText' && data.results) {
+        // results of several files finishing together arrive in one message
+        data.results.forEach((result: { fileId: string, body: any }) => handleResult(result.body, result.fileId))
       } else if (data.type === 'extractText') {
-        console.log(data.body.data)
-        console.log('aadfasd')
-        handleExtractedText(data.body.data, data.fileId)
-        console.log('mmmmd')
-        // const mockData = generateMockData()
-        // setExtractedData(mockData);
-        // setCurrentStep(3); // Move to "Instant Results"
-        // setShowResults(true); // Switch to results page
-        // setIsUploading(false);
+        handleResult(data.body, data.fileId)
       }
 
     } 
@@ -86,17 +163,21 @@ const LandingPage: React.FC = () => {
 
 
     // Construct request body
-    const fileList: FileData[] = receipts.map(receipt => ({
+    const fileList: FileData[] = await Promise.all(receipts.map(async receipt => ({
       id: receipt.id,
       name: receipt.file.name,
       type: receipt.file.type,
       size: receipt.file.size,
-    }));
+      hash: await hashFile(receipt.file),
+    })));
 
     const requestPayload = {
       action: 'getPresignedUrl',
-      files: fileList,
+      encodings: ACCEPTED_ENCODINGS,
+      sessionId: getSessionId(),
+      files: fileList.filter(file => file.size <= MULTIPART_THRESHOLD),
     };
+    const multipartFiles = fileList.filter(file => file.size > MULTIPART_THRESHOLD)
 
     try {
       // verify socket open
@@ -104,7 +185,18 @@ const LandingPage: React.FC = () => {
         console.error("Socket is not connected.");
         return;
       }
-      socketRef.current.send(JSON.stringify(requestPayload))
+      if (requestPayload.files.length > 0) {
+        socketRef.current.send(JSON.stringify(requestPayload))
+      }
+      // every large file gets its own upload, see Backend/multipart_upload.py
+      multipartFiles.forEach(file => socketRef.current?.send(JSON.stringify({
+        action: 'createMultipartUpload',
+        encodings: ACCEPTED_ENCODINGS,
+        sessionId: getSessionId(),
+        // echoed back with errors, which carry no file otherwise
+        fileId: file.id,
+        file,
+      })))
       console.log("Sent request")
 
 
@@ -114,14 +206,11 @@ const LandingPage: React.FC = () => {
     }
   };
 
-  const uploadToS3 = async (presignedUrls: { [name: string]: string }, connectionId: string) => {
-    const currentReceipts = receiptsRef.current
+  const uploadToS3 = async (presignedUrls: { [name: string]: string }, connectionId: string, encoding?: string, sessionId?: string) => {
+    // urls arrive in chunks, so only the receipts named in this chunk are uploaded
+    const currentReceipts = receiptsRef.current.filter(receipt => receipt.file.name in presignedUrls)
     const uploadPromises = currentReceipts.map(async (receipt) => {
       const presignedUrl = presignedUrls[receipt.file.name];
-      if (!presignedUrl) {
-        console.error(`No presigned URL for ${receipt.file.name}`);
-        return;
-      }
       try {
         const response = await fetch(presignedUrl, {
           method: 'PUT',
@@ -129,6 +218,9 @@ const LandingPage: React.FC = () => {
             'Content-Type': receipt.file.type,
             'x-amz-meta-connectionId': connectionId,
             'x-amz-meta-fileId': receipt.id,
+            // signed into the url when an encoding other than json was negotiated
+            ...(encoding && encoding !== 'json' ? { 'x-amz-meta-encoding': encoding } : {}),
+            ...(sessionId ? { 'x-amz-meta-sessionid': sessionId } : {}),
 
           },
           body: receipt.file,
@@ -148,6 +240,85 @@ const LandingPage: React.FC = () => {
   };
 
 
+  const handleMultipartUpload = async (data: any) => {
+    if (data.error) {
+      // a failed abort leaves nothing to report, the lifecycle rule cleans up the parts
+      if (data.action !== 'abortMultipartUpload') {
+        handleExtractionError(data.fileId, data.error)
+      }
+      return
+    }
+    if (data.action !== 'createMultipartUpload') {
+      // once completed, the result arrives as extractText like any other upload
+      return
+    }
+    if (data.cached_result) {
+      handleResult(data.cached_result, data.fileId)
+      return
+    }
+
+    // later steps must present the uploadToken of the session that created the upload
+    const send = (action: string, fields: object = {}) => socketRef.current?.send(JSON.stringify({
+      action,
+      sessionId: getSessionId(),
+      fileId: data.fileId,
+      key: data.key,
+      uploadId: data.uploadId,
+      uploadToken: data.uploadToken,
+      ...fields,
+    }))
+    const receipt = receiptsRef.current.find(receipt => receipt.id === data.fileId)
+    if (!receipt) {
+      send('abortMultipartUpload')
+      return
+    }
+
+    try {
+      await Promise.all(Object.entries(data.partUrls as { [partNumber: string]: string }).map(async ([partNumber, url]) => {
+        const start = (Number(partNumber) - 1) * data.partSize
+        const response = await fetch(url, { method: 'PUT', body: receipt.file.slice(start, start + data.partSize) })
+        if (!response.ok) {
+          throw new Error(`Upload of part ${partNumber} failed for ${receipt.file.name}`)
+        }
+      }))
+      // the backend lists the uploaded parts, so the ETag header need not be exposed to the page
+      send('completeMultipartUpload', { partCount: data.partCount })
+      console.log(`Successfully uploaded ${receipt.file.name}`)
+    } catch (error) {
+      console.error(`Error uploading ${receipt.file.name}:`, error)
+      send('abortMultipartUpload')
+      handleExtractionError(data.fileId, 'Upload failed, please try again.')
+    }
+  }
+
+  // A failed receipt only marks its own file, the others of a batch still show
+  const handleResult = (body: any, fileId: string) => {
+    if (body?.statusCode !== 200 || !body.data?.['0']) {
+      handleExtractionError(fileId, body?.error?.message ?? 'Could not extract data from this receipt.')
+      return
+    }
+    try {
+      handleExtractedText(body.data, fileId)
+    } catch (error) {
+      console.error(`Error handling result for fileId ${fileId}:`, error)
+      handleExtractionError(fileId, 'Could not read the extracted data of this receipt.')
+    }
+  }
+
+  const handleExtractionError = (fileId: string, message: string) => {
+    // replayed or stale failures of receipts no longer on the page are ignored
+    const receiptExists = receiptsRef.current.some(receipt => receipt.id === fileId)
+    if (!receiptExists) {
+      console.error(`No receipt found with fileId: ${fileId}`)
+      return
+    }
+    console.error(`Extraction failed for fileId ${fileId}: ${message}`)
+    setFileErrors(prevErrors => ({ ...prevErrors, [fileId]: message }))
+    setCurrentStep(3);
+    setShowResults(true);
+    setIsUploading(false);
+  }
+
   const handleExtractedText = (textBody: Array<any>, fileId: string) => {
     console.log('In handle extract')
     console.log("HALLO", textBody)
@@ -199,7 +370,7 @@ const LandingPage: React.FC = () => {
 
     try {
       // Step 1: Generate presigned URLs
-      generatePresignedUrls();
+      await generatePresignedUrls();
       // setTimeout(() => {
       //   const mockData = generateMockData();
       //   setExtractedData(mockData);
@@ -221,6 +392,7 @@ const LandingPage: React.FC = () => {
     // Optionally clear receipts and data
     setReceipts([]);
     setExtractedData([]);
+    setFileErrors({});
   };
 
   return (
@@ -244,6 +416,7 @@ const LandingPage: React.FC = () => {
           <ResultsSection
             receipts={receipts}
             extractedData={extractedData}
+            fileErrors={fileErrors}
             onBackToUpload={handleBackToUpload}
           />
         </>